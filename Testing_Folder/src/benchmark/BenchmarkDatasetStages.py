@@ -0,0 +1,204 @@
+"""Measures how fast FireSpreadDataset serves training samples, in total and per stage of __getitem__.
+
+For each data config (e.g. the mono- and multitemporal data YAMLs) and storage format, the training dataset of
+FireSpreadDataModule is built, and two measurements are made:
+
+1. Stage breakdown, in the main process: The stages of __getitem__ are wrapped with timers, and random samples are loaded
+   one by one. Stages are timed inclusively, i.e. preprocess_and_augment contains augment and expand_features (standardization
+   and one-hot expansion), and select_features contains flatten_and_remove_duplicate_features_. Bytes read are taken from
+   /proc/self/io (Linux only), which counts all bytes read from files, including those served from the page cache, but not
+   those accessed through memory maps.
+2. DataLoader throughput, for each number of workers: samples per second and the latency percentiles of each batch.
+
+Results are written as JSON, so that runs before and after a data pipeline change can be compared.
+
+Example:
+    python src/benchmark/BenchmarkDatasetStages.py --configs cfgs/data_monotemporal_full_features.yaml \\
+        "cfgs/data_multitemporal_full_features copy.yaml" --tif_dir data/tif --hdf5_dir data/hdf5 \\
+        --worker_counts 1 4 8 --output stages.json
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.FireSpreadDataModule import FireSpreadDataModule
+import argparse
+import functools
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import yaml
+from torch.utils.data import DataLoader
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+# Methods of FireSpreadDataset that are timed, in the order in which __getitem__ reaches them
+STAGES = ["find_image_index_from_dataset_index", "load_imgs", "preprocess_and_augment", "augment",
+          "expand_features", "select_features", "flatten_and_remove_duplicate_features_"]
+
+
+def read_io_bytes():
+    """_summary_ Returns the number of bytes the current process has read from files so far, or None if unknown.
+    """
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def summarize(times) -> dict:
+    """_summary_ Summarizes latencies in seconds as milliseconds.
+    """
+    times_ms = np.asarray(times) * 1000
+    if len(times_ms) == 0:
+        return {"count": 0}
+    return {"count": len(times_ms), "mean_ms": float(times_ms.mean()),
+            **{f"p{q}_ms": float(np.percentile(times_ms, q)) for q in [50, 90, 99]}}
+
+
+def instrument(dataset, stage_times):
+    """_summary_ Shadows the stage methods of dataset with timed versions, which record their durations of the current
+    sample in stage_times. Since the methods call each other through self, nested stages are timed as well.
+    """
+    for stage in STAGES:
+        method = getattr(dataset, stage)
+
+        @functools.wraps(method)
+        def timed(*args, method=method, stage=stage, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stage_times[stage] += time.perf_counter() - start_time
+
+        setattr(dataset, stage, timed)
+
+
+def benchmark_stages(dataset, n_samples: int, seed: int) -> dict:
+    """_summary_ Loads n_samples random samples in the main process, and times each stage.
+    """
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(dataset), size=n_samples)
+    np.random.seed(seed)
+
+    stage_times = defaultdict(float)
+    instrument(dataset, stage_times)
+    per_stage = defaultdict(list)
+    totals, io_bytes = [], []
+    for index in indices:
+        stage_times.clear()
+        io_start = read_io_bytes()
+        start_time = time.perf_counter()
+        dataset[int(index)]
+        totals.append(time.perf_counter() - start_time)
+        io_end = read_io_bytes()
+        if io_start is not None and io_end is not None:
+            io_bytes.append(io_end - io_start)
+        for stage in STAGES:
+            if stage in stage_times:
+                per_stage[stage].append(stage_times[stage])
+
+    return {"samples_per_second": n_samples / sum(totals), "getitem": summarize(totals),
+            "stages": {stage: summarize(per_stage[stage]) for stage in STAGES},
+            "bytes_read_per_sample": float(np.mean(io_bytes)) if io_bytes else None}
+
+
+def benchmark_workers(data_module: FireSpreadDataModule, num_workers: int, n_batches: int) -> dict:
+    """_summary_ Times n_batches batches of a shuffled DataLoader over the training set, after a first batch that
+    includes the worker startup.
+    """
+    loader = DataLoader(data_module.train_dataset, batch_size=data_module.batch_size, shuffle=True,
+                        **data_module.get_dataloader_kwargs("train", num_workers=num_workers))
+    start_time = time.perf_counter()
+    iterator = iter(loader)
+    next(iterator)
+    startup_time = time.perf_counter() - start_time
+
+    batch_times = []
+    n_samples = 0
+    for _ in range(n_batches):
+        start_time = time.perf_counter()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            iterator = iter(loader)
+            batch = next(iterator)
+        batch_times.append(time.perf_counter() - start_time)
+        n_samples += len(batch[0])
+    del iterator, loader
+
+    return {"num_workers": num_workers, "startup_time": startup_time, "samples_per_second": n_samples / sum(batch_times),
+            "batch_latency": summarize(batch_times)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs", type=str, nargs="+",
+                        default=["cfgs/data_monotemporal_full_features.yaml", "cfgs/data_multitemporal_full_features copy.yaml"],
+                        help="Data YAMLs with the arguments of FireSpreadDataModule")
+    parser.add_argument("--tif_dir", type=str, default=None,
+                        help="Dataset directory with TIF files. If neither --tif_dir nor --hdf5_dir is given, data_dir and load_from_hdf5 of each config are used.")
+    parser.add_argument("--hdf5_dir", type=str, default=None,
+                        help="Dataset directory with HDF5 files, as created by CreateHDF5Dataset.py")
+    parser.add_argument("--n_samples", type=int, default=200,
+                        help="Number of random samples for the stage breakdown")
+    parser.add_argument("--worker_counts", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Numbers of DataLoader workers to measure throughput for")
+    parser.add_argument("--n_batches", type=int, default=20,
+                        help="Number of batches to time per number of workers, after the first batch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="dataset_stages.json",
+                        help="Path of the JSON file to write the results to")
+    args = parser.parse_args()
+
+    data_sources = []
+    if args.tif_dir is not None:
+        data_sources.append(("tif", {"data_dir": args.tif_dir, "load_from_hdf5": False, "load_from_memmap": False}))
+    if args.hdf5_dir is not None:
+        data_sources.append(("hdf5", {"data_dir": args.hdf5_dir, "load_from_hdf5": True, "load_from_memmap": False}))
+    if not data_sources:
+        data_sources.append(("config", {}))
+
+    runs = []
+    for config_path in args.configs:
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f)
+        for data_source, overrides in data_sources:
+            run_config = {**config, **overrides}
+            data_module = FireSpreadDataModule(**run_config)
+            data_module.setup("fit")
+            data_format = data_module.train_dataset.data_format
+            print(f"\n{Path(config_path).name}, {data_format}: {len(data_module.train_dataset)} training samples")
+
+            workers = [benchmark_workers(data_module, num_workers, args.n_batches) for num_workers in args.worker_counts]
+            # Instrumenting the dataset modifies it, so the stage breakdown comes last
+            stages = benchmark_stages(data_module.train_dataset, args.n_samples, args.seed)
+
+            for stage in ["getitem"] + STAGES:
+                summary = stages["getitem"] if stage == "getitem" else stages["stages"][stage]
+                if summary["count"] > 0:
+                    print(f"{stage:>40}: mean {summary['mean_ms']:8.2f} ms, p50 {summary['p50_ms']:8.2f} ms, "
+                          f"p99 {summary['p99_ms']:8.2f} ms")
+            if stages["bytes_read_per_sample"] is not None:
+                print(f"{'bytes read per sample':>40}: {stages['bytes_read_per_sample'] / 1e6:.2f} MB")
+            for result in workers:
+                print(f"{result['num_workers']:>3} workers: {result['samples_per_second']:8.1f} samples/s, "
+                      f"batch p50 {result['batch_latency']['p50_ms']:8.2f} ms, p99 {result['batch_latency']['p99_ms']:8.2f} ms")
+
+            runs.append({"config": config_path, "data_format": data_format, "settings": run_config,
+                         "n_train_samples": len(data_module.train_dataset), "stages": stages, "workers": workers})
+
+    with open(args.output, "w") as f:
+        json.dump({"args": vars(args), "runs": runs}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
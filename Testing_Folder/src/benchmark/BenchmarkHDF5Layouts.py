@@ -0,0 +1,158 @@
+"""Compares the read throughput of different HDF5 layouts (chunking and compression) on the same fires.
+
+The selected fires of an existing HDF5 dataset (as created by CreateHDF5Dataset.py) are rewritten once per layout.
+Afterwards, random windows of n_leading_observations + 1 days are read from each layout, which is the access pattern
+of FireSpreadDataset.load_imgs, including dequantization of quantized layouts. Note that the files are likely in the page cache after writing them, so the reported
+times are optimistic for cold reads, while the bytes read per sample are exact.
+
+Example:
+    python src/benchmark/BenchmarkHDF5Layouts.py --data_dir data/ --target_dir /tmp/layouts \\
+        --layouts none:none day:none day:lzf tile:gzip:1 day:blosc-lz4 none:none:::int16 --output layouts.json
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.quantization import dequantize_imgs, get_quantization_params
+from src.preprocess.hdf5_utils import write_fire_hdf5
+import argparse
+import glob
+import json
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+
+def parse_layout(layout: str):
+    """_summary_ Parses a layout string of the form chunk_layout:compression[:compression_level][:tile_size][:quantization].
+    Optional fields can be left empty to use their defaults, e.g. day:lzf:::int16.
+    """
+    parts = layout.split(":")
+    if len(parts) < 2:
+        raise ValueError(f"Layout {layout} must have the form chunk_layout:compression[:compression_level][:tile_size][:quantization].")
+    chunk_layout, compression = parts[:2]
+    compression_level = int(parts[2]) if len(parts) > 2 and parts[2] != "" else None
+    tile_size = int(parts[3]) if len(parts) > 3 and parts[3] != "" else 64
+    quantization = parts[4] if len(parts) > 4 and parts[4] != "" else "none"
+    return dict(chunk_layout=chunk_layout, compression=compression,
+                compression_level=compression_level, tile_size=tile_size, quantization=quantization)
+
+
+def read_window(dset: h5py.Dataset, start: int, end: int) -> np.ndarray:
+    """_summary_ Reads days [start, end) as float32, dequantizing them if necessary.
+    """
+    imgs = dset[start:end]
+    quantization_params = get_quantization_params(dset)
+    if quantization_params is not None:
+        imgs = dequantize_imgs(imgs, *quantization_params)
+    return imgs
+
+
+def bytes_read_for_window(dset: h5py.Dataset, start: int, end: int) -> int:
+    """_summary_ Computes how many stored (i.e. possibly compressed) bytes have to be read to get days [start, end).
+    """
+    if dset.chunks is None:
+        return int(dset.dtype.itemsize * np.prod(dset.shape[1:]) * (end - start))
+
+    n_bytes = 0
+    for i in range(dset.id.get_num_chunks()):
+        chunk_info = dset.id.get_chunk_info(i)
+        chunk_start = chunk_info.chunk_offset[0]
+        if chunk_start < end and chunk_start + dset.chunks[0] > start:
+            n_bytes += chunk_info.size
+    return n_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, required=True,
+                        help="Path to an existing HDF5 dataset directory")
+    parser.add_argument("--target_dir", type=str, required=True,
+                        help="Scratch directory for the rewritten fires")
+    parser.add_argument("--years", type=int, nargs="+", default=[2018])
+    parser.add_argument("--n_fires", type=int, default=10,
+                        help="Number of fires per year to include")
+    parser.add_argument("--n_leading_observations", type=int, default=5)
+    parser.add_argument("--n_samples", type=int, default=500,
+                        help="Number of random windows to read per layout")
+    parser.add_argument("--layouts", type=str, nargs="+",
+                        default=["none:none", "day:none", "day:lzf", "day:gzip:1", "tile:lzf"],
+                        help="Layouts of the form chunk_layout:compression[:compression_level][:tile_size][:quantization]")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Optional path of a JSON file to write the report to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    source_files = []
+    for year in args.years:
+        fires_in_year = sorted(glob.glob(f"{args.data_dir}/{year}/*.hdf5"))
+        source_files += [(year, p) for p in fires_in_year[:args.n_fires]]
+    if not source_files:
+        raise FileNotFoundError(f"No HDF5 files found in {args.data_dir} for years {args.years}.")
+
+    window = args.n_leading_observations + 1
+    report = []
+    for layout in args.layouts:
+        layout_kwargs = parse_layout(layout)
+        layout_dir = Path(args.target_dir) / layout.replace(":", "_")
+
+        # Rewrite the fires in this layout
+        paths = []
+        for year, source_path in source_files:
+            target_path = layout_dir / str(year) / Path(source_path).name
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            with h5py.File(source_path, "r") as f:
+                dset = f["data"]
+                write_fire_hdf5(str(target_path), dset.attrs["year"], dset.attrs["fire_name"], dset.attrs["img_dates"],
+                                dset.attrs["lnglat"], read_window(dset, 0, len(dset)), **layout_kwargs)
+            paths.append(str(target_path))
+
+        # Read random windows, as FireSpreadDataset.load_imgs does
+        rng = np.random.default_rng(args.seed)
+        handles = [h5py.File(p, "r") for p in paths]
+        candidates = [(h, start) for h in handles for start in range(max(len(h["data"]) - window + 1, 0))]
+        if not candidates:
+            raise ValueError(f"No fire contains {window} days, reduce --n_leading_observations.")
+        sample_ids = rng.integers(0, len(candidates), size=args.n_samples)
+
+        latencies = []
+        bytes_read = 0
+        raw_bytes = 0
+        for sample_id in sample_ids:
+            h, start = candidates[sample_id]
+            dset = h["data"]
+            t0 = time.perf_counter()
+            imgs = read_window(dset, start, start + window)
+            latencies.append(time.perf_counter() - t0)
+            bytes_read += bytes_read_for_window(dset, start, start + window)
+            raw_bytes += dset.dtype.itemsize * imgs.size
+        for h in handles:
+            h.close()
+
+        latencies = np.array(latencies)
+        result = {
+            "layout": layout,
+            **layout_kwargs,
+            "size_on_disk_mb": sum(os.path.getsize(p) for p in paths) / 2**20,
+            "samples_per_sec": len(latencies) / latencies.sum(),
+            "latency_ms_p50": float(np.percentile(latencies, 50) * 1e3),
+            "latency_ms_p95": float(np.percentile(latencies, 95) * 1e3),
+            "mb_read_per_sample": bytes_read / len(latencies) / 2**20,
+            "mb_decoded_per_sample": raw_bytes / len(latencies) / 2**20,
+        }
+        report.append(result)
+        print(f"{layout:>20}: {result['samples_per_sec']:8.1f} samples/s, p50 {result['latency_ms_p50']:7.2f} ms, "
+              f"{result['mb_read_per_sample']:7.2f} MB read/sample, {result['size_on_disk_mb']:8.1f} MB on disk")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
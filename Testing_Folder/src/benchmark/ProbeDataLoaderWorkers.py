@@ -0,0 +1,104 @@
+"""Measures the throughput of the training (or validation) dataloader of FireSpreadDataModule for different numbers of
+workers, and recommends the smallest number of workers that reaches close to the best throughput.
+
+The data module is configured from the same data YAML that is used for training, so that all other settings (storage
+format, crop size, caches, worker runtime policy) match the training run. For each number of workers, the time until
+the first batch (worker startup) is reported separately from the steady-state throughput of the following batches.
+Only data loading is measured, so the recommendation is an upper bound for training, where the model competes for the CPU.
+
+Example:
+    python src/benchmark/ProbeDataLoaderWorkers.py --config cfgs/data_monotemporal_full_features.yaml \\
+        --worker_counts 0 2 4 8 16 --n_batches 50 --output workers.json
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.FireSpreadDataModule import FireSpreadDataModule
+import argparse
+import json
+import time
+
+import yaml
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+
+def probe(data_module: FireSpreadDataModule, split: str, n_batches: int) -> dict:
+    """_summary_ Iterates over n_batches batches of the given split, after a first batch that includes the worker startup.
+    """
+    loader = data_module.train_dataloader() if split == "train" else data_module.val_dataloader()
+    start_time = time.perf_counter()
+    iterator = iter(loader)
+    batch = next(iterator)
+    startup_time = time.perf_counter() - start_time
+
+    n_samples = 0
+    start_time = time.perf_counter()
+    for _ in range(n_batches):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            iterator = iter(loader)
+            batch = next(iterator)
+        n_samples += len(batch[0])
+    elapsed = time.perf_counter() - start_time
+    # Shut down the workers before the next configuration starts its own
+    del iterator, loader
+
+    return {"startup_time": startup_time, "elapsed": elapsed, "n_samples": n_samples,
+            "samples_per_second": n_samples / elapsed, "batches_per_second": n_batches / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True,
+                        help="Data YAML with the arguments of FireSpreadDataModule, e.g. cfgs/data_monotemporal_full_features.yaml")
+    parser.add_argument("--data_dir", type=str, default=None,
+                        help="Overrides data_dir of the config")
+    parser.add_argument("--worker_counts", type=int, nargs="+", default=None,
+                        help="Numbers of workers to measure. Defaults to 0 and powers of two up to the number of available CPUs.")
+    parser.add_argument("--split", type=str, choices=["train", "val"], default="train",
+                        help="Dataloader to measure")
+    parser.add_argument("--n_batches", type=int, default=50,
+                        help="Number of batches to time per number of workers, after the first batch")
+    parser.add_argument("--tolerance", type=float, default=0.95,
+                        help="Recommend the fewest workers that reach this fraction of the best throughput")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Optional path of a JSON file to write the results to")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    if args.data_dir is not None:
+        config["data_dir"] = args.data_dir
+
+    n_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    worker_counts = args.worker_counts
+    if worker_counts is None:
+        worker_counts = [0] + [2**i for i in range(n_cpus.bit_length()) if 2**i <= n_cpus]
+
+    results = []
+    for num_workers in worker_counts:
+        data_module = FireSpreadDataModule(**{**config, "num_workers": num_workers})
+        data_module.setup("fit")
+        result = {"num_workers": num_workers, **probe(data_module, args.split, args.n_batches)}
+        results.append(result)
+        print(f"{num_workers:>3} workers: {result['samples_per_second']:8.1f} samples/s, "
+              f"{result['batches_per_second']:6.2f} batches/s, startup {result['startup_time']:.2f}s")
+
+    best = max(result["samples_per_second"] for result in results)
+    recommended = min(result["num_workers"] for result in results
+                      if result["samples_per_second"] >= args.tolerance * best)
+    print(f"\nRecommended num_workers: {recommended} (reaches {args.tolerance:.0%} of the best throughput of "
+          f"{best:.1f} samples/s on {n_cpus} available CPUs)")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "split": args.split, "n_cpus": n_cpus, "results": results,
+                       "recommended_num_workers": recommended}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
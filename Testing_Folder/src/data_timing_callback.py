@@ -0,0 +1,37 @@
+import time
+
+from pytorch_lightning.callbacks import Callback
+
+
+class DataTimingCallback(Callback):
+    """_summary_ Logs how long each training step waited for its batch (data stall), and the per-stage timings of
+    loading the batch, which FireSpreadDataModule collects if log_stage_timings is True. Does nothing otherwise.
+    """
+
+    def __init__(self):
+        self.last_batch_end = None
+        self.stall_time = None
+
+    def is_enabled(self, trainer):
+        return getattr(trainer.datamodule, "log_stage_timings", False)
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        # The first batch of an epoch also waits for the workers to start, which is not counted as a stall
+        self.last_batch_end = None
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        if self.is_enabled(trainer) and self.last_batch_end is not None:
+            # Time between the end of the previous step and the start of this one, i.e. waiting for and transferring the batch
+            self.stall_time = time.perf_counter() - self.last_batch_end
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if not self.is_enabled(trainer):
+            return
+
+        metrics = trainer.datamodule.pop_stage_timings() or {}
+        if self.stall_time is not None:
+            metrics["data/stall_ms"] = 1000 * self.stall_time
+            self.stall_time = None
+        for name, value in metrics.items():
+            pl_module.log(name, value, on_step=True, on_epoch=True, logger=True, batch_size=len(batch[0]))
+        self.last_batch_end = time.perf_counter()
@@ -1,11 +1,20 @@
+from functools import partial
 from pathlib import Path
 
 import numpy as np
+import torch
 from pytorch_lightning import LightningDataModule
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, RandomSampler
 import glob
 from .FireSpreadDataset import FireSpreadDataset
-from typing import List, Optional, Union
+from .fire_catalog import FireCatalog
+from .samplers import FireLocalitySampler, SizeBucketBatchSampler
+from .prefetch import SharedOrderSampler
+from .materialized_dataset import materialize_dataset
+from .worker_runtime import get_dataloader_kwargs
+from .stage_timer import reduce_stage_timings
+from .utils import pad_collate
+from typing import Dict, List, Optional, Union
 
 
 class FireSpreadDataModule(LightningDataModule):
@@ -14,12 +23,20 @@ class FireSpreadDataModule(LightningDataModule):
                  crop_side_length: int,
                  load_from_hdf5: bool, num_workers: int, remove_duplicate_features: bool,
                  features_to_keep: Union[Optional[List[int]], str] = None, return_doy: bool = False,
-                 data_fold_id: int = 0, *args, **kwargs):
+                 data_fold_id: int = 0, hdf5_max_open_files: int = 64, compact_batches: bool = False,
+                 load_from_memmap: bool = False, use_inventory_cache: bool = True,
+                 n_crop_candidates: Optional[int] = 10, landcover_as_index: bool = False,
+                 sampler_block_size: Optional[int] = None, day_cache_size: int = 0, test_batch_size: int = 1,
+                 prefetch_depth: int = 0, prefetch_threads: int = 2, resident_memory_budget_gb: Optional[float] = None,
+                 use_crop_index: bool = True, val_crop_seed: Optional[int] = None, val_cache: Optional[str] = None,
+                 persistent_workers: bool = False, prefetch_factor: Optional[Dict[str, int]] = None, pin_memory: bool = True,
+                 worker_threads: Optional[int] = None, pin_worker_cpus: bool = False,
+                 log_stage_timings: bool = False, *args, **kwargs):
         """_summary_ Data module for loading the WildfireSpreadTS dataset.
 
         Args:
             data_dir (str): _description_ Path to the directory containing the data.
-            batch_size (int): _description_ Batch size for training and validation set. Test set uses batch size 1, because images of different sizes can not be batched together.
+            batch_size (int): _description_ Batch size for training and validation set. The test set uses test_batch_size.
             n_leading_observations (int): _description_ Number of days to use as input observation. 
             n_leading_observations_test_adjustment (int): _description_ When increasing the number of leading observations, the number of samples per fire is reduced.
               This parameter allows to adjust the number of samples in the test set to be the same across several different values of n_leading_observations, 
@@ -33,11 +50,84 @@ class FireSpreadDataModule(LightningDataModule):
             features_to_keep (Union[Optional[List[int]], str], optional): _description_. List of feature indices from 0 to 39, indicating which features to keep. Defaults to None, which means using all features.
             return_doy (bool, optional): _description_. Return the day of the year per time step, as an additional feature. Defaults to False.
             data_fold_id (int, optional): _description_. Which data fold to use, i.e. splitting years into train/val/test set. Defaults to 0.
+            hdf5_max_open_files (int, optional): _description_. Maximum number of HDF5 files each dataloader worker keeps open. Defaults to 64.
+            compact_batches (bool, optional): _description_. If True, dataloader workers return compact float16/uint8 samples, and standardization, 
+              sin-transformation, binary active fire mask and one-hot encoding are applied to the whole batch after it has been moved to the device. Defaults to False.
+            load_from_memmap (bool, optional): _description_. If True, load data from flat binary files per year via np.memmap instead of TIF or HDF5. 
+              Requires load_from_hdf5 to be False. Defaults to False.
+            use_inventory_cache (bool, optional): _description_. Persist the inventory of fires and files in a manifest in data_dir, 
+              which makes creating the datasets fast as long as the data doesn't change. Defaults to True.
+            n_crop_candidates (Optional[int], optional): _description_. Number of random crop positions scored per training sample, 
+              to prefer crops containing fire pixels. If None, all crop positions are scored. Defaults to 10.
+            landcover_as_index (bool, optional): _description_. If True, land cover is returned as a single class index channel instead of 
+              17 one-hot channels, and embedded by the model on the device. train.py passes the position of these channels to the model. Defaults to False.
+            sampler_block_size (Optional[int], optional): _description_. If set, the training set is shuffled in blocks of this many consecutive 
+              windows of the same fire, see FireLocalitySampler. Should divide the batch size. Defaults to None, which shuffles all samples independently.
+            day_cache_size (int, optional): _description_. Number of decoded fire-days each dataloader worker keeps in memory, so that 
+              days shared by neighbouring windows are only read once. Should be at least sampler_block_size + n_leading_observations. 
+              Defaults to 0, which disables the cache.
+            test_batch_size (int, optional): _description_. Batch size for the test set. Test images have different sizes, so batches are 
+              formed from images of the same size where possible, and the remaining images are padded, see SizeBucketBatchSampler. 
+              Padded pixels are ignored by BaseModel.test_step. Defaults to 1, which evaluates one image at a time without padding.
+            prefetch_depth (int, optional): _description_. Number of upcoming training samples that each dataloader worker reads in background 
+              threads, while it preprocesses the current one. Defaults to 0, which disables prefetching.
+            prefetch_threads (int, optional): _description_. Number of background reader threads per dataloader worker. Defaults to 2.
+            resident_memory_budget_gb (Optional[float], optional): _description_. If set, the training years are read once in the main process 
+              into shared memory, which all dataloader workers read from without any disk I/O, see FireSpreadDataset.make_resident. 
+              If the training data takes more than this many GB, or more than the free shared memory, it is read from disk instead. 
+              The budget covers all years kept resident by the catalog, which may be shared with the data modules of other folds. 
+              Defaults to None, which always reads from disk.
+            use_crop_index (bool, optional): _description_. If True, training and validation crops are chosen from the crop index of HDF5 files 
+              before reading, and only the crop window is read, see FireSpreadDataset. Defaults to True.
+            val_crop_seed (Optional[int], optional): _description_. If set, the crops and flips of the validation set are drawn per sample from 
+              this seed, so they are the same in every epoch and every run, see crop_seed in FireSpreadDataset. Defaults to None, which draws 
+              new crops every epoch.
+            val_cache (Optional[str], optional): _description_. Requires val_crop_seed. If "memory", the fully preprocessed validation samples are 
+              computed once, when the validation dataloader is first requested, and later validation epochs only index tensors. 
+              Any other value is used as a directory, in which the samples are additionally stored and reused by later runs with the 
+              same data and settings. Defaults to None, which preprocesses the validation set in every epoch.
+            persistent_workers (bool, optional): _description_. Keep the dataloader workers alive between epochs, instead of starting them 
+              again for every epoch, which also keeps their open files and caches. Defaults to False.
+            prefetch_factor (Optional[Dict[str, int]], optional): _description_. Number of batches each worker loads in advance, per split, 
+              e.g. {"train": 4, "val": 2}. Splits that are not listed use the DataLoader's default of 2. Defaults to None.
+            pin_memory (bool, optional): _description_. Return batches in pinned memory, for faster transfer to the GPU. Defaults to True.
+            worker_threads (Optional[int], optional): _description_. Maximum number of intra-op threads of torch, BLAS and OpenMP in each 
+              dataloader worker, to avoid oversubscribing the CPU. Defaults to None, which keeps the libraries' defaults.
+            pin_worker_cpus (bool, optional): _description_. Pin each dataloader worker to its own share of the available CPUs. Linux only. Defaults to False.
+            log_stage_timings (bool, optional): _description_. If True, training samples carry the time spent in each stage of loading them, 
+              the bytes read and cache hit rates, see collect_stage_timings in FireSpreadDataset. They are removed from each batch before 
+              it is transferred to the device, and logged by DataTimingCallback. Defaults to False.
         """
         super().__init__()
 
         self.n_leading_observations_test_adjustment = n_leading_observations_test_adjustment
         self.data_fold_id = data_fold_id
+        self.hdf5_max_open_files = hdf5_max_open_files
+        self.compact_batches = compact_batches
+        self.load_from_memmap = load_from_memmap
+        self.use_inventory_cache = use_inventory_cache
+        self.n_crop_candidates = n_crop_candidates
+        self.landcover_as_index = landcover_as_index
+        self.sampler_block_size = sampler_block_size
+        self.day_cache_size = day_cache_size
+        self.test_batch_size = test_batch_size
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_threads = prefetch_threads
+        self.resident_memory_budget_gb = resident_memory_budget_gb
+        self.use_crop_index = use_crop_index
+        if val_cache is not None and val_crop_seed is None:
+            raise ValueError("val_cache requires val_crop_seed to be set, otherwise the validation crops change every epoch.")
+        self.val_crop_seed = val_crop_seed
+        self.val_cache = val_cache
+        self.materialized_val_dataset = None
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor if prefetch_factor is not None else {}
+        self.pin_memory = pin_memory
+        self.worker_threads = worker_threads
+        self.pin_worker_cpus = pin_worker_cpus
+        self.log_stage_timings = log_stage_timings
+        self.stage_timings = None
+        self.expansion_tensors = None
         self.return_doy = return_doy
         # wandb apparently can't pass None values via the command line without turning them into a string, so we need this workaround
         self.features_to_keep = features_to_keep if type(
@@ -50,46 +140,109 @@ class FireSpreadDataModule(LightningDataModule):
         self.data_dir = data_dir
         self.batch_size = batch_size
         self.train_dataset, self.val_dataset, self.test_dataset = None, None, None
+        # Shared by the datasets of all splits, and kept across calls of setup. Can be set to the catalog of another 
+        # data module with the same data_dir and storage format before setup, to share it between folds, see src/run_folds.py.
+        self.catalog: Optional[FireCatalog] = None
 
     def setup(self, stage: str):
         train_years, val_years, test_years = self.split_fires(
             self.data_fold_id)
-        self.train_dataset = FireSpreadDataset(data_dir=self.data_dir, included_fire_years=train_years,
-                                               n_leading_observations=self.n_leading_observations,
+        if self.catalog is None:
+            data_format = "memmap" if self.load_from_memmap else "hdf5" if self.load_from_hdf5 else "tif"
+            self.catalog = FireCatalog(self.data_dir, data_format, self.use_inventory_cache)
+        # Arguments shared by all three datasets. All of them are standardized with the statistics of the training years.
+        dataset_kwargs = dict(data_dir=self.data_dir, n_leading_observations=self.n_leading_observations,
+                              crop_side_length=self.crop_side_length, load_from_hdf5=self.load_from_hdf5,
+                              remove_duplicate_features=self.remove_duplicate_features,
+                              features_to_keep=self.features_to_keep, return_doy=self.return_doy,
+                              stats_years=train_years, hdf5_max_open_files=self.hdf5_max_open_files,
+                              compact_batches=self.compact_batches, load_from_memmap=self.load_from_memmap,
+                              use_inventory_cache=self.use_inventory_cache, n_crop_candidates=self.n_crop_candidates,
+                              landcover_as_index=self.landcover_as_index, day_cache_size=self.day_cache_size,
+                              use_crop_index=self.use_crop_index, catalog=self.catalog)
+        # Only the training set is read in random order, which is what prefetching is for.
+        self.train_dataset = FireSpreadDataset(included_fire_years=train_years,
                                                n_leading_observations_test_adjustment=None,
-                                               crop_side_length=self.crop_side_length,
-                                               load_from_hdf5=self.load_from_hdf5, is_train=True,
-                                               remove_duplicate_features=self.remove_duplicate_features,
-                                               features_to_keep=self.features_to_keep, return_doy=self.return_doy,
-                                               stats_years=train_years)
-        self.val_dataset = FireSpreadDataset(data_dir=self.data_dir, included_fire_years=val_years,
-                                             n_leading_observations=self.n_leading_observations,
+                                               is_train=True, prefetch_depth=self.prefetch_depth,
+                                               prefetch_threads=self.prefetch_threads,
+                                               collect_stage_timings=self.log_stage_timings, **dataset_kwargs)
+        if self.resident_memory_budget_gb is not None:
+            self.train_dataset.make_resident(int(self.resident_memory_budget_gb * 1e9))
+        self.val_dataset = FireSpreadDataset(included_fire_years=val_years,
                                              n_leading_observations_test_adjustment=None,
-                                             crop_side_length=self.crop_side_length,
-                                             load_from_hdf5=self.load_from_hdf5, is_train=True,
-                                             remove_duplicate_features=self.remove_duplicate_features,
-                                             features_to_keep=self.features_to_keep, return_doy=self.return_doy,
-                                             stats_years=train_years)
-        self.test_dataset = FireSpreadDataset(data_dir=self.data_dir, included_fire_years=test_years,
-                                              n_leading_observations=self.n_leading_observations,
+                                             is_train=True, crop_seed=self.val_crop_seed, **dataset_kwargs)
+        self.materialized_val_dataset = None
+        self.test_dataset = FireSpreadDataset(included_fire_years=test_years,
                                               n_leading_observations_test_adjustment=self.n_leading_observations_test_adjustment,
-                                              crop_side_length=self.crop_side_length,
-                                              load_from_hdf5=self.load_from_hdf5, is_train=False,
-                                              remove_duplicate_features=self.remove_duplicate_features,
-                                              features_to_keep=self.features_to_keep, return_doy=self.return_doy,
-                                              stats_years=train_years)
+                                              is_train=False, **dataset_kwargs)
 
     def train_dataloader(self):
-        return DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers, pin_memory=True)
+        if self.sampler_block_size is not None:
+            sampler = FireLocalitySampler(self.train_dataset, self.sampler_block_size)
+        else:
+            sampler = RandomSampler(self.train_dataset)
+        if self.prefetch_depth > 0:
+            sampler = SharedOrderSampler(sampler, self.train_dataset, self.batch_size)
+        return DataLoader(self.train_dataset, batch_size=self.batch_size, sampler=sampler, **self.get_dataloader_kwargs("train"))
 
     def val_dataloader(self):
-        return DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers, pin_memory=True)
+        if self.val_cache is not None:
+            if self.materialized_val_dataset is None:
+                cache_dir = None if self.val_cache == "memory" else self.val_cache
+                self.materialized_val_dataset = materialize_dataset(self.val_dataset, cache_dir, batch_size=self.batch_size,
+                                                                    num_workers=self.num_workers)
+            # Samples are only indexed, which is faster in the main process than sending them from workers
+            return DataLoader(self.materialized_val_dataset, batch_size=self.batch_size, shuffle=False,
+                              **self.get_dataloader_kwargs("val", num_workers=0))
+        return DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=False, **self.get_dataloader_kwargs("val"))
 
     def test_dataloader(self):
-        return DataLoader(self.test_dataset, batch_size=1, shuffle=False, num_workers=self.num_workers, pin_memory=True)
+        if self.test_batch_size > 1:
+            batch_sampler = SizeBucketBatchSampler(self.test_dataset, self.test_batch_size)
+            collate_fn = partial(pad_collate, label_index=2 if self.compact_batches else 1)
+            return DataLoader(self.test_dataset, batch_sampler=batch_sampler, collate_fn=collate_fn, **self.get_dataloader_kwargs("test"))
+        return DataLoader(self.test_dataset, batch_size=1, shuffle=False, **self.get_dataloader_kwargs("test"))
 
     def predict_dataloader(self):
-        return DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers, pin_memory=True)
+        return DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=False, **self.get_dataloader_kwargs("predict"))
+
+    def get_dataloader_kwargs(self, split: str, num_workers: Optional[int] = None):
+        """_summary_ Returns the worker configuration of the dataloader of the given split, see worker_runtime.get_dataloader_kwargs.
+
+        Args:
+            split (str): _description_ One of "train", "val", "test" or "predict", used to look up the prefetch factor.
+            num_workers (Optional[int], optional): _description_ Overrides num_workers. Defaults to None.
+        """
+        return get_dataloader_kwargs(self.num_workers if num_workers is None else num_workers,
+                                     persistent_workers=self.persistent_workers,
+                                     prefetch_factor=self.prefetch_factor.get(split), pin_memory=self.pin_memory,
+                                     threads_per_worker=self.worker_threads, pin_cpus=self.pin_worker_cpus)
+
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        # Stage timings are reduced on the CPU, before the batch is transferred, and only the rest of the batch reaches the model.
+        if self.log_stage_timings and isinstance(batch[-1], dict):
+            self.stage_timings = reduce_stage_timings(batch[-1])
+            batch = batch[:-1]
+        return batch
+
+    def pop_stage_timings(self):
+        """_summary_ Returns the reduced stage timings of the latest training batch, see reduce_stage_timings, or None.
+        """
+        stage_timings, self.stage_timings = self.stage_timings, None
+        return stage_timings
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if not self.compact_batches:
+            return batch
+
+        # All datasets use the statistics of the training years, so any of them can expand the batch.
+        dataset = self.train_dataset
+        device = batch[0].device
+        if self.expansion_tensors is None or self.expansion_tensors[0].device != device:
+            self.expansion_tensors = (torch.as_tensor(dataset.means, device=device),
+                                      torch.as_tensor(dataset.stds, device=device),
+                                      dataset.one_hot_matrix.to(device))
+        return dataset.expand_compact_batch(batch, *self.expansion_tensors)
 
     @staticmethod
     def split_fires(data_fold_id):
@@ -1,5 +1,7 @@
+from contextlib import nullcontext
 from pathlib import Path
 from typing import List, Optional
+import bisect
 
 import rasterio
 from torch.utils.data import Dataset
@@ -8,17 +10,35 @@ import numpy as np
 #from torch.utils.data.dataset import T_co
 import glob
 import warnings
-from .utils import get_means_stds_missing_values, get_indices_of_degree_features
+from .utils import get_indices_of_degree_features, COMPACT_PADDING_LABEL, PADDING_LABEL
+from .hdf5_pool import HDF5HandlePool
+from .flat_array_store import FlatArrayStore
+from .quantization import dequantize_imgs, get_quantization_params
+from .day_cache import DayCache
+from .prefetch import ReadAheadPrefetcher
+from .resident_store import ResidentStore, ResidentStoreGroup
+from .fire_catalog import FireCatalog
+from .crop_index import has_crop_index, read_active_fire_from_crop_index
+from .stage_timer import StageTimer
 import torchvision.transforms.functional as TF
 import h5py
 from datetime import datetime
 
 
+# Number of bands per image in the TIF, HDF5 and memmap files, and the band that contains the land cover class
+N_BANDS = 23
+LANDCOVER_BAND = 16
+
+
 class FireSpreadDataset(Dataset):
     def __init__(self, data_dir: str, included_fire_years: List[int], n_leading_observations: int,
                  crop_side_length: int, load_from_hdf5: bool, is_train: bool, remove_duplicate_features: bool,
                  stats_years: List[int], n_leading_observations_test_adjustment: Optional[int] = None, 
-                 features_to_keep: Optional[List[int]] = None, return_doy: bool = False):
+                 features_to_keep: Optional[List[int]] = None, return_doy: bool = False, hdf5_max_open_files: int = 64,
+                 compact_batches: bool = False, load_from_memmap: bool = False, use_inventory_cache: bool = True,
+                 n_crop_candidates: Optional[int] = 10, landcover_as_index: bool = False, day_cache_size: int = 0,
+                 prefetch_depth: int = 0, prefetch_threads: int = 2, use_crop_index: bool = True,
+                 crop_seed: Optional[int] = None, collect_stage_timings: bool = False, catalog: Optional[FireCatalog] = None):
         """_summary_
 
         Args:
@@ -34,6 +54,47 @@ class FireSpreadDataset(Dataset):
         In practice, this means that if n_leading_observations is smaller than this value, some samples are skipped. Defaults to None. If None, nothing is skipped. This is especially used for the train and val set. 
             features_to_keep (Optional[List[int]], optional): _description_. List of feature indices from 0 to 39, indicating which features to keep. Defaults to None, which means using all features.
             return_doy (bool, optional): _description_. Return the day of the year per time step, as an additional feature. Defaults to False.
+            hdf5_max_open_files (int, optional): _description_. Maximum number of HDF5 files that each process (e.g. each DataLoader worker) 
+        keeps open for reading. Only relevant if load_from_hdf5 is True. Defaults to 64.
+            compact_batches (bool, optional): _description_. If True, samples are returned in a compact form, before standardization, 
+        sin-transformation of degree features, adding the binary active fire mask and one-hot encoding of land cover classes. 
+        These steps then need to be applied to the whole batch on the target device via expand_compact_batch. 
+        Samples are returned as (x_dynamic, landcover, y) or (x_dynamic, landcover, y, doy) tuples, where x_dynamic is a float16 
+        tensor with all features but the land cover class, landcover is a uint8 tensor with the land cover class and y is 
+        the uint8 target mask. Defaults to False.
+            load_from_memmap (bool, optional): _description_. If True, load data from flat binary files per year via np.memmap, 
+        as created by src/preprocess/CreateFlatArrayDataset.py, instead of TIF or HDF5 files. Can't be combined with load_from_hdf5. Defaults to False.
+            use_inventory_cache (bool, optional): _description_. If True, the inventory of fires, files, image counts and shapes is persisted 
+        in a manifest file in data_dir, and reused while the directory and file modification times are unchanged. This avoids listing 
+        all directories and opening all files every time a dataset is created. Defaults to True.
+            n_crop_candidates (Optional[int], optional): _description_. Number of random crop positions that are scored during augmentation, 
+        to prefer crops with fire pixels. If None, every possible crop position is scored. Defaults to 10.
+            landcover_as_index (bool, optional): _description_. If True, land cover is not one-hot encoded, but kept as a single channel 
+        containing the class index (0 to 16), which leaves 24 instead of 40 features per time step. The model then needs to embed the 
+        land cover channels on the device, see landcover_channel_ids in BaseModel. features_to_keep still uses indices from 0 to 39, 
+        but has to contain either all or none of the land cover features 16 to 32. Defaults to False.
+            day_cache_size (int, optional): _description_. Number of decoded fire-days that each process (e.g. each DataLoader worker) 
+        keeps in memory, so that days shared by neighbouring samples of a fire are only read once. Only useful if samples of the 
+        same fire are loaded close to each other, see FireLocalitySampler. Defaults to 0, which disables the cache.
+            prefetch_depth (int, optional): _description_. Number of upcoming samples that each process reads in background threads, 
+        while the current sample is preprocessed. Requires the DataLoader's sampler to be wrapped in SharedOrderSampler, which 
+        tells the processes the sample order. Defaults to 0, which disables prefetching.
+            prefetch_threads (int, optional): _description_. Number of background reader threads per process, if prefetch_depth > 0. Defaults to 2.
+            use_crop_index (bool, optional): _description_. If True and is_train is True, HDF5 files that contain a crop index of their fire pixels 
+        (see src/preprocess/CreateHDF5Dataset.py) are read in two steps: The crop window is chosen from the index first, and then only the 
+        window is read, instead of the full images. The chosen crops are the same as without the index. Not used for data that is resident 
+        in memory, with prefetching, since the crop needs to be drawn from the random state of the calling thread, or for files without an index. 
+        The day cache is bypassed for windowed reads. Defaults to True.
+            crop_seed (Optional[int], optional): _description_. If set, the random crop and flips of each sample are drawn from a random state 
+        seeded with (crop_seed, index), so that every epoch sees the same crops, e.g. for a stable validation loss. The global random state 
+        is left untouched. Defaults to None, which draws new crops every time.
+            collect_stage_timings (bool, optional): _description_. If True, every sample gets a dictionary as additional last element, 
+        with the time spent in the stages of __getitem__, the bytes read and the cache hits and misses since the previous sample 
+        of the same process, see StageTimer. The DataLoader collates these into one dictionary per batch, which needs to be removed 
+        from the batch before it reaches the model, see FireSpreadDataModule.on_before_batch_transfer. Defaults to False.
+            catalog (Optional[FireCatalog], optional): _description_. Catalog of data_dir to take the inventory of fires, the statistics and 
+        the resident years from, which can be shared with the datasets of other splits and folds. Has to match data_dir, the storage format 
+        and use_inventory_cache. Defaults to None, which creates a new catalog.
 
         Raises:
             ValueError: _description_ Raised if input values are not in the expected ranges.
@@ -51,9 +112,47 @@ class FireSpreadDataset(Dataset):
         self.n_leading_observations_test_adjustment = n_leading_observations_test_adjustment
         self.included_fire_years = included_fire_years
         self.data_dir = data_dir
+        self.hdf5_pool = HDF5HandlePool(max_open_files=hdf5_max_open_files)
+        self.compact_batches = compact_batches
+        self.load_from_memmap = load_from_memmap
+        self.flat_store = FlatArrayStore(data_dir)
+        self.use_inventory_cache = use_inventory_cache
+        self.n_crop_candidates = n_crop_candidates
+        self.landcover_as_index = landcover_as_index
+        self.data_format = "memmap" if load_from_memmap else "hdf5" if load_from_hdf5 else "tif"
+        # Per-channel (scale, offset) of quantized HDF5 files, or None for float32 files. Filled on first access of each file.
+        self.hdf5_quantization_params = {}
+        self.day_cache = DayCache(day_cache_size) if day_cache_size > 0 else None
+        self.prefetcher = ReadAheadPrefetcher(prefetch_depth, prefetch_threads) if prefetch_depth > 0 else None
+        # Set by make_resident
+        self.resident_store = None
+        self.use_crop_index = use_crop_index
+        # Whether each HDF5 file contains a crop index. Filled on first access of each file.
+        self.hdf5_has_crop_index = {}
+        self.crop_seed = crop_seed
+        self.stage_timer = StageTimer() if collect_stage_timings else None
 
         self.validate_inputs()
 
+        if catalog is None:
+            catalog = FireCatalog(data_dir, self.data_format, use_inventory_cache)
+        elif not catalog.matches(data_dir, self.data_format, use_inventory_cache):
+            raise ValueError(f"The catalog of {catalog.data_dir} ({catalog.data_format}, use_inventory_cache={catalog.use_inventory_cache}) "
+                             f"does not match the dataset {data_dir} ({self.data_format}, {use_inventory_cache=}).")
+        self.catalog = catalog
+
+        # Indices of the channels to keep, in the channel layout that the dataset produces
+        self.channels_to_keep = self.map_features_to_keep(features_to_keep, landcover_as_index)
+        # Only the bands that the kept features are derived from are read and preprocessed, see get_bands_to_read.
+        # The channels that expand_features produces from them, and their positions, in the layout of channels_to_keep:
+        self.bands_to_read = self.get_bands_to_read(features_to_keep)
+        self.expanded_channel_ids = self.get_expanded_channel_ids(self.bands_to_read, landcover_as_index)
+        self.expanded_channel_positions = {channel_id: position for position, channel_id in enumerate(self.expanded_channel_ids)}
+        self.channel_positions_to_keep = None if self.channels_to_keep is None else \
+            [self.expanded_channel_positions[channel_id] for channel_id in self.channels_to_keep]
+        read_band_ids = list(range(N_BANDS)) if self.bands_to_read is None else self.bands_to_read
+        self.landcover_band_position = read_band_ids.index(LANDCOVER_BAND) if LANDCOVER_BAND in read_band_ids else None
+
         # Compute how many samples to skip in the test set, to make it look like it would with n_leading_observations set to this value.
         if self.n_leading_observations_test_adjustment is None:
             self.skip_initial_samples = 0
@@ -66,16 +165,26 @@ class FireSpreadDataset(Dataset):
         # we need to know how many data points each fire contains, to be able to map a dataset index to a specific fire.
         self.imgs_per_fire = self.read_list_of_images()
         self.datapoints_per_fire = self.compute_datapoints_per_fire()
-        self.length = sum([sum(self.datapoints_per_fire[fire_year].values())
-                          for fire_year in self.datapoints_per_fire])
+        self.fire_keys, self.fire_end_offsets = self.compute_cumulative_datapoints()
+        self.fire_key_years = np.array([fire_year for fire_year, _ in self.fire_keys], dtype=np.int64)
+        self.fire_key_names = np.array([fire_name for _, fire_name in self.fire_keys], dtype=object)
+        # Don't let DataLoader workers inherit the handles opened while building the inventory. They open their own on demand.
+        self.hdf5_pool.close_all()
+        self.length = int(self.fire_end_offsets[-1]) if len(self.fire_end_offsets) > 0 else 0
 
         # Used in preprocessing and normalization. Better to define it once than build/call for every data point
         # The one-hot matrix is used for one-hot encoding of land cover classes
         self.one_hot_matrix = torch.eye(17)
-        self.means, self.stds, _ = get_means_stds_missing_values(self.stats_years)
+        self.means, self.stds, _ = self.catalog.get_means_stds_missing_values(self.stats_years)
         self.means = self.means[None, :, None, None]
         self.stds = self.stds[None, :, None, None]
         self.indices_of_degree_features = get_indices_of_degree_features()
+        if self.bands_to_read is not None:
+            # Statistics and degree features refer to the positions of the bands that are read
+            self.means = self.means[:, self.bands_to_read]
+            self.stds = self.stds[:, self.bands_to_read]
+            self.indices_of_degree_features = [self.bands_to_read.index(band) for band in self.indices_of_degree_features
+                                               if band in self.bands_to_read]
 
     def find_image_index_from_dataset_index(self, target_id) -> (int, str, int):
         """_summary_ Given the index of a data point in the dataset, find the corresponding fire that contains it, 
@@ -98,26 +207,43 @@ class FireSpreadDataset(Dataset):
             raise RuntimeError(
                 f"Tried to access item {target_id}, but maximum index is {self.length - 1}.")
 
-        # The index is relative to the length of the full dataset. However, we need to make sure that we know which
-        # specific fire the queried index belongs to. We know how many data points each fire contains from
-        # self.datapoints_per_fire.
-        first_id_in_current_fire = 0
-        found_fire_year = None
-        found_fire_name = None
-        for fire_year in self.datapoints_per_fire:
-            if found_fire_year is None:
-                for fire_name, datapoints_in_fire in self.datapoints_per_fire[fire_year].items():
-                    if target_id - first_id_in_current_fire < datapoints_in_fire:
-                        found_fire_year = fire_year
-                        found_fire_name = fire_name
-                        break
-                    else:
-                        first_id_in_current_fire += datapoints_in_fire
+        # The index is relative to the length of the full dataset. We know the (exclusive) end offset of each fire 
+        # from self.fire_end_offsets, so the fire containing the queried index is the first one whose end offset is 
+        # larger than the index. Fires without data points have the same end offset as their predecessor and are skipped.
+        fire_id = bisect.bisect_right(self.fire_end_offsets, target_id)
+        found_fire_year, found_fire_name = self.fire_keys[fire_id]
+        first_id_in_current_fire = self.fire_end_offsets[fire_id] - \
+            self.datapoints_per_fire[found_fire_year][found_fire_name]
 
-        in_fire_index = target_id - first_id_in_current_fire
+        in_fire_index = int(target_id - first_id_in_current_fire)
 
         return found_fire_year, found_fire_name, in_fire_index
 
+    def find_image_indices_from_dataset_indices(self, target_ids):
+        """_summary_ Vectorized version of find_image_index_from_dataset_index, which resolves a whole array of 
+        dataset indices at once, e.g. for samplers or offline tools.
+
+        Args:
+            target_ids (_type_): _description_ Array-like of dataset indices. Negative indices are counted from the end.
+
+        Raises:
+            RuntimeError: _description_ Raised if any dataset index is out of range.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): _description_ Arrays of years, fire names and indices of data points within fires.
+        """
+        target_ids = np.asarray(target_ids, dtype=np.int64)
+        target_ids = np.where(target_ids < 0, target_ids + self.length, target_ids)
+        if target_ids.size > 0 and (target_ids.min() < 0 or target_ids.max() >= self.length):
+            raise RuntimeError(
+                f"Tried to access items in [{target_ids.min()}, {target_ids.max()}], but valid indices are in [0, {self.length - 1}].")
+
+        fire_ids = np.searchsorted(self.fire_end_offsets, target_ids, side="right")
+        fire_sizes = np.diff(self.fire_end_offsets, prepend=0)
+        in_fire_indices = target_ids - (self.fire_end_offsets[fire_ids] - fire_sizes[fire_ids])
+
+        return self.fire_key_years[fire_ids], self.fire_key_names[fire_ids], in_fire_indices
+
     def load_imgs(self, found_fire_year, found_fire_name, in_fire_index):
         """_summary_ Load the images corresponding to the specified data point from disk.
 
@@ -136,45 +262,287 @@ class FireSpreadDataset(Dataset):
         in_fire_index += self.skip_initial_samples
         end_index = (in_fire_index + self.n_leading_observations + 1)
 
-        if self.load_from_hdf5:
-            hdf5_path = self.imgs_per_fire[found_fire_year][found_fire_name][0]
-            with h5py.File(hdf5_path, 'r') as f:
-                imgs = f["data"][in_fire_index:end_index]
-                if self.return_doy:
-                    doys = f["data"].attrs["img_dates"][in_fire_index:(
-                        end_index-1)]
-                    doys = self.img_dates_to_doys(doys)
-                    doys = torch.Tensor(doys)
-            x, y = np.split(imgs, [-1], axis=0)
-            # Last image's active fire mask is used as label, rest is input data
-            y = y[0, -1, ...]
+        if self.can_read_crop_window(found_fire_year, found_fire_name):
+            imgs = self.read_crop_window(found_fire_year, found_fire_name, in_fire_index, end_index)
+        elif self.day_cache is not None:
+            imgs = self.read_days_cached(found_fire_year, found_fire_name, in_fire_index, end_index)
         else:
-            imgs_to_load = self.imgs_per_fire[found_fire_year][found_fire_name][in_fire_index:end_index]
-            imgs = []
-            for img_path in imgs_to_load:
-                with rasterio.open(img_path, 'r') as ds:
-                    imgs.append(ds.read())
-            x = np.stack(imgs[:-1], axis=0)
-            y = imgs[-1][-1, ...]
+            imgs = self.read_days(found_fire_year, found_fire_name, in_fire_index, end_index)
+
+        # Last image's active fire mask is used as label, rest is input data
+        x, y = np.split(imgs, [-1], axis=0)
+        y = y[0, -1, ...]
+
+        if self.return_doy:
+            if self.load_from_hdf5:
+                hdf5_path = self.imgs_per_fire[found_fire_year][found_fire_name][0]
+                with self.hdf5_pool.lease(hdf5_path) as f:
+                    img_dates = f["data"].attrs["img_dates"]
+            else:
+                img_dates = self.flat_store.load_index(found_fire_year)["fires"][found_fire_name]["img_dates"]
+            doys = self.img_dates_to_doys(img_dates[in_fire_index:(end_index-1)])
+            doys = torch.Tensor(doys)
 
         if self.return_doy:
             return x, y, doys
         return x, y
 
-    def __getitem__(self, index):
+    def read_hdf5(self, hdf5_path, start_index, end_index, window: Optional[tuple] = None, bands: Optional[List[int]] = None):
+        """_summary_ Reads the images [start_index, end_index) of a fire's HDF5 file, and dequantizes them if the file is quantized.
+        If window is given as (top, left), only the square crop of side length crop_side_length at that position is read.
+        If bands is given as a sorted list, only these bands are read.
+        """
+        rows, cols = slice(None), slice(None)
+        if window is not None:
+            top, left = window
+            rows, cols = slice(top, top + self.crop_side_length), slice(left, left + self.crop_side_length)
+        with self.hdf5_pool.lease(hdf5_path) as f:
+            dset = f["data"]
+            imgs = dset[start_index:end_index, slice(None) if bands is None else bands, rows, cols]
+            if hdf5_path not in self.hdf5_quantization_params:
+                self.hdf5_quantization_params[hdf5_path] = get_quantization_params(dset)
+        if self.stage_timer is not None:
+            self.stage_timer.add("bytes_read", imgs.nbytes)
+        if self.hdf5_quantization_params[hdf5_path] is not None:
+            scale, offset = self.hdf5_quantization_params[hdf5_path]
+            if bands is not None:
+                scale, offset = scale[bands], offset[bands]
+            imgs = dequantize_imgs(imgs, scale, offset)
+        return imgs
+
+    def read_days(self, fire_year, fire_name, start_index, end_index):
+        """_summary_ Reads the images [start_index, end_index) of a fire from disk, independent of the storage format.
+        Only the bands in bands_to_read are read.
+
+        Returns:
+            _type_: _description_ Array of shape (days, features, height, width).
+        """
+        if self.resident_store is not None:
+            # Copy the window, so that the shared images are not modified by the following preprocessing.
+            return np.array(self.resident_store.get_fire((fire_year, fire_name))[start_index:end_index])
+        if self.load_from_hdf5:
+            return self.read_hdf5(self.imgs_per_fire[fire_year][fire_name][0], start_index, end_index, bands=self.bands_to_read)
+        if self.load_from_memmap:
+            # The memory map is read-only, so the window is copied out of the page cache once here.
+            fire = self.flat_store.get_fire(fire_year, fire_name)
+            if self.bands_to_read is None:
+                imgs = np.array(fire[start_index:end_index])
+            else:
+                imgs = fire[start_index:end_index, self.bands_to_read]
+        else:
+            # rasterio counts bands from 1
+            indexes = None if self.bands_to_read is None else [band + 1 for band in self.bands_to_read]
+            imgs = []
+            for img_path in self.imgs_per_fire[fire_year][fire_name][start_index:end_index]:
+                with rasterio.open(img_path, 'r') as ds:
+                    imgs.append(ds.read(indexes))
+            imgs = np.stack(imgs, axis=0)
+        if self.stage_timer is not None:
+            self.stage_timer.add("bytes_read", imgs.nbytes)
+        return imgs
+
+    def can_read_crop_window(self, fire_year, fire_name) -> bool:
+        """_summary_ Whether the training crop of this fire's samples can be chosen before reading, see use_crop_index.
+        """
+        if not (self.use_crop_index and self.is_train and self.load_from_hdf5) \
+                or self.resident_store is not None or self.prefetcher is not None:
+            return False
+        hdf5_path = self.imgs_per_fire[fire_year][fire_name][0]
+        if hdf5_path not in self.hdf5_has_crop_index:
+            with self.hdf5_pool.lease(hdf5_path) as f:
+                self.hdf5_has_crop_index[hdf5_path] = has_crop_index(f)
+        return self.hdf5_has_crop_index[hdf5_path]
+
+    def read_crop_window(self, fire_year, fire_name, start_index, end_index):
+        """_summary_ Chooses the training crop of a sample from the crop index of its HDF5 file, in the same way as augment 
+        does from the full images, and reads only the crop window of the images [start_index, end_index).
+
+        Returns:
+            _type_: _description_ Array of shape (days, features, crop_side_length, crop_side_length).
+        """
+        hdf5_path = self.imgs_per_fire[fire_year][fire_name][0]
+        with self.hdf5_pool.lease(hdf5_path) as f:
+            height, width = f["data"].shape[-2:]
+            active_fire = read_active_fire_from_crop_index(f, start_index, end_index, height, width)
+        window = self.select_crop_window(torch.from_numpy(active_fire[-1] > 0).long(), torch.from_numpy(active_fire[:-1]))
+        return self.read_hdf5(hdf5_path, start_index, end_index, window=window, bands=self.bands_to_read)
+
+    def read_days_cached(self, fire_year, fire_name, start_index, end_index):
+        """_summary_ Like read_days, but takes days from the day cache where possible. Missing days are read 
+        with a single read from the first to the last missing day, and added to the cache.
+        """
+        days = list(range(start_index, end_index))
+        cached_imgs = [self.day_cache.get((fire_year, fire_name, day)) for day in days]
+        missing_days = [day for day, img in zip(days, cached_imgs) if img is None]
+        if missing_days:
+            first_missing, last_missing = missing_days[0], missing_days[-1] + 1
+            imgs = self.read_days(fire_year, fire_name, first_missing, last_missing)
+            for day in range(first_missing, last_missing):
+                self.day_cache.put((fire_year, fire_name, day), imgs[day - first_missing])
+                cached_imgs[day - start_index] = imgs[day - first_missing]
+
+        # Stacking copies the cached images, so they are not modified by the following preprocessing.
+        return np.stack(cached_imgs, axis=0)
+
+    def get_resident_fire_shapes(self):
+        """_summary_ Returns the shape (days, bands, height, width) of all fires that contribute data points, 
+        as they would be kept in memory by make_resident. Only the bands in bands_to_read are kept.
+        """
+        n_bands = N_BANDS if self.bands_to_read is None else len(self.bands_to_read)
+        return {(fire_year, fire_name): (self.fire_inventory[fire_year][fire_name]["n_imgs"], n_bands,
+                                         *self.fire_inventory[fire_year][fire_name]["shape"][1:])
+                for fire_year, fire_name in self.fire_keys
+                if self.datapoints_per_fire[fire_year][fire_name] > 0}
+
+    def make_resident(self, max_bytes: Optional[int] = None) -> bool:
+        """_summary_ Reads all fires of the dataset once into shared memory, see ResidentStore, after which no more 
+        disk I/O happens. Should be called in the main process, before the DataLoader starts its workers, which then all 
+        read from the same memory. Years that the catalog already keeps resident, e.g. for the dataset of another fold, 
+        are reused instead of read again. Falls back to reading from disk if the data doesn't fit.
+
+        Args:
+            max_bytes (Optional[int], optional): _description_ Memory budget, for all years kept resident by the catalog. 
+            If the dataset is larger, it stays on disk. Other resident years of the catalog are released to make room. 
+            Defaults to None, which only checks the free space in shared memory.
+
+        Returns:
+            bool: _description_ Whether the dataset is now resident in memory.
+        """
+        fire_shapes = self.get_resident_fire_shapes()
+        resident_size = ResidentStore.get_size(fire_shapes)
+        new_size = ResidentStore.get_size(self.catalog.get_missing_resident_fires(fire_shapes, self.bands_to_read))
+        available_shared_memory = ResidentStore.get_available_shared_memory()
+        print(f"Resident dataset: {len(fire_shapes)} fires of years {self.included_fire_years} take {resident_size / 1e9:.2f} GB in memory, "
+              f"of which {(resident_size - new_size) / 1e9:.2f} GB are already resident "
+              f"(budget: {'none' if max_bytes is None else f'{max_bytes / 1e9:.2f} GB'}, "
+              f"free shared memory: {'unknown' if available_shared_memory is None else f'{available_shared_memory / 1e9:.2f} GB'}).")
+
+        if max_bytes is not None and resident_size > max_bytes:
+            warnings.warn(f"The dataset of years {self.included_fire_years} ({resident_size / 1e9:.2f} GB) exceeds the memory budget "
+                          f"of {max_bytes / 1e9:.2f} GB, and is read from disk instead.", RuntimeWarning)
+            return False
+        if available_shared_memory is not None and new_size > available_shared_memory:
+            warnings.warn(f"The dataset of years {self.included_fire_years} ({new_size / 1e9:.2f} GB not yet resident) exceeds the free "
+                          f"shared memory of {available_shared_memory / 1e9:.2f} GB, and is read from disk instead.", RuntimeWarning)
+            return False
+
+        def read_fire(fire_year, fire_name):
+            return self.read_days(fire_year, fire_name, 0, self.fire_inventory[fire_year][fire_name]["n_imgs"])
+
+        resident_stores = self.catalog.make_resident(fire_shapes, self.bands_to_read, read_fire, max_bytes)
+        # Handles opened while reading are not needed anymore, and should not be inherited by the DataLoader workers.
+        self.hdf5_pool.close_all()
+        self.resident_store = ResidentStoreGroup(resident_stores)
+        return True
+
+    def load_fire_array(self, fire_year, fire_name):
+        """_summary_ Loads all images of a fire at once, independent of the storage format. Active fire detection 
+        times are converted to hours and their NaNs are replaced with 0, as in the HDF5 files.
+
+        Args:
+            fire_year (_type_): _description_
+            fire_name (_type_): _description_
 
-        found_fire_year, found_fire_name, in_fire_index = self.find_image_index_from_dataset_index(
-            index)
-        loaded_imgs = self.load_imgs(
-            found_fire_year, found_fire_name, in_fire_index)
+        Returns:
+            _type_: _description_ float32 array of shape (days, features, height, width).
+        """
+        if self.load_from_hdf5:
+            imgs = self.read_hdf5(self.imgs_per_fire[fire_year][fire_name][0], 0, None)
+        elif self.load_from_memmap:
+            imgs = np.array(self.flat_store.get_fire(fire_year, fire_name))
+        else:
+            _, _, imgs = self.load_fire_for_hdf5(self.imgs_per_fire[fire_year][fire_name])
+        return imgs.astype(np.float32, copy=False)
+
+    def load_sample(self, index):
+        """_summary_ Loads the unprocessed images of the data point with the given index, see load_imgs. 
+        Thread-safe, so that it can be run by the prefetcher.
+        """
+        with self.time_stage("find_index"):
+            found_fire_year, found_fire_name, in_fire_index = self.find_image_index_from_dataset_index(
+                index)
+        with self.time_stage("load_imgs"):
+            return self.load_imgs(
+                found_fire_year, found_fire_name, in_fire_index)
+
+    def time_stage(self, stage: str):
+        """_summary_ Context manager that adds the duration of a stage to the stage timer, or does nothing if collect_stage_timings is False.
+        """
+        return nullcontext() if self.stage_timer is None else self.stage_timer.time(stage)
+
+    def __getitem__(self, index):
+        if self.stage_timer is not None:
+            with self.stage_timer.time("getitem"):
+                sample = self.get_seeded_sample(index)
+            self.stage_timer.add("samples", 1)
+            self.stage_timer.add_counters(self.get_cache_counters())
+            return (*sample, self.stage_timer.pop())
+        return self.get_seeded_sample(index)
+
+    def get_cache_counters(self):
+        """_summary_ Returns the cumulative hit and miss counters of the day cache and the prefetcher of the current process.
+        """
+        counters = {}
+        if self.day_cache is not None:
+            counters.update({"day_cache/hits": self.day_cache.hits, "day_cache/misses": self.day_cache.misses})
+        if self.prefetcher is not None:
+            stats = self.prefetcher.get_stats()
+            counters.update({"prefetch/hits": stats["hits"], "prefetch/misses": stats["misses"],
+                             "prefetch/stall_time": stats["stall_time"]})
+        return counters
+
+    def get_seeded_sample(self, index):
+        if self.crop_seed is None:
+            return self.get_sample(index)
+
+        # Augmentation draws from the global random state, which is seeded per sample and restored afterwards
+        random_state = np.random.get_state()
+        np.random.seed([self.crop_seed, index])
+        try:
+            return self.get_sample(index)
+        finally:
+            np.random.set_state(random_state)
+
+    def get_sample(self, index):
+
+        if self.prefetcher is not None:
+            loaded_imgs = self.prefetcher.get(index, self.load_sample)
+        else:
+            loaded_imgs = self.load_sample(index)
 
         if self.return_doy:
             x, y, doys = loaded_imgs
         else:
             x, y = loaded_imgs
 
-        x, y = self.preprocess_and_augment(x, y)
+        if self.compact_batches:
+            with self.time_stage("preprocess_and_augment"):
+                x, landcover, y = self.preprocess_and_augment(x, y)
+            if self.return_doy:
+                return x, landcover, y, doys
+            return x, landcover, y
+
+        with self.time_stage("preprocess_and_augment"):
+            x, y = self.preprocess_and_augment(x, y)
+        with self.time_stage("select_features"):
+            x = self.select_features(x)
 
+        if self.return_doy:
+            return x, y, doys
+        return x, y
+
+    def select_features(self, x, batched: bool = False):
+        """_summary_ Removes duplicate static features or discards features that we don't want to use, depending on 
+        remove_duplicate_features and features_to_keep.
+
+        Args:
+            x (_type_): _description_ Input data, of shape (time_steps, features, height, width), or 
+            (batch_size, time_steps, features, height, width) if batched is True.
+            batched (bool, optional): _description_. Whether x has a leading batch dimension. Defaults to False.
+
+        Returns:
+            _type_: _description_
+        """
         # Remove duplicate static features, which can greatly reduce the number of features, since we use 
         # one-hot encoded landcover types. The result would have different amounts of feature channels per 
         # time step, therefore, we flatten the temporal dimension.
@@ -183,13 +551,11 @@ class FireSpreadDataset(Dataset):
         
         # Discard features that we don't want to use
         elif self.features_to_keep is not None:
-            if len(x.shape) != 4:
+            if len(x.shape) != 4 + int(batched):
                 raise NotImplementedError(f"Removing features is only implemented for 4D tensors, but got {x.shape=}.")
-            x = x[:, self.features_to_keep, ...]
+            x = x[..., self.channel_positions_to_keep, :, :]
 
-        if self.return_doy:
-            return x, y, doys
-        return x, y
+        return x
 
     def __len__(self):
         return self.length
@@ -197,9 +563,11 @@ class FireSpreadDataset(Dataset):
     def validate_inputs(self):
         if self.n_leading_observations < 1:
             raise ValueError("Need at least one day of observations.")
-        if self.return_doy and not self.load_from_hdf5:
+        if self.load_from_hdf5 and self.load_from_memmap:
+            raise ValueError("load_from_hdf5 and load_from_memmap can't both be True.")
+        if self.return_doy and not (self.load_from_hdf5 or self.load_from_memmap):
             raise NotImplementedError(
-                "Returning day of year is only implemented for hdf5 files.")
+                "Returning day of year is only implemented for hdf5 and memmap files.")
         if self.n_leading_observations_test_adjustment is not None:
             if self.n_leading_observations_test_adjustment < self.n_leading_observations:
                 raise ValueError(
@@ -215,32 +583,22 @@ class FireSpreadDataset(Dataset):
             _type_: _description_ Returns a dictionary mapping integer years to dictionaries. 
             These dictionaries map names of fires that happened within the respective year to either
             a) the corresponding list of image files (in case hdf5 files are not used) or
-            b) the individual hdf5 file for each fire.
+            b) the individual hdf5 file for each fire or
+            c) the flat binary file of the fire's year, if memmap files are used.
         """
         imgs_per_fire = {}
+        # Additionally keep track of the number of images, image shape and dates of each fire.
+        self.fire_inventory = {}
         for fire_year in self.included_fire_years:
             imgs_per_fire[fire_year] = {}
+            self.fire_inventory[fire_year] = self.catalog.get_year_inventory(fire_year)
 
-            if not self.load_from_hdf5:
-                fires_in_year = glob.glob(f"{self.data_dir}/{fire_year}/*/")
-                fires_in_year.sort()
-                for fire_dir_path in fires_in_year:
-                    fire_name = fire_dir_path.split("/")[-2]
-                    fire_img_paths = glob.glob(f"{fire_dir_path}/*.tif")
-                    fire_img_paths.sort()
-                    
-                    imgs_per_fire[fire_year][fire_name] = fire_img_paths
-
-                    if len(fire_img_paths) == 0:
-                        warnings.warn(f"In dataset preparation: Fire {fire_year}: {fire_name} contains no images.",
-                                      RuntimeWarning)
-            else:
-                fires_in_year = glob.glob(
-                    f"{self.data_dir}/{fire_year}/*.hdf5")
-                fires_in_year.sort()
-                for fire_hdf5 in fires_in_year:
-                    fire_name = Path(fire_hdf5).stem
-                    imgs_per_fire[fire_year][fire_name] = [fire_hdf5]
+            for fire_name, fire in self.fire_inventory[fire_year].items():
+                imgs_per_fire[fire_year][fire_name] = fire["files"]
+
+                if fire["n_imgs"] == 0:
+                    warnings.warn(f"In dataset preparation: Fire {fire_year}: {fire_name} contains no images.",
+                                  RuntimeWarning)
 
         return imgs_per_fire
 
@@ -255,41 +613,55 @@ class FireSpreadDataset(Dataset):
         for fire_year in self.imgs_per_fire:
             datapoints_per_fire[fire_year] = {}
             for fire_name, fire_imgs in self.imgs_per_fire[fire_year].items():
-                if not self.load_from_hdf5:
-                    n_fire_imgs = len(fire_imgs) - self.skip_initial_samples
-                else:
-                    # Catch error case that there's no file
-                    if not fire_imgs:
-                        n_fire_imgs = 0
-                    else:
-                        with h5py.File(fire_imgs[0], 'r') as f:
-                            n_fire_imgs = len(f["data"]) - self.skip_initial_samples
+                n_fire_imgs = self.fire_inventory[fire_year][fire_name]["n_imgs"] - self.skip_initial_samples
                 # If we have two days of observations, and a lead of one day,
                 # we can only predict the second day's fire mask, based on the first day's observation
                 datapoints_in_fire = n_fire_imgs - self.n_leading_observations
                 if datapoints_in_fire <= 0:
                     warnings.warn(
                         f"In dataset preparation: Fire {fire_year}: {fire_name} does not contribute data points. It contains "
-                        f"{len(fire_imgs)} images, which is too few for a lead of {self.n_leading_observations} observations.",
+                        f"{n_fire_imgs + self.skip_initial_samples} images, which is too few for a lead of {self.n_leading_observations} observations.",
                         RuntimeWarning)
                     datapoints_per_fire[fire_year][fire_name] = 0
                 else:
                     datapoints_per_fire[fire_year][fire_name] = datapoints_in_fire
         return datapoints_per_fire
 
-    def standardize_features(self, x):
+    def compute_cumulative_datapoints(self):
+        """_summary_ Flatten self.datapoints_per_fire into a list of fires and the cumulative number of data points, 
+        which allows mapping a dataset index to a specific fire via binary search instead of a linear walk.
+
+        Returns:
+            _type_: _description_ Tuple of a list of (year, fire name) tuples and an array with the exclusive 
+            end offset of each fire in the dataset index space.
+        """
+        fire_keys = []
+        datapoints = []
+        for fire_year in self.datapoints_per_fire:
+            for fire_name, datapoints_in_fire in self.datapoints_per_fire[fire_year].items():
+                fire_keys.append((fire_year, fire_name))
+                datapoints.append(datapoints_in_fire)
+
+        fire_end_offsets = np.cumsum(np.array(datapoints, dtype=np.int64))
+        return fire_keys, fire_end_offsets
+
+    def standardize_features(self, x, means=None, stds=None):
         """_summary_ Standardizes the input data, using the mean and standard deviation of each feature. 
         Some features are excluded from this, which are the degree features (e.g. wind direction), and the land cover class.
         The binary active fire mask is also excluded, since it's added after standardization.
 
         Args:
             x (_type_): _description_ Input data, of shape (time_steps, features, height, width)
+            means (_type_, optional): _description_. Feature means, broadcastable to x. Defaults to None, which uses self.means.
+            stds (_type_, optional): _description_. Feature standard deviations, broadcastable to x. Defaults to None, which uses self.stds.
 
         Returns:
             _type_: _description_ Standardized input data, of shape (time_steps, features, height, width)
         """
+        means = self.means if means is None else means
+        stds = self.stds if stds is None else stds
 
-        x = (x - self.means) / self.stds
+        x = (x - means) / stds
 
         return x
 
@@ -313,8 +685,8 @@ class FireSpreadDataset(Dataset):
 
         x, y = torch.Tensor(x), torch.Tensor(y)
 
-        # Preprocessing that has been done in HDF files already
-        if not self.load_from_hdf5:
+        # Preprocessing that has been done in HDF and memmap files already
+        if not (self.load_from_hdf5 or self.load_from_memmap):
 
             # Active fire masks have nans where no detections occur. In general, we want to replace NaNs with
             # the mean of the respective feature. Since the NaNs here don't represent missing values, we replace
@@ -334,39 +706,120 @@ class FireSpreadDataset(Dataset):
         else:
             x, y = self.center_crop_x32(x, y)
 
+        if self.compact_batches:
+            return self.compact_features(x, y)
+
+        x = self.expand_features(x)
+
+        return x, y
+
+    def expand_features(self, x, means=None, stds=None, one_hot_matrix=None):
+        """_summary_ Applies the feature transformations that follow the geometric augmentation: 
+        sin of degree features, standardization, addition of the binary active fire mask and one-hot encoding of land cover classes.
+        Works on single samples as well as on whole batches, since only the last three dimensions are indexed.
+
+        Args:
+            x (_type_): _description_ Input data, of shape (..., features, height, width)
+            means (_type_, optional): _description_. Feature means, broadcastable to x. Defaults to None, which uses self.means.
+            stds (_type_, optional): _description_. Feature standard deviations, broadcastable to x. Defaults to None, which uses self.stds.
+            one_hot_matrix (_type_, optional): _description_. Matrix used for one-hot encoding, on the same device as x. 
+            Defaults to None, which uses self.one_hot_matrix.
+
+        Returns:
+            _type_: _description_ Input data with 40 features (24 if landcover_as_index is True), of shape (..., features, height, width). 
+            If only some bands were read, see bands_to_read, only the features derived from them, see expanded_channel_ids.
+        """
+        one_hot_matrix = self.one_hot_matrix if one_hot_matrix is None else one_hot_matrix
+
         # Some features take values in [0,360] degrees. By applying sin, we make sure that values near 0 and 360 are
         # close in feature space, since they are also close in reality.
-        x[:, self.indices_of_degree_features, ...] = torch.sin(
-            torch.deg2rad(x[:, self.indices_of_degree_features, ...]))
+        x[..., self.indices_of_degree_features, :, :] = torch.sin(
+            torch.deg2rad(x[..., self.indices_of_degree_features, :, :]))
 
         # Compute binary mask of active fire pixels before normalization changes what 0 means. 
-        binary_af_mask = (x[:, -1:, ...] > 0).float()
+        binary_af_mask = (x[..., -1:, :, :] > 0).float()
 
-        x = self.standardize_features(x)
+        x = self.standardize_features(x, means, stds)
 
         # Adds the binary fire mask as an additional channel to the input data.
-        x = torch.cat([x, binary_af_mask], axis=1)
+        x = torch.cat([x, binary_af_mask], axis=-3)
 
         # Replace NaN values with 0, thereby essentially setting them to the mean of the respective feature.
         x = torch.nan_to_num(x, nan=0.0)
 
+        lc = self.landcover_band_position
+        if lc is None:
+            return x
+
         # Create land cover class one-hot encoding, put it where the land cover integer was
-        new_shape = (x.shape[0], x.shape[2], x.shape[3],
-                     self.one_hot_matrix.shape[0])
         # -1 because land cover classes start at 1
-        landcover_classes_flattened = x[:, 16, ...].long().flatten() - 1
-        landcover_encoding = self.one_hot_matrix[landcover_classes_flattened].reshape(
-            new_shape).permute(0, 3, 1, 2)
+        landcover_classes = x[..., lc, :, :].long() - 1
+        if self.landcover_as_index:
+            # Missing values (0 after nan_to_num) end up as index -1, which selects the last row of the one-hot matrix.
+            # Keep the same mapping, so that an embedding initialized as identity reproduces the one-hot encoding.
+            landcover_encoding = torch.remainder(landcover_classes, 17).unsqueeze(-3).to(x.dtype)
+        else:
+            landcover_encoding = one_hot_matrix[landcover_classes].movedim(-1, -3)
         x = torch.concatenate(
-            [x[:, :16, ...], landcover_encoding, x[:, 17:, ...]], dim=1)
+            [x[..., :lc, :, :], landcover_encoding, x[..., lc + 1:, :, :]], dim=-3)
+
+        return x
+
+    def compact_features(self, x, y):
+        """_summary_ Turns augmented, but otherwise unprocessed samples into the compact form used if compact_batches is True.
+
+        Args:
+            x (_type_): _description_ Input data, of shape (time_steps, features, height, width)
+            y (_type_): _description_ Binary target mask, of shape (height, width)
+
+        Returns:
+            _type_: _description_ Tuple of float16 features without land cover (time_steps, features - 1, height, width), 
+            uint8 land cover classes (time_steps, height, width) and uint8 target mask (height, width).
+        """
+        lc = self.landcover_band_position
+        if lc is None:
+            return x.half(), torch.zeros(x[:, 0, ...].shape, dtype=torch.uint8), y.to(torch.uint8)
+        landcover = torch.nan_to_num(x[:, lc, ...], nan=0.0).to(torch.uint8)
+        x_dynamic = torch.cat([x[:, :lc, ...], x[:, lc + 1:, ...]], dim=1).half()
+        return x_dynamic, landcover, y.to(torch.uint8)
+
+    def expand_compact_batch(self, batch, means=None, stds=None, one_hot_matrix=None):
+        """_summary_ Counterpart of compact_features for whole batches, meant to be called on the target device, e.g. in
+        on_after_batch_transfer. Produces the same batches as the dataset would with compact_batches set to False.
 
+        Args:
+            batch (_type_): _description_ Collated (x_dynamic, landcover, y) or (x_dynamic, landcover, y, doy) tuple.
+            means, stds, one_hot_matrix (_type_, optional): _description_. See expand_features. Should be on the same device as the batch.
+
+        Returns:
+            _type_: _description_ (x, y) or (x, y, doy) tuple, as returned by __getitem__ with compact_batches set to False.
+        """
+        if self.return_doy:
+            x_dynamic, landcover, y, doys = batch
+        else:
+            x_dynamic, landcover, y = batch
+
+        lc = self.landcover_band_position
+        if lc is None:
+            x = x_dynamic.float()
+        else:
+            x = torch.cat([x_dynamic[..., :lc, :, :].float(), landcover.unsqueeze(-3).float(),
+                           x_dynamic[..., lc:, :, :].float()], dim=-3)
+        x = self.expand_features(x, means, stds, one_hot_matrix)
+        x = self.select_features(x, batched=True)
+        y = y.long()
+        # Padding added by pad_collate
+        y[y == COMPACT_PADDING_LABEL] = PADDING_LABEL
+
+        if self.return_doy:
+            return x, y, doys
         return x, y
 
     def augment(self, x, y):
         """_summary_ Applies geometric transformations: 
           1. random square cropping, preferring images with a) fire pixels in the output and b) (with much less weight) fire pixels in the input
-          2. rotate by multiples of 90°
-          3. flip horizontally and vertically
+          2. flip horizontally and vertically
+          3. rotate by multiples of 90°
         Adjustment of angles is done as in https://github.com/google-research/google-research/blob/master/simulation_research/next_day_wildfire_spread/image_utils.py
 
         Args:
@@ -378,58 +831,112 @@ class FireSpreadDataset(Dataset):
         """
 
         # Need square crop to prevent rotation from creating/destroying data at the borders, due to uneven side lengths.
-        # Try several crops, prefer the ones with most fire pixels in output, followed by most fire_pixels in input
-        best_n_fire_pixels = -1
-        best_crop = (None, None)
-
-        for i in range(10):
-            top = np.random.randint(0, x.shape[-2] - self.crop_side_length)
-            left = np.random.randint(0, x.shape[-1] - self.crop_side_length)
-            x_crop = TF.crop(
-                x, top, left, self.crop_side_length, self.crop_side_length)
-            y_crop = TF.crop(
-                y, top, left, self.crop_side_length, self.crop_side_length)
-
-            # We really care about having fire pixels in the target. But if we don't find any there,
-            # we care about fire pixels in the input, to learn to predict that no new observations will be made,
-            # even though previous days had active fires.
-            n_fire_pixels = x_crop[:, -1, ...].mean() + \
-                1000 * y_crop.float().mean()
-            if n_fire_pixels > best_n_fire_pixels:
-                best_n_fire_pixels = n_fire_pixels
-                best_crop = (x_crop, y_crop)
-
-        x, y = best_crop
+        # Try several crops, prefer the ones with most fire pixels in output, followed by most fire_pixels in input.
+        # Samples read via read_crop_window have been cropped in the same way already.
+        if tuple(y.shape[-2:]) != (self.crop_side_length, self.crop_side_length):
+            top, left = self.select_crop_window(y, x[:, -1, ...])
+            x = x[..., top:top + self.crop_side_length, left:left + self.crop_side_length]
+            y = y[..., top:top + self.crop_side_length, left:left + self.crop_side_length]
 
         hflip = bool(np.random.random() > 0.5)
         vflip = bool(np.random.random() > 0.5)
         rotate = int(np.floor(np.random.random() * 4))
-        if hflip:
-            x = TF.hflip(x)
-            y = TF.hflip(y)
-            # Adjust angles
-            x[:, self.indices_of_degree_features, ...] = 360 - \
-                x[:, self.indices_of_degree_features, ...]
+        x, y = self.dihedral_transform(x, y, hflip, vflip, rotate)
+
+        return x, y
+
+    def dihedral_transform(self, x, y, hflip: bool, vflip: bool, rotate: int):
+        """_summary_ Flips horizontally, then vertically, then rotates by rotate * 90° counter-clockwise, and corrects the 
+        degree features accordingly. This is equivalent to applying TF.hflip, TF.vflip and TF.rotate one after the other, 
+        but the composition of the three is one of the 8 symmetries of the square, which can be expressed as an optional 
+        transposition (a view) followed by flips. The result is therefore materialized with at most a single copy, and the 
+        angle corrections are composed into one affine map that is applied in one pass.
+
+        Args:
+            x (_type_): _description_ Input data, of shape (time_steps, features, height, width), with height == width if rotate is odd.
+            y (_type_): _description_ Target data, of shape (height, width)
+            hflip (bool): _description_ Whether to flip horizontally.
+            vflip (bool): _description_ Whether to flip vertically.
+            rotate (int): _description_ Number of counter-clockwise rotations by 90°.
 
+        Returns:
+            _type_: _description_
+        """
+        # Track the composed transformation as flip(transpose^transpose(img)). A horizontal/vertical flip of that toggles 
+        # the flip of the width/height axis. A counter-clockwise rotation by 90° is a vertical flip of the transposed image, 
+        # and transposing swaps which axes the existing flips refer to.
+        transpose, flip_h, flip_w = False, False, False
+        # Angles are transformed as angle -> (angle_sign * angle + angle_offset) % 360
+        angle_sign, angle_offset = 1, 0
+        if hflip:
+            flip_w = not flip_w
+            angle_sign, angle_offset = -angle_sign, 360 - angle_offset
         if vflip:
-            x = TF.vflip(x)
-            y = TF.vflip(y)
-            # Adjust angles
+            flip_h = not flip_h
+            angle_sign, angle_offset = -angle_sign, 180 - angle_offset
+        for _ in range(rotate % 4):
+            transpose, flip_h, flip_w = not transpose, not flip_w, flip_h
+        angle_offset -= 90 * (rotate % 4)
+
+        if transpose:
+            x = x.transpose(-2, -1)
+            y = y.transpose(-2, -1)
+        flip_dims = [dim for dim, flip in [(-2, flip_h), (-1, flip_w)] if flip]
+        if flip_dims:
+            x = x.flip(flip_dims)
+            y = y.flip(flip_dims)
+
+        # Adjust angles
+        if angle_sign != 1 or angle_offset % 360 != 0:
             x[:, self.indices_of_degree_features, ...] = (
-                180 - x[:, self.indices_of_degree_features, ...]) % 360
+                angle_sign * x[:, self.indices_of_degree_features, ...] + angle_offset) % 360
+
+        return x, y
 
-        if rotate != 0:
-            angle = rotate * 90
-            x = TF.rotate(x, angle)
-            y = torch.unsqueeze(y, 0)
-            y = TF.rotate(y, angle)
-            y = torch.squeeze(y, 0)
+    def select_crop_window(self, target_mask, input_af):
+        """_summary_ Chooses the top left corner of the square training crop. Crops are scored by the mean of the target
+        fire mask and (with much less weight) the mean of the input active fire features, via integral images of both.
+        This scores each candidate window in constant time, without slicing the full feature tensor.
 
-            # Adjust angles
-            x[:, self.indices_of_degree_features, ...] = (x[:, self.indices_of_degree_features,
-                                                          ...] - 90 * rotate) % 360
+        Args:
+            target_mask (_type_): _description_ Binary target mask, of shape (height, width)
+            input_af (_type_): _description_ Active fire features of the input days, of shape (time_steps, height, width)
 
-        return x, y
+        Returns:
+            _type_: _description_ Tuple (top, left) of the best scoring candidate window.
+        """
+        c = self.crop_side_length
+        H, W = target_mask.shape[-2:]
+
+        def integral_image(a):
+            integral = torch.zeros(H + 1, W + 1, dtype=torch.float64)
+            integral[1:, 1:] = a.to(torch.float64).cumsum(0).cumsum(1)
+            return integral
+
+        def window_sums(integral, tops, lefts):
+            return integral[tops + c, lefts + c] - integral[tops, lefts + c] - integral[tops + c, lefts] + integral[tops, lefts]
+
+        if self.n_crop_candidates is None:
+            tops, lefts = torch.meshgrid(torch.arange(H - c), torch.arange(W - c), indexing="ij")
+            tops, lefts = tops.flatten(), lefts.flatten()
+        else:
+            positions = torch.from_numpy(np.random.randint(0, [H - c, W - c], size=(self.n_crop_candidates, 2)))
+            tops, lefts = positions[:, 0], positions[:, 1]
+
+        # We really care about having fire pixels in the target. But if we don't find any there,
+        # we care about fire pixels in the input, to learn to predict that no new observations will be made,
+        # even though previous days had active fires.
+        scores = window_sums(integral_image(input_af.sum(dim=0)), tops, lefts) / (input_af.shape[0] * c * c) + \
+            1000 * window_sums(integral_image(target_mask), tops, lefts) / (c * c)
+
+        if self.n_crop_candidates is None:
+            # When scoring all windows, pick randomly among equally good ones, to keep some variety in the crops.
+            best_ids = torch.nonzero(scores == scores.max()).flatten()
+            best_id = best_ids[np.random.randint(0, len(best_ids))]
+        else:
+            best_id = torch.argmax(scores)
+
+        return int(tops[best_id]), int(lefts[best_id])
 
     def center_crop_x32(self, x, y):
         """_summary_ Crops the center of the image to side lengths that are a multiple of 32, 
@@ -450,6 +957,24 @@ class FireSpreadDataset(Dataset):
         y = TF.center_crop(y, (H_new, W_new))
         return x, y
 
+    def get_sample_shapes(self):
+        """_summary_ Returns the (height, width) of each sample's images after preprocessing, without loading them. 
+        With is_train=True, this is the crop size. Otherwise, it's the size after center_crop_x32.
+
+        Returns:
+            _type_: _description_ Array of shape (len(self), 2).
+        """
+        shapes = np.zeros((len(self), 2), dtype=np.int64)
+        start = 0
+        for (fire_year, fire_name), end in zip(self.fire_keys, self.fire_end_offsets):
+            if self.is_train:
+                shapes[start:end] = self.crop_side_length
+            elif end > start:
+                _, H, W = self.fire_inventory[fire_year][fire_name]["shape"]
+                shapes[start:end] = [H // 32 * 32, W // 32 * 32]
+            start = end
+        return shapes
+
     def flatten_and_remove_duplicate_features_(self, x):
         """_summary_ For a simple U-Net, static and forecast features can be removed everywhere but in the last time step
         to reduce the number of features. Since that would result in different numbers of channels for different
@@ -457,42 +982,140 @@ class FireSpreadDataset(Dataset):
         Also discards features that we don't want to use. 
 
         Args:
-            x (_type_): _description_ Input tensor data of shape (n_leading_observations, n_features, height, width)
+            x (_type_): _description_ Input tensor data of shape (n_leading_observations, n_features, height, width), 
+            optionally with a leading batch dimension.
 
         Returns:
             _type_: _description_
         """
-        static_feature_ids, dynamic_feature_ids = self.get_static_and_dynamic_features_to_keep(self.features_to_keep)
-        dynamic_feature_ids = torch.tensor(dynamic_feature_ids).int()
+        static_feature_ids, dynamic_feature_ids = self.get_static_and_dynamic_features_to_keep(
+            self.features_to_keep, self.landcover_as_index)
+        # Feature ids refer to the full layout, but x only contains the channels derived from bands_to_read
+        dynamic_feature_positions = torch.tensor(
+            [self.expanded_channel_positions[feature_id] for feature_id in dynamic_feature_ids]).int()
+
+        x_dynamic_only = x[..., :-1, dynamic_feature_positions, :, :].flatten(start_dim=-4, end_dim=-3)
+        if self.channels_to_keep is None:
+            x_last_day = x[..., -1, :, :, :]
+        else:
+            x_last_day = x[..., -1, self.channel_positions_to_keep, :, :]
+
+        return torch.cat([x_dynamic_only, x_last_day], axis=-3)
 
-        x_dynamic_only = x[:-1, dynamic_feature_ids, :, :].flatten(start_dim=0, end_dim=1)
-        x_last_day = x[-1, self.features_to_keep, ...].squeeze(0)
+    @staticmethod
+    def map_features_to_keep(features_to_keep:Optional[List[int]], landcover_as_index:bool = False):
+        """_summary_ Maps feature indices from 0 to 39 to the channel layout that the dataset produces. 
+        If landcover_as_index is True, the 17 one-hot land cover features 16 to 32 are a single channel 16, 
+        and all following features move down by 16.
+
+        Args:
+            features_to_keep (Optional[List[int]]): _description_ Feature indices from 0 to 39, or None.
+            landcover_as_index (bool, optional): _description_. Defaults to False.
 
-        return torch.cat([x_dynamic_only, x_last_day], axis=0)
+        Raises:
+            ValueError: _description_ If landcover_as_index is True and only some of the land cover features are kept.
+
+        Returns:
+            _type_: _description_ Channel indices, in the same order as features_to_keep, or None.
+        """
+        if type(features_to_keep) != list or not landcover_as_index:
+            return features_to_keep
+
+        landcover_feature_ids = set(range(16,33))
+        kept_landcover_ids = landcover_feature_ids & set(features_to_keep)
+        if len(kept_landcover_ids) not in [0, len(landcover_feature_ids)]:
+            raise ValueError(f"With landcover_as_index, features_to_keep must contain all or none of the land cover features 16 to 32, "
+                             f"but got {sorted(kept_landcover_ids)}.")
+
+        channels_to_keep = []
+        for feature_id in features_to_keep:
+            if feature_id < 16:
+                channels_to_keep.append(feature_id)
+            elif feature_id >= 33:
+                channels_to_keep.append(feature_id - 16)
+            elif 16 not in channels_to_keep:
+                channels_to_keep.append(16)
+        return channels_to_keep
 
     @staticmethod
-    def get_static_and_dynamic_feature_ids():
+    def get_bands_to_read(features_to_keep:Optional[List[int]]):
+        """_summary_ Maps feature indices from 0 to 39 back to the bands of the files that they are derived from: Features 0 to 15 
+        are bands 0 to 15, the one-hot land cover features 16 to 32 come from band 16, features 33 to 37 are bands 17 to 21, and 
+        both the active fire feature 38 and the binary active fire mask 39 come from band 22. Band 22 is always read, since it 
+        contains the target and is used to choose training crops.
+
+        Args:
+            features_to_keep (Optional[List[int]]): _description_ Feature indices from 0 to 39, or None.
+
+        Returns:
+            _type_: _description_ Sorted band indices, or None if all bands are needed.
+        """
+        if type(features_to_keep) != list:
+            return None
+        bands = {N_BANDS - 1}
+        for feature_id in features_to_keep:
+            if feature_id < 16:
+                bands.add(feature_id)
+            elif feature_id <= 32:
+                bands.add(LANDCOVER_BAND)
+            elif feature_id <= 38:
+                bands.add(feature_id - 16)
+        if len(bands) == N_BANDS:
+            return None
+        return sorted(bands)
+
+    @staticmethod
+    def get_expanded_channel_ids(bands_to_read:Optional[List[int]], landcover_as_index:bool = False):
+        """_summary_ Returns the ids of the channels that expand_features produces from the given bands, in the layout of 
+        map_features_to_keep, i.e. from 0 to 39, or from 0 to 23 if landcover_as_index is True.
+        """
+        n_landcover_channels = 1 if landcover_as_index else 17
+        expanded_channel_ids = []
+        for band in range(N_BANDS) if bands_to_read is None else bands_to_read:
+            if band < LANDCOVER_BAND:
+                expanded_channel_ids.append(band)
+            elif band == LANDCOVER_BAND:
+                expanded_channel_ids += list(range(LANDCOVER_BAND, LANDCOVER_BAND + n_landcover_channels))
+            else:
+                expanded_channel_ids.append(band + n_landcover_channels - 1)
+        # The binary active fire mask is appended after the active fire band
+        expanded_channel_ids.append(N_BANDS + n_landcover_channels - 1)
+        return expanded_channel_ids
+
+    @staticmethod
+    def get_static_and_dynamic_feature_ids(landcover_as_index:bool = False):
         """_summary_ Returns the indices of static and dynamic features.
         Static features include topographical features and one-hot encoded land cover classes.
 
+        Args:
+            landcover_as_index (bool, optional): _description_. If True, return the indices for the layout with 
+            a single land cover index channel instead of the one-hot encoding. Defaults to False.
+
         Returns:
             _type_: _description_ Tuple of lists of integers, first list contains static feature indices, second list contains dynamic feature indices.
         """
-        static_feature_ids = [12,13,14] + list(range(16,33))
-        dynamic_feature_ids = list(range(12)) + [15] + list(range(33,40))
+        if landcover_as_index:
+            static_feature_ids = [12,13,14,16]
+            dynamic_feature_ids = list(range(12)) + [15] + list(range(17,24))
+        else:
+            static_feature_ids = [12,13,14] + list(range(16,33))
+            dynamic_feature_ids = list(range(12)) + [15] + list(range(33,40))
         return static_feature_ids, dynamic_feature_ids
 
     @staticmethod
-    def get_static_and_dynamic_features_to_keep(features_to_keep:Optional[List[int]]):
+    def get_static_and_dynamic_features_to_keep(features_to_keep:Optional[List[int]], landcover_as_index:bool = False):
         """_summary_ Returns the indices of static and dynamic features that should be kept, based on the input list of feature indices to keep.
 
         Args:
-            features_to_keep (Optional[List[int]]): _description_
+            features_to_keep (Optional[List[int]]): _description_ Feature indices from 0 to 39.
+            landcover_as_index (bool, optional): _description_. Whether to return indices in the layout with a single land cover 
+            index channel, see map_features_to_keep. Defaults to False.
 
         Returns:
             _type_: _description_
         """
-        static_features_to_keep, dynamic_features_to_keep = FireSpreadDataset.get_static_and_dynamic_feature_ids()
+        static_features_to_keep, dynamic_features_to_keep = FireSpreadDataset.get_static_and_dynamic_feature_ids(landcover_as_index)
+        features_to_keep = FireSpreadDataset.map_features_to_keep(features_to_keep, landcover_as_index)
         
         if type(features_to_keep) == list:
             dynamic_features_to_keep = list(set(dynamic_features_to_keep) & set(features_to_keep))
@@ -505,7 +1128,8 @@ class FireSpreadDataset(Dataset):
         return static_features_to_keep, dynamic_features_to_keep
 
     @staticmethod
-    def get_n_features(n_observations:int, features_to_keep:Optional[List[int]], deduplicate_static_features:bool):
+    def get_n_features(n_observations:int, features_to_keep:Optional[List[int]], deduplicate_static_features:bool,
+                       landcover_as_index:bool = False):
         """_summary_ Computes the number of features that the dataset will have after preprocessing, 
         considering the number of input observations, which features to keep or discard, and whether to deduplicate static features.
 
@@ -513,12 +1137,15 @@ class FireSpreadDataset(Dataset):
             n_observations (int): _description_
             features_to_keep (Optional[List[int]]): _description_
             deduplicate_static_features (bool): _description_
+            landcover_as_index (bool, optional): _description_. If True, count land cover as a single channel, as the dataset 
+            returns it with landcover_as_index. The model sees the full count again after embedding land cover. Defaults to False.
 
         Returns:
             _type_: _description_ If deduplicate_static_features is True, returns the total number of features, flattened across all time steps. 
             Otherwise, returns the number of features per time step.
         """
-        static_features_to_keep, dynamic_features_to_keep = FireSpreadDataset.get_static_and_dynamic_features_to_keep(features_to_keep)
+        static_features_to_keep, dynamic_features_to_keep = FireSpreadDataset.get_static_and_dynamic_features_to_keep(
+            features_to_keep, landcover_as_index)
 
         n_static_features = len(static_features_to_keep)
         n_dynamic_features = len(dynamic_features_to_keep)
@@ -530,6 +1157,34 @@ class FireSpreadDataset(Dataset):
 
         return n_features
 
+    @staticmethod
+    def get_landcover_channel_ids(n_observations:int, features_to_keep:Optional[List[int]], deduplicate_static_features:bool):
+        """_summary_ Computes at which channel indices the land cover index channel ends up in the data returned with landcover_as_index.
+        These are the channels that the model has to embed, see landcover_channel_ids in BaseModel. 
+
+        Args:
+            n_observations (int): _description_
+            features_to_keep (Optional[List[int]]): _description_ Feature indices from 0 to 39.
+            deduplicate_static_features (bool): _description_
+
+        Returns:
+            _type_: _description_ List of channel indices. If deduplicate_static_features is True and n_observations > 1, the indices 
+            refer to the flattened channel dimension, otherwise to the channels of each time step. Empty if land cover is not kept.
+        """
+        channels_to_keep = FireSpreadDataset.map_features_to_keep(features_to_keep, landcover_as_index=True)
+        if type(channels_to_keep) != list:
+            channels_to_keep = list(range(24))
+        if 16 not in channels_to_keep:
+            return []
+
+        # Land cover is static, so with deduplication, it only occurs in the last time step, after the dynamic features of all previous days.
+        n_preceding_channels = 0
+        if deduplicate_static_features and n_observations > 1:
+            _, dynamic_features_to_keep = FireSpreadDataset.get_static_and_dynamic_features_to_keep(
+                features_to_keep, landcover_as_index=True)
+            n_preceding_channels = len(dynamic_features_to_keep) * (n_observations - 1)
+        return [n_preceding_channels + channels_to_keep.index(16)]
+
 
     @staticmethod
     def img_dates_to_doys(img_dates):
@@ -621,24 +1276,38 @@ class FireSpreadDataset(Dataset):
 
         for year, fires_in_year in self.imgs_per_fire.items():
             for fire_name, img_files in fires_in_year.items():
-                imgs = []
-                lnglat = None
-                for img_path in img_files:
-                    with rasterio.open(img_path, 'r') as ds:
-                        imgs.append(ds.read())
-                        if lnglat is None:
-                            lnglat = ds.lnglat()
-                x = np.stack(imgs, axis=0)
-
-                # Get dates from filenames
-                img_dates = [img_path.split("/")[-1].split("_")[0].replace(".tif", "")
-                             for img_path in img_files]
-
-                # Active fire masks have nans where no detections occur. In general, we want to replace NaNs with
-                # the mean of the respective feature. Since the NaNs here don't represent missing values, we replace
-                # them with 0 instead.
-                x[:, -1, ...] = np.nan_to_num(x[:, -1, ...], nan=0)
-
-                # Turn active fire detection time from hhmm to hh.
-                x[:, -1, ...] = np.floor_divide(x[:, -1, ...], 100)
-                yield year, fire_name, img_dates, lnglat, x
\ No newline at end of file
+                img_dates, lnglat, x = self.load_fire_for_hdf5(img_files)
+                yield year, fire_name, img_dates, lnglat, x
+
+    @staticmethod
+    def load_fire_for_hdf5(img_files: List[str]):
+        """_summary_ Loads all TIF images of a single fire and applies the preprocessing steps of get_generator_for_hdf5. 
+        Separate from the generator, so that fires can be converted independently, e.g. in a process pool.
+
+        Args:
+            img_files (List[str]): _description_ Sorted paths of the fire's TIF files.
+
+        Returns:
+            _type_: _description_ Tuple of (img_dates, lnglat, img_array), see get_generator_for_hdf5.
+        """
+        imgs = []
+        lnglat = None
+        for img_path in img_files:
+            with rasterio.open(img_path, 'r') as ds:
+                imgs.append(ds.read())
+                if lnglat is None:
+                    lnglat = ds.lnglat()
+        x = np.stack(imgs, axis=0)
+
+        # Get dates from filenames
+        img_dates = [img_path.split("/")[-1].split("_")[0].replace(".tif", "")
+                     for img_path in img_files]
+
+        # Active fire masks have nans where no detections occur. In general, we want to replace NaNs with
+        # the mean of the respective feature. Since the NaNs here don't represent missing values, we replace
+        # them with 0 instead.
+        x[:, -1, ...] = np.nan_to_num(x[:, -1, ...], nan=0)
+
+        # Turn active fire detection time from hhmm to hh.
+        x[:, -1, ...] = np.floor_divide(x[:, -1, ...], 100)
+        return img_dates, lnglat, x
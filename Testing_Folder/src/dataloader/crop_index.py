@@ -0,0 +1,59 @@
+from typing import Tuple
+
+import numpy as np
+
+# Names of the side datasets that CreateHDF5Dataset writes next to "data"
+FIRE_PIXELS_NAME = "fire_pixels"
+FIRE_PIXEL_VALUES_NAME = "fire_pixel_values"
+FIRE_PIXEL_OFFSETS_NAME = "fire_pixel_offsets"
+
+
+def compute_crop_index(active_fire: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """_summary_ Computes the sparse index of active fire pixels of a fire, which FireSpreadDataset uses to choose a
+    training crop before reading any feature data.
+
+    Args:
+        active_fire (np.ndarray): _description_ Active fire feature of all days, of shape (days, height, width),
+        with detection times in hours and 0 where there is no detection.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: _description_ (fire_pixels, fire_pixel_values, fire_pixel_offsets).
+        fire_pixels is an int16 array of shape (n, 2) with the (row, column) of every pixel with a detection, grouped by day.
+        fire_pixel_values contains the float32 detection times of these pixels. The pixels of day d are
+        fire_pixels[fire_pixel_offsets[d]:fire_pixel_offsets[d + 1]].
+    """
+    if max(active_fire.shape[1:]) > np.iinfo(np.int16).max:
+        raise ValueError(f"Images of shape {active_fire.shape[1:]} are too large for int16 pixel coordinates.")
+    days, rows, cols = np.nonzero(np.nan_to_num(active_fire, nan=0) > 0)
+    fire_pixels = np.stack([rows, cols], axis=1).astype(np.int16)
+    fire_pixel_values = active_fire[days, rows, cols].astype(np.float32)
+    fire_pixel_offsets = np.searchsorted(days, np.arange(active_fire.shape[0] + 1)).astype(np.int64)
+    return fire_pixels, fire_pixel_values, fire_pixel_offsets
+
+
+def read_active_fire_from_crop_index(f, start_index: int, end_index: int, height: int, width: int) -> np.ndarray:
+    """_summary_ Reconstructs the active fire feature of the days [start_index, end_index) of a fire from its crop index,
+    which only requires reading the (few) fire pixels instead of the full images.
+
+    Args:
+        f (_type_): _description_ Open HDF5 file that contains the crop index.
+        start_index (int): _description_
+        end_index (int): _description_
+        height (int): _description_ Image height.
+        width (int): _description_ Image width.
+
+    Returns:
+        np.ndarray: _description_ float32 array of shape (end_index - start_index, height, width).
+    """
+    offsets = f[FIRE_PIXEL_OFFSETS_NAME][start_index:end_index + 1]
+    fire_pixels = f[FIRE_PIXELS_NAME][offsets[0]:offsets[-1]]
+    fire_pixel_values = f[FIRE_PIXEL_VALUES_NAME][offsets[0]:offsets[-1]]
+    days = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    active_fire = np.zeros((len(offsets) - 1, height, width), dtype=np.float32)
+    active_fire[days, fire_pixels[:, 0], fire_pixels[:, 1]] = fire_pixel_values
+    return active_fire
+
+
+def has_crop_index(f) -> bool:
+    return FIRE_PIXEL_OFFSETS_NAME in f
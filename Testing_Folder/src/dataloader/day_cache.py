@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+
+class DayCache:
+    """_summary_ Least-recently-used cache of decoded images, one entry per fire-day.
+
+    With n_leading_observations = k, consecutive samples of a fire share k of their k+1 days. If samples of the same
+    fire are loaded close to each other, e.g. with FireLocalitySampler, each day only needs to be read and decoded once.
+    Like HDF5HandlePool, each process (i.e. every DataLoader worker) owns its own cache, which is empty after forking
+    or unpickling. The cache can be used from several threads, e.g. by ReadAheadPrefetcher.
+    """
+
+    def __init__(self, max_days: int):
+        """_summary_
+
+        Args:
+            max_days (int): _description_ Maximum number of cached images. Each image takes features * height * width * 4 bytes.
+        """
+        if max_days < 1:
+            raise ValueError(f"max_days must be at least 1, but got {max_days=}.")
+        self.max_days = max_days
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._imgs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """_summary_ Returns the cached image for key, or None. The returned array is shared with the cache and must not be modified.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            img = self._imgs.get(key)
+            if img is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._imgs.move_to_end(key)
+        return img
+
+    def put(self, key: Hashable, img: np.ndarray):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            self._imgs[key] = img
+            self._imgs.move_to_end(key)
+            while len(self._imgs) > self.max_days:
+                self._imgs.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._pid == os.getpid() and key in self._imgs
+
+    def __len__(self):
+        return len(self._imgs) if self._pid == os.getpid() else 0
+
+    def __getstate__(self):
+        # Cached images are not sent along, e.g. when the dataset is sent to spawned DataLoader workers.
+        return {"max_days": self.max_days}
+
+    def __setstate__(self, state):
+        self.max_days = state["max_days"]
+        self._reset()
@@ -0,0 +1,132 @@
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .flat_array_store import FlatArrayStore
+from .inventory import load_year_inventory
+from .resident_store import ResidentStore
+from .utils import get_means_stds_missing_values
+
+
+class FireCatalog:
+    """_summary_ Keeps the data of a dataset directory that doesn't depend on the data fold: the inventory of the fires
+    of each year, the channel statistics of each set of training years, and the fires of each year that are resident
+    in shared memory, see ResidentStore.
+
+    Every FireSpreadDataset uses a catalog, and FireSpreadDataModule shares one between its training, validation and
+    test set. Since the twelve data folds only combine four years, passing the same catalog to the data modules of
+    several folds, see src/run_folds.py, means that each year is listed, and read into memory, only once. Resident
+    stores are shared memory, so they are shared with DataLoader workers and with processes the catalog is sent to.
+    """
+
+    def __init__(self, data_dir: str, data_format: str, use_inventory_cache: bool = True):
+        """_summary_
+
+        Args:
+            data_dir (str): _description_ Root directory of the dataset.
+            data_format (str): _description_ One of "tif", "hdf5" or "memmap".
+            use_inventory_cache (bool, optional): _description_ See load_year_inventory. Defaults to True.
+        """
+        self.data_dir = data_dir
+        self.data_format = data_format
+        self.use_inventory_cache = use_inventory_cache
+        self.year_inventories: Dict[int, dict] = {}
+        self.statistics: Dict[Tuple[int, ...], tuple] = {}
+        # Maps (year, bands) to the resident fires of that year, least recently used first
+        self.resident_stores: Dict[Tuple[int, Optional[Tuple[int, ...]]], ResidentStore] = {}
+
+    def matches(self, data_dir: str, data_format: str, use_inventory_cache: bool) -> bool:
+        """_summary_ Checks whether the catalog describes the given dataset directory and storage format.
+        """
+        return (self.data_dir, self.data_format, self.use_inventory_cache) == (data_dir, data_format, use_inventory_cache)
+
+    def get_year_inventory(self, year: int) -> dict:
+        """_summary_ Returns the inventory of all fires of a year, see load_year_inventory. Fires in memmap files are
+        listed from the index of their year, see FlatArrayStore.
+        """
+        if year not in self.year_inventories:
+            if self.data_format == "memmap":
+                data_path, _ = FlatArrayStore.get_paths(self.data_dir, year)
+                self.year_inventories[year] = {
+                    fire_name: {"files": [str(data_path)], "n_imgs": fire["shape"][0], "shape": fire["shape"][1:],
+                                "img_dates": fire["img_dates"]}
+                    for fire_name, fire in FlatArrayStore(self.data_dir).load_index(year)["fires"].items()}
+            else:
+                self.year_inventories[year] = load_year_inventory(self.data_dir, year, self.data_format,
+                                                                  use_cache=self.use_inventory_cache)
+        return self.year_inventories[year]
+
+    def get_means_stds_missing_values(self, years: List[int]):
+        """_summary_ Returns the statistics of the given training years, see get_means_stds_missing_values.
+        """
+        key = tuple(years)
+        if key not in self.statistics:
+            self.statistics[key] = get_means_stds_missing_values(list(years), data_dir=self.data_dir,
+                                                                 data_format=self.data_format,
+                                                                 use_inventory_cache=self.use_inventory_cache)
+        return self.statistics[key]
+
+    def get_missing_resident_fires(self, fire_shapes: Dict[Hashable, Tuple[int, ...]],
+                                   bands: Optional[List[int]]) -> Dict[Hashable, Tuple[int, ...]]:
+        """_summary_ Returns the shapes of the fires of all years that are not resident yet, and would be read by make_resident.
+
+        Args:
+            fire_shapes (Dict[Hashable, Tuple[int, ...]]): _description_ Maps (year, fire name) to the shape of its images.
+            bands (Optional[List[int]]): _description_ Bands of the resident images, or None for all bands.
+        """
+        missing_fire_shapes = {}
+        for year, year_fire_shapes in self._group_by_year(fire_shapes).items():
+            store = self.resident_stores.get((year, self._bands_key(bands)))
+            if store is None or any(fire_key not in store.fire_slices for fire_key in year_fire_shapes):
+                missing_fire_shapes.update(year_fire_shapes)
+        return missing_fire_shapes
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(store.nbytes for store in self.resident_stores.values())
+
+    def make_resident(self, fire_shapes: Dict[Hashable, Tuple[int, ...]], bands: Optional[List[int]],
+                      read_fire: Callable[[int, str], np.ndarray], max_bytes: Optional[int] = None) -> List[ResidentStore]:
+        """_summary_ Makes the given fires resident, one ResidentStore per year. Years that are already resident with the
+        same bands are reused. To stay within max_bytes, resident years that are not requested are released, least
+        recently used first. The caller checks that the requested fires themselves fit into max_bytes.
+
+        Args:
+            fire_shapes (Dict[Hashable, Tuple[int, ...]]): _description_ Maps (year, fire name) to the shape of its images.
+            bands (Optional[List[int]]): _description_ Bands of the resident images, or None for all bands.
+            read_fire (Callable[[int, str], np.ndarray]): _description_ Reads all images of a fire, given its year and name.
+            max_bytes (Optional[int], optional): _description_ Memory budget of all resident years of the catalog. Defaults to None.
+
+        Returns:
+            List[ResidentStore]: _description_ The stores of the requested years.
+        """
+        fire_shapes_per_year = {(year, self._bands_key(bands)): year_fire_shapes
+                                for year, year_fire_shapes in self._group_by_year(fire_shapes).items()}
+        if max_bytes is not None:
+            new_bytes = ResidentStore.get_size(self.get_missing_resident_fires(fire_shapes, bands))
+            for key in list(self.resident_stores):
+                if key not in fire_shapes_per_year and self.resident_bytes + new_bytes > max_bytes:
+                    del self.resident_stores[key]
+
+        stores = []
+        for key, year_fire_shapes in fire_shapes_per_year.items():
+            store = self.resident_stores.pop(key, None)
+            if store is None or any(fire_key not in store.fire_slices for fire_key in year_fire_shapes):
+                store = ResidentStore(year_fire_shapes)
+                for fire_year, fire_name in year_fire_shapes:
+                    store.put((fire_year, fire_name), read_fire(fire_year, fire_name))
+            # Re-inserting marks the year as most recently used
+            self.resident_stores[key] = store
+            stores.append(store)
+        return stores
+
+    @staticmethod
+    def _group_by_year(fire_shapes: Dict[Hashable, Tuple[int, ...]]) -> Dict[int, Dict[Hashable, Tuple[int, ...]]]:
+        fire_shapes_per_year = {}
+        for (fire_year, fire_name), shape in fire_shapes.items():
+            fire_shapes_per_year.setdefault(fire_year, {})[(fire_year, fire_name)] = shape
+        return fire_shapes_per_year
+
+    @staticmethod
+    def _bands_key(bands: Optional[List[int]]) -> Optional[Tuple[int, ...]]:
+        return None if bands is None else tuple(bands)
@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+
+class FlatArrayStore:
+    """_summary_ Storage backend that keeps all fires of a year back to back in one uncompressed binary file,
+    which is read via np.memmap. Each year directory consists of two files:
+      <data_dir>/<year>.bin: raw array data of all fires of that year, in the order of the index.
+      <data_dir>/<year>.json: index that maps each fire name to its element offset in the binary file, its shape
+      (days, features, height, width), the dates of its images and its longitude/latitude.
+    The files are created from an HDF5 dataset by src/preprocess/CreateFlatArrayDataset.py.
+
+    The memory maps are opened lazily in each process, and are not pickled, e.g. when sending the dataset to
+    DataLoader workers. Slicing a fire's array is zero-copy; data is only read from the page cache when it is accessed.
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.indices: Dict[int, dict] = {}
+        self._arrays: Dict[int, np.memmap] = {}
+
+    @staticmethod
+    def get_paths(data_dir: str, year: int):
+        """_summary_ Returns the paths of the binary data file and the index file of the given year.
+        """
+        return Path(data_dir) / f"{year}.bin", Path(data_dir) / f"{year}.json"
+
+    def load_index(self, year: int) -> dict:
+        """_summary_ Reads the index of the given year, see class description.
+
+        Returns:
+            dict: _description_ Index with keys "dtype" and "fires", the latter mapping fire names to dictionaries
+            with keys "offset", "shape", "img_dates" and "lnglat".
+        """
+        if year not in self.indices:
+            _, index_path = self.get_paths(self.data_dir, year)
+            with open(index_path, "r") as f:
+                self.indices[year] = json.load(f)
+        return self.indices[year]
+
+    def get_fire(self, year: int, fire_name: str) -> np.ndarray:
+        """_summary_ Returns a read-only view of all images of a fire, of shape (days, features, height, width).
+        Needs to be copied before it is modified.
+        """
+        index = self.load_index(year)
+        if year not in self._arrays:
+            data_path, _ = self.get_paths(self.data_dir, year)
+            self._arrays[year] = np.memmap(data_path, dtype=np.dtype(index["dtype"]), mode="r")
+
+        fire = index["fires"][fire_name]
+        n_elements = int(np.prod(fire["shape"]))
+        return self._arrays[year][fire["offset"]:fire["offset"] + n_elements].reshape(fire["shape"])
+
+    def __getstate__(self):
+        # Pickling a memmap would copy its whole content
+        return {"data_dir": self.data_dir, "indices": self.indices}
+
+    def __setstate__(self, state):
+        self.data_dir = state["data_dir"]
+        self.indices = state["indices"]
+        self._arrays = {}
@@ -0,0 +1,138 @@
+import os
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from multiprocessing import util as mp_util
+
+import h5py
+
+try:
+    # Registers additional compression filters (e.g. blosc, lz4) that files written by CreateHDF5Dataset may use.
+    import hdf5plugin  # noqa: F401
+except ImportError:
+    pass
+
+
+class HDF5HandlePool:
+    """_summary_ Least-recently-used pool of open, read-only HDF5 file handles.
+
+    Each process (i.e. the main process and every DataLoader worker) owns its own handles. Handles are opened
+    lazily on first access, so nothing is opened before the workers are started. If the pool is used in a process
+    that was forked from the process that opened the handles, the inherited handles are discarded instead of
+    being reused, since HDF5 handles can't safely be shared between processes. All handles are closed when the
+    owning process shuts down.
+
+    Threads of a process share its handles, e.g. the reader threads of ReadAheadPrefetcher. A handle is only used
+    within a lease, see lease, and handles that are leased are never closed by eviction, so that a thread can't close
+    a file while another thread still reads from it.
+    """
+
+    def __init__(self, max_open_files: int = 64):
+        """_summary_
+
+        Args:
+            max_open_files (int, optional): _description_ Maximum number of simultaneously open files per process.
+            When exceeded, the least recently used file that isn't leased is closed. Defaults to 64.
+        """
+        if max_open_files < 1:
+            raise ValueError(f"max_open_files must be at least 1, but got {max_open_files=}.")
+        self.max_open_files = max_open_files
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._handles = OrderedDict()
+        # Number of active leases per path
+        self._leases = Counter()
+        self._lock = threading.Lock()
+        self._finalizer_registered = False
+
+    @contextmanager
+    def lease(self, path: str):
+        """_summary_ Context manager that provides an open read-only handle for the given file, opening it if necessary.
+        The handle stays open until the context is left, even if other threads open more than max_open_files files
+        in the meantime.
+
+        Args:
+            path (str): _description_ Path to the HDF5 file.
+
+        Yields:
+            h5py.File: _description_ Open file handle. Must not be closed by the caller, or used after the context is left.
+        """
+        f = self._acquire(path)
+        try:
+            yield f
+        finally:
+            with self._lock:
+                self._leases[path] -= 1
+                if self._leases[path] == 0:
+                    del self._leases[path]
+                self._evict()
+
+    def _acquire(self, path: str) -> h5py.File:
+        if self._pid != os.getpid():
+            # Forked from another process: drop the inherited handles without touching them.
+            self._reset()
+
+        with self._lock:
+            self._leases[path] += 1
+            f = self._handles.get(path)
+            if f is not None:
+                self._handles.move_to_end(path)
+                return f
+
+            if not self._finalizer_registered:
+                # Runs on interpreter exit in the main process, and on shutdown of multiprocessing workers.
+                mp_util.Finalize(self, HDF5HandlePool._close_handles, args=(self._handles,), exitpriority=10)
+                self._finalizer_registered = True
+
+            try:
+                f = h5py.File(path, 'r')
+            except Exception:
+                self._leases[path] -= 1
+                if self._leases[path] == 0:
+                    del self._leases[path]
+                raise
+            self._handles[path] = f
+            self._evict()
+            return f
+
+    def _evict(self):
+        """_summary_ Closes the least recently used handles that aren't leased, until at most max_open_files are open.
+        Must be called with the lock held. If too many handles are leased, more than max_open_files stay open until
+        their leases end.
+        """
+        for path in list(self._handles):
+            if len(self._handles) <= self.max_open_files:
+                break
+            if path not in self._leases:
+                self._handles.pop(path).close()
+
+    def close_all(self):
+        """_summary_ Closes all handles owned by the current process.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+            return
+        with self._lock:
+            HDF5HandlePool._close_handles(self._handles)
+
+    @staticmethod
+    def _close_handles(handles):
+        while handles:
+            _, f = handles.popitem()
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    def __len__(self):
+        return len(self._handles) if self._pid == os.getpid() else 0
+
+    def __getstate__(self):
+        # Open handles can't be pickled, e.g. when the dataset is sent to spawned DataLoader workers.
+        return {"max_open_files": self.max_open_files}
+
+    def __setstate__(self, state):
+        self.max_open_files = state["max_open_files"]
+        self._reset()
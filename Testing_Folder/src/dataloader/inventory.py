@@ -0,0 +1,143 @@
+import glob
+import json
+import os
+import warnings
+from pathlib import Path
+from typing import Optional
+
+import rasterio
+
+from .hdf5_pool import HDF5HandlePool
+
+INVENTORY_MANIFEST_NAME = ".fire_inventory.json"
+INVENTORY_VERSION = 1
+
+
+def _mtime(path) -> int:
+    return os.stat(path).st_mtime_ns
+
+
+def _scan_tif_year(year_dir: str) -> dict:
+    """_summary_ Lists all fires of a year in the TIF layout, i.e. <year_dir>/<fire_name>/<date>.tif.
+    """
+    fires = {}
+    for fire_dir_path in sorted(glob.glob(f"{year_dir}/*/")):
+        fire_name = fire_dir_path.split("/")[-2]
+        fire_img_paths = sorted(glob.glob(f"{fire_dir_path}/*.tif"))
+        shape = None
+        if fire_img_paths:
+            with rasterio.open(fire_img_paths[0], 'r') as ds:
+                shape = [ds.count, ds.height, ds.width]
+        fires[fire_name] = {
+            "files": [Path(p).name for p in fire_img_paths],
+            "n_imgs": len(fire_img_paths),
+            "shape": shape,
+            "img_dates": [Path(p).name.split("_")[0].replace(".tif", "") for p in fire_img_paths],
+            "mtime": _mtime(fire_dir_path),
+        }
+    return fires
+
+
+def _scan_hdf5_year(year_dir: str, hdf5_pool: HDF5HandlePool) -> dict:
+    """_summary_ Lists all fires of a year in the HDF5 layout, i.e. <year_dir>/<fire_name>.hdf5.
+    """
+    fires = {}
+    for fire_hdf5 in sorted(glob.glob(f"{year_dir}/*.hdf5")):
+        with hdf5_pool.lease(fire_hdf5) as f:
+            dset = f["data"]
+            n_imgs, shape, img_dates = len(dset), list(dset.shape[1:]), [str(img_date) for img_date in dset.attrs["img_dates"]]
+        stat = os.stat(fire_hdf5)
+        fires[Path(fire_hdf5).stem] = {
+            "files": [Path(fire_hdf5).name],
+            "n_imgs": n_imgs,
+            "shape": shape,
+            "img_dates": img_dates,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+    return fires
+
+
+def _is_valid(year_dir: str, data_format: str, entry: dict) -> bool:
+    """_summary_ Checks whether a cached year entry still matches the directory. Files are added to or removed from a
+    directory only by changing its mtime, so only the year directory and each fire directory (TIF) or file (HDF5) need
+    to be checked, instead of listing everything again.
+    """
+    try:
+        if entry["mtime"] != _mtime(year_dir):
+            return False
+        for fire_name, fire in entry["fires"].items():
+            if data_format == "tif":
+                if fire["mtime"] != _mtime(f"{year_dir}/{fire_name}/"):
+                    return False
+            else:
+                stat = os.stat(f"{year_dir}/{fire['files'][0]}")
+                if fire["mtime"] != stat.st_mtime_ns or fire["size"] != stat.st_size:
+                    return False
+    except (OSError, KeyError):
+        return False
+    return True
+
+
+def load_year_inventory(data_dir: str, year: int, data_format: str, use_cache: bool = True,
+                        hdf5_pool: Optional[HDF5HandlePool] = None) -> dict:
+    """_summary_ Returns the inventory of all fires of a year: their files, number of images, image shape and dates.
+    Building the inventory requires listing every directory and opening files. If use_cache is True, the result is
+    persisted in a manifest file in data_dir, and reused as long as the directory and file modification times
+    (and for HDF5, the file sizes) are unchanged.
+
+    Args:
+        data_dir (str): _description_ Root directory of the dataset.
+        year (int): _description_ Year of fires to list.
+        data_format (str): _description_ Either "tif" or "hdf5".
+        use_cache (bool, optional): _description_. Whether to read and write the manifest file. Defaults to True.
+        hdf5_pool (Optional[HDF5HandlePool], optional): _description_. Pool used for opening HDF5 files. Defaults to None,
+        which uses a temporary pool.
+
+    Returns:
+        dict: _description_ Dictionary mapping fire names to dictionaries with keys "files" (absolute paths, sorted),
+        "n_imgs", "shape" (features, height, width) and "img_dates".
+    """
+    if data_format not in ["tif", "hdf5"]:
+        raise ValueError(f"Unknown data format {data_format}, expected tif or hdf5.")
+
+    year_dir = f"{data_dir}/{year}"
+    manifest_path = Path(data_dir) / INVENTORY_MANIFEST_NAME
+    key = f"{data_format}/{year}"
+
+    manifest = {"version": INVENTORY_VERSION, "years": {}}
+    if use_cache and manifest_path.is_file():
+        try:
+            with open(manifest_path, "r") as f:
+                cached_manifest = json.load(f)
+            if cached_manifest.get("version") == INVENTORY_VERSION:
+                manifest = cached_manifest
+        except (OSError, ValueError):
+            pass
+
+    entry = manifest["years"].get(key)
+    if entry is None or not _is_valid(year_dir, data_format, entry):
+        year_mtime = _mtime(year_dir) if os.path.isdir(year_dir) else None
+        if data_format == "tif":
+            fires = _scan_tif_year(year_dir)
+        else:
+            pool = hdf5_pool if hdf5_pool is not None else HDF5HandlePool()
+            fires = _scan_hdf5_year(year_dir, pool)
+            if hdf5_pool is None:
+                pool.close_all()
+        entry = {"mtime": year_mtime, "fires": fires}
+
+        if use_cache and year_mtime is not None:
+            manifest["years"][key] = entry
+            # Write atomically, since several processes might build datasets from the same directory at the same time.
+            tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(manifest, f)
+                os.replace(tmp_path, manifest_path)
+            except OSError as e:
+                warnings.warn(f"Could not write the dataset inventory manifest {manifest_path}: {e}", RuntimeWarning)
+
+    return {fire_name: {**fire, "files": [f"{year_dir}/{fire_name}/{p}" if data_format == "tif" else f"{year_dir}/{p}"
+                                          for p in fire["files"]]}
+            for fire_name, fire in entry["fires"].items()}
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from .statistics import get_year_fingerprint
+
+
+class MaterializedDataset(Dataset):
+    """_summary_ Holds every sample of a dataset as rows of stacked tensors, so that iterating over it only indexes
+    tensors, without reading or preprocessing anything. Only sensible for datasets whose samples are the same in
+    every epoch, e.g. a FireSpreadDataset with a fixed crop_seed.
+    """
+
+    def __init__(self, tensors: Tuple[torch.Tensor, ...]):
+        """_summary_
+
+        Args:
+            tensors (Tuple[torch.Tensor, ...]): _description_ One tensor per element of the samples, e.g. (x, y),
+            stacked along the first dimension.
+        """
+        if len(set(len(t) for t in tensors)) > 1:
+            raise ValueError(f"All tensors need the same number of samples, but got {[len(t) for t in tensors]}.")
+        self.tensors = tuple(tensors)
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset, batch_size: int = 64, num_workers: int = 0) -> "MaterializedDataset":
+        """_summary_ Computes all samples of dataset once, in order, using a DataLoader with num_workers processes.
+        """
+        batches = list(DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers))
+        return cls(tuple(torch.cat(elements) for elements in zip(*batches)))
+
+    @classmethod
+    def load(cls, path: str) -> "MaterializedDataset":
+        return cls(tuple(torch.load(path)))
+
+    def save(self, path: str):
+        """_summary_ Saves the tensors atomically, so that an interrupted run never leaves a partial file behind.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(list(self.tensors), tmp_path)
+        os.replace(tmp_path, path)
+
+    def __getitem__(self, index):
+        return tuple(t[index] for t in self.tensors)
+
+    def __len__(self):
+        return len(self.tensors[0]) if self.tensors else 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.tensors)
+
+
+def get_dataset_fingerprint(dataset) -> str:
+    """_summary_ Computes a fingerprint of everything that determines the samples of a FireSpreadDataset with a fixed
+    crop_seed: its data (see get_year_fingerprint), statistics and preprocessing settings. Used to name its cache file,
+    so that a cache is never reused after any of these change.
+    """
+    config = {
+        "data_dir": os.path.abspath(dataset.data_dir), "data_format": dataset.data_format,
+        "years": {str(year): get_year_fingerprint(dataset.data_dir, year, dataset.data_format, dataset.use_inventory_cache)
+                  for year in dataset.included_fire_years},
+        "means": dataset.means.flatten().tolist(), "stds": dataset.stds.flatten().tolist(),
+        "n_leading_observations": dataset.n_leading_observations,
+        "n_leading_observations_test_adjustment": dataset.n_leading_observations_test_adjustment,
+        "crop_side_length": dataset.crop_side_length, "is_train": dataset.is_train,
+        "remove_duplicate_features": dataset.remove_duplicate_features, "features_to_keep": dataset.features_to_keep,
+        "return_doy": dataset.return_doy, "compact_batches": dataset.compact_batches,
+        "landcover_as_index": dataset.landcover_as_index, "n_crop_candidates": dataset.n_crop_candidates,
+        "crop_seed": dataset.crop_seed,
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def materialize_dataset(dataset, cache_dir: Optional[str] = None, batch_size: int = 64,
+                        num_workers: int = 0) -> MaterializedDataset:
+    """_summary_ Materializes a FireSpreadDataset with a fixed crop_seed. If cache_dir is given, the result is stored
+    there, and reused by later runs with the same data and settings, see get_dataset_fingerprint.
+
+    Args:
+        dataset (_type_): _description_ FireSpreadDataset with crop_seed set.
+        cache_dir (Optional[str], optional): _description_ Directory for cache files. Defaults to None, which keeps the
+        samples in memory only.
+        batch_size (int, optional): _description_ Batch size used while computing the samples. Defaults to 64.
+        num_workers (int, optional): _description_ Number of DataLoader workers used while computing the samples. Defaults to 0.
+    """
+    if dataset.crop_seed is None:
+        raise ValueError("Only datasets with a fixed crop_seed can be materialized, otherwise their samples change every epoch.")
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"materialized_{get_dataset_fingerprint(dataset)}.pt"
+        if cache_path.is_file():
+            print(f"Loading materialized dataset from {cache_path}.")
+            return MaterializedDataset.load(str(cache_path))
+
+    materialized = MaterializedDataset.from_dataset(dataset, batch_size, num_workers)
+    print(f"Materialized {len(materialized)} samples of years {dataset.included_fire_years}, "
+          f"taking {materialized.nbytes / 1e9:.2f} GB.")
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        materialized.save(str(cache_path))
+    return materialized
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler, get_worker_info
+
+
+class ReadAheadPrefetcher:
+    """_summary_ Per-process background reader, which loads the samples that the current process will be asked for next,
+    while the current sample is being preprocessed.
+
+    The sample order of an epoch is only known to the sampler in the main process. SharedOrderSampler writes it into a
+    shared memory tensor, which every DataLoader worker can read. The DataLoader sends batch k of an epoch to worker
+    k % num_workers, so each worker can predict its next indices from the position of the index it was just asked for.
+    Samples for the next depth of these indices are loaded by a thread pool. Without a shared order (e.g. in the
+    validation and test set), nothing is prefetched and every sample is loaded on demand.
+
+    Like HDF5HandlePool, the thread pool and pending reads belong to the process that created them, and are dropped
+    after forking or unpickling.
+    """
+
+    def __init__(self, depth: int, n_threads: int = 2):
+        """_summary_
+
+        Args:
+            depth (int): _description_ Maximum number of upcoming samples that are loaded ahead of time.
+            n_threads (int, optional): _description_ Number of reader threads per process. Defaults to 2.
+        """
+        if depth < 1:
+            raise ValueError(f"depth must be at least 1, but got {depth=}.")
+        self.depth = depth
+        self.n_threads = n_threads
+        self.order = None
+        self.order_version = None
+        self.batch_size = 1
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = None
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_version = None
+        self._positions = None
+        self.hits = 0
+        self.misses = 0
+        self.stall_time = 0.0
+
+    def attach_order(self, order: torch.Tensor, order_version: torch.Tensor, batch_size: int):
+        """_summary_ Sets the shared memory tensors that SharedOrderSampler writes the sample order to.
+        Needs to be called before the DataLoader starts its workers.
+        """
+        self.order = order
+        self.order_version = order_version
+        self.batch_size = batch_size
+
+    def get(self, index: int, load_fn: Callable[[int], object]):
+        """_summary_ Returns load_fn(index), from a read that was started ahead of time if possible, and starts reading
+        the samples that this process will be asked for next.
+
+        Args:
+            index (int): _description_ Dataset index.
+            load_fn (Callable[[int], object]): _description_ Function that loads a sample, must be thread-safe.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+
+        with self._lock:
+            future = self._pending.pop(index, None)
+        self._schedule(self.predict_next_indices(index), load_fn)
+
+        if future is None:
+            self.misses += 1
+            return load_fn(index)
+
+        self.hits += 1
+        start_time = time.perf_counter()
+        result = future.result()
+        self.stall_time += time.perf_counter() - start_time
+        return result
+
+    def predict_next_indices(self, index: int) -> List[int]:
+        """_summary_ Predicts the next indices that the current process will be asked for, after index.
+        """
+        if self.order is None:
+            return []
+
+        version = int(self.order_version.item())
+        if version != self._seen_version:
+            order = self.order.numpy()
+            self._positions = np.full(len(order), -1, dtype=np.int64)
+            valid = order >= 0
+            self._positions[order[valid]] = np.nonzero(valid)[0]
+            self._seen_version = version
+
+        if index >= len(self._positions) or self._positions[index] < 0:
+            return []
+
+        worker_info = get_worker_info()
+        worker_id, n_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        order = self.order.numpy()
+        position = self._positions[index] + 1
+        next_indices = []
+        while len(next_indices) < self.depth and position < len(order):
+            batch_id = position // self.batch_size
+            if batch_id % n_workers != worker_id:
+                # Skip to the next batch of this worker
+                position = (batch_id + (worker_id - batch_id) % n_workers) * self.batch_size
+                continue
+            next_indices.append(int(order[position]))
+            position += 1
+        return next_indices
+
+    def _schedule(self, indices: List[int], load_fn: Callable[[int], object]):
+        if not indices:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.n_threads)
+
+        with self._lock:
+            for index in indices:
+                if index not in self._pending:
+                    self._pending[index] = self._executor.submit(load_fn, index)
+            # Drop reads that were not requested, e.g. because the order changed
+            while len(self._pending) > 2 * self.depth:
+                _, future = self._pending.popitem(last=False)
+                future.cancel()
+
+    def get_stats(self) -> dict:
+        """_summary_ Returns the counters of the current process: number of samples that were prefetched (hits) or had
+        to be loaded on demand (misses), and the total time spent waiting for prefetched samples, in seconds.
+        """
+        n_requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / n_requests if n_requests else 0.0,
+                "stall_time": self.stall_time}
+
+    def __getstate__(self):
+        return {"depth": self.depth, "n_threads": self.n_threads, "order": self.order,
+                "order_version": self.order_version, "batch_size": self.batch_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+class SharedOrderSampler(Sampler[int]):
+    """_summary_ Wraps a sampler, and writes the order of each epoch into shared memory, where the ReadAheadPrefetcher
+    of the dataset in each DataLoader worker can read it.
+    """
+
+    def __init__(self, sampler: Sampler, dataset, batch_size: int):
+        """_summary_
+
+        Args:
+            sampler (Sampler): _description_ Sampler that determines the order.
+            dataset (_type_): _description_ FireSpreadDataset with a prefetcher, see prefetch_depth.
+            batch_size (int): _description_ Batch size of the DataLoader, needed to predict which worker gets which sample.
+        """
+        self.sampler = sampler
+        # Allocated once, before the workers are started, and overwritten in place every epoch
+        self.order = torch.full((len(sampler),), -1, dtype=torch.int64).share_memory_()
+        self.order_version = torch.zeros(1, dtype=torch.int64).share_memory_()
+        dataset.prefetcher.attach_order(self.order, self.order_version, batch_size)
+
+    def set_epoch(self, epoch: int):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        order = list(self.sampler)
+        self.order[:len(order)] = torch.as_tensor(order, dtype=torch.int64)
+        self.order_version += 1
+        yield from order
+
+    def __len__(self) -> int:
+        return len(self.sampler)
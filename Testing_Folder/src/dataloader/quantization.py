@@ -0,0 +1,111 @@
+from typing import Tuple
+
+import numpy as np
+import torch
+
+QUANTIZATIONS = ["none", "int16", "float16"]
+
+# Stored in int16 channels in place of NaN. The remaining values [-32767, 32767] are symmetric around 0.
+INT16_NAN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+# Values are scaled down if they would get close to the largest float16 value (65504)
+FLOAT16_SAFE_MAX = 60000.0
+
+
+def quantize_imgs(imgs: np.ndarray, quantization: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """_summary_ Quantizes images channel by channel, such that imgs ~ quantized * scale + offset.
+
+    For int16, the finite value range of each channel is mapped linearly onto [-32767, 32767], and NaNs are stored as -32768.
+    Channels that only contain integers in the int16 range (e.g. land cover class, active fire hour) are stored with
+    scale 1 and offset 0, which is lossless. For float16, each channel is centered around the middle of its value range
+    before the conversion, which keeps the absolute rounding error small for channels with a large offset (e.g. elevation,
+    temperatures in Kelvin). This includes integer channels, since float16 only represents integers up to 2048 exactly.
+    float16 keeps NaNs as they are.
+
+    Args:
+        imgs (np.ndarray): _description_ Images of shape (days, features, height, width).
+        quantization (str): _description_ One of "none", "int16" or "float16".
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: _description_ Quantized images with the same shape as imgs,
+        and per-channel scale and offset as float32 arrays of shape (features,).
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}.")
+
+    n_channels = imgs.shape[1]
+    scale = np.ones(n_channels, dtype=np.float32)
+    offset = np.zeros(n_channels, dtype=np.float32)
+    if quantization == "none":
+        return imgs, scale, offset
+
+    target_dtype = np.int16 if quantization == "int16" else np.float16
+    quantized = np.empty(imgs.shape, dtype=target_dtype)
+    for c in range(n_channels):
+        channel = imgs[:, c, ...]
+        finite = np.isfinite(channel)
+        if finite.any():
+            low, high = float(channel[finite].min()), float(channel[finite].max())
+        else:
+            low, high = 0.0, 0.0
+
+        is_int16_lossless = (quantization == "int16" and low >= -INT16_MAX and high <= INT16_MAX
+                             and bool(np.all(channel[finite] == np.round(channel[finite]))))
+        if not is_int16_lossless:
+            offset[c] = (low + high) / 2
+            if quantization == "int16" and high > low:
+                scale[c] = (high - low) / (2 * INT16_MAX)
+            elif quantization == "float16" and (high - low) / 2 > FLOAT16_SAFE_MAX:
+                scale[c] = (high - low) / (2 * FLOAT16_SAFE_MAX)
+
+        values = (channel - offset[c]) / scale[c]
+        if quantization == "int16":
+            values = np.clip(np.round(np.nan_to_num(values, nan=0.0, posinf=INT16_MAX, neginf=-INT16_MAX)), -INT16_MAX, INT16_MAX)
+            quantized[:, c, ...] = np.where(np.isnan(channel), INT16_NAN, values)
+        else:
+            quantized[:, c, ...] = values
+
+    return quantized, scale, offset
+
+
+def dequantize_imgs(imgs: np.ndarray, scale: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    """_summary_ Inverse of quantize_imgs.
+
+    Args:
+        imgs (np.ndarray): _description_ Quantized images of shape (days, features, height, width).
+        scale (np.ndarray): _description_ Per-channel scale, of shape (features,).
+        offset (np.ndarray): _description_ Per-channel offset, of shape (features,).
+
+    Returns:
+        np.ndarray: _description_ float32 images of the same shape.
+    """
+    if imgs.dtype == np.float16:
+        # numpy converts float16 element by element, torch uses vectorized conversion instructions
+        x = torch.from_numpy(np.ascontiguousarray(imgs)).float().numpy()
+    else:
+        x = imgs.astype(np.float32)
+    x *= scale[:, None, None]
+    x += offset[:, None, None]
+    if imgs.dtype == np.int16:
+        np.copyto(x, np.nan, where=imgs == INT16_NAN)
+    return x
+
+
+def get_quantization_params(dset):
+    """_summary_ Returns the per-channel (scale, offset) stored in the attributes of an HDF5 dataset, or None if the
+    data is not quantized. Quantized files are written by src/preprocess/CreateHDF5Dataset.py with --quantization.
+    """
+    if "scale" not in dset.attrs:
+        return None
+    return np.asarray(dset.attrs["scale"], dtype=np.float32), np.asarray(dset.attrs["offset"], dtype=np.float32)
+
+
+def max_reconstruction_error(imgs: np.ndarray, quantized: np.ndarray, scale: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    """_summary_ Computes the maximum absolute difference per channel between the original and the dequantized images.
+    NaNs have to stay NaN, otherwise the error is infinite.
+    """
+    reconstructed = dequantize_imgs(quantized, scale, offset)
+    errors = np.abs(reconstructed - imgs)
+    errors[np.isnan(imgs) & np.isnan(reconstructed)] = 0
+    errors[np.isnan(imgs) != np.isnan(reconstructed)] = np.inf
+    return errors.max(axis=(0, 2, 3))
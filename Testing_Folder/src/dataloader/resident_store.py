@@ -0,0 +1,86 @@
+import shutil
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+import torch
+
+# torch places shared memory tensors in this directory on Linux
+SHARED_MEMORY_DIR = "/dev/shm"
+
+
+class ResidentStore:
+    """_summary_ Keeps the images of a set of fires, e.g. all fires of a year, in a single shared memory arena.
+
+    The arena is filled once in the main process. DataLoader workers inherit it when they are forked, or receive a
+    handle to the same memory when the dataset is pickled for spawned workers, so all workers read from one copy
+    without any disk I/O, instead of each reading and caching the same files.
+    """
+
+    def __init__(self, fire_shapes: Dict[Hashable, Tuple[int, ...]]):
+        """_summary_
+
+        Args:
+            fire_shapes (Dict[Hashable, Tuple[int, ...]]): _description_ Maps each fire key, e.g. (year, fire name),
+            to the shape (days, features, height, width) of its images.
+        """
+        self.fire_slices = {}
+        offset = 0
+        for key, shape in fire_shapes.items():
+            n_values = int(np.prod(shape))
+            self.fire_slices[key] = (offset, tuple(shape))
+            offset += n_values
+        self.arena = torch.empty(offset, dtype=torch.float32).share_memory_()
+        self._arena_np = None
+
+    @staticmethod
+    def get_size(fire_shapes: Dict[Hashable, Tuple[int, ...]]) -> int:
+        """_summary_ Returns the number of bytes needed to keep fires of the given shapes resident.
+        """
+        return sum(int(np.prod(shape)) for shape in fire_shapes.values()) * np.dtype(np.float32).itemsize
+
+    @staticmethod
+    def get_available_shared_memory() -> int:
+        """_summary_ Returns the number of free bytes in the shared memory file system, or None if it doesn't exist.
+        """
+        try:
+            return shutil.disk_usage(SHARED_MEMORY_DIR).free
+        except OSError:
+            return None
+
+    def get_fire(self, key: Hashable) -> np.ndarray:
+        """_summary_ Returns a view of all images of a fire. The view is shared between all processes, and must not be modified.
+        """
+        if self._arena_np is None:
+            self._arena_np = self.arena.numpy()
+        offset, shape = self.fire_slices[key]
+        return self._arena_np[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def put(self, key: Hashable, imgs: np.ndarray):
+        self.get_fire(key)[...] = imgs
+
+    @property
+    def nbytes(self) -> int:
+        return self.arena.numel() * self.arena.element_size()
+
+    def __getstate__(self):
+        return {"fire_slices": self.fire_slices, "arena": self.arena}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._arena_np = None
+
+
+class ResidentStoreGroup:
+    """_summary_ Looks up fires in several ResidentStores, e.g. one per year as kept by FireCatalog, as if they were one.
+    """
+
+    def __init__(self, stores: List[ResidentStore]):
+        self.stores = list(stores)
+        self.store_of_fire = {key: store for store in self.stores for key in store.fire_slices}
+
+    def get_fire(self, key: Hashable) -> np.ndarray:
+        return self.store_of_fire[key].get_fire(key)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(store.nbytes for store in self.stores)
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from typing import Iterator, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class FireLocalitySampler(Sampler[int]):
+    """_summary_ Shuffles the samples of a FireSpreadDataset in blocks of consecutive windows of the same fire.
+
+    The samples of each fire are split into blocks of block_size consecutive windows. Each epoch, the order of all
+    blocks is shuffled, and so is the order of the windows within each block. Neighbouring windows share most of
+    their days, so in combination with a day cache (see day_cache_size in FireSpreadDataset), each day of a block is
+    only read once instead of up to n_leading_observations + 1 times.
+
+    The DataLoader hands out whole batches to workers, so blocks that span two batches are split between two workers.
+    A block size that divides the batch size avoids that. Larger blocks save more reads, but make batches less diverse,
+    since each batch then contains samples of fewer fires.
+    """
+
+    def __init__(self, dataset, block_size: int, seed: Optional[int] = None):
+        """_summary_
+
+        Args:
+            dataset (_type_): _description_ FireSpreadDataset to sample from.
+            block_size (int): _description_ Number of consecutive windows of a fire per block.
+            seed (Optional[int], optional): _description_ Seed of the shuffling. The order changes every epoch. Defaults to None,
+            which draws a seed from torch's global random number generator, e.g. as set by seed_everything.
+        """
+        if block_size < 1:
+            raise ValueError(f"block_size must be at least 1, but got {block_size=}.")
+        self.block_size = block_size
+        self.seed = int(torch.empty((), dtype=torch.int64).random_().item()) if seed is None else seed
+        self.epoch = 0
+
+        # Start index of each block. Blocks never span two fires.
+        fire_end_offsets = np.asarray(dataset.fire_end_offsets, dtype=np.int64)
+        fire_start_offsets = np.concatenate([[0], fire_end_offsets[:-1]]).astype(np.int64)
+        self.block_starts = np.concatenate(
+            [np.arange(start, end, block_size) for start, end in zip(fire_start_offsets, fire_end_offsets)]
+            + [np.zeros(0, dtype=np.int64)])
+        block_fire_ends = np.repeat(fire_end_offsets, np.ceil((fire_end_offsets - fire_start_offsets) / block_size).astype(np.int64))
+        self.block_ends = np.minimum(self.block_starts + block_size, block_fire_ends)
+        self.length = int(fire_end_offsets[-1]) if len(fire_end_offsets) > 0 else 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        rng = np.random.default_rng([self.seed, self.epoch])
+        # Without an explicit call of set_epoch, advance the epoch, so that each iteration uses a new order
+        self.epoch += 1
+        for block_id in rng.permutation(len(self.block_starts)):
+            start, end = self.block_starts[block_id], self.block_ends[block_id]
+            yield from (start + rng.permutation(end - start)).tolist()
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class SizeBucketBatchSampler(Sampler[List[int]]):
+    """_summary_ Batches samples of a FireSpreadDataset with is_train=False by their image size, so that full, uncropped 
+    scenes of different fires can be evaluated in batches instead of one at a time.
+
+    Samples are grouped by their (height, width) after center_crop_x32. Each group is split into full batches of 
+    batch_size samples. The remaining samples of all groups are sorted by size and batched together, which requires 
+    padding them to a common size, see pad_collate. Batches follow the dataset order as far as possible, and are 
+    the same in every epoch.
+    """
+
+    def __init__(self, dataset, batch_size: int):
+        """_summary_
+
+        Args:
+            dataset (_type_): _description_ FireSpreadDataset with is_train=False.
+            batch_size (int): _description_
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, but got {batch_size=}.")
+        self.batch_size = batch_size
+
+        buckets = defaultdict(list)
+        for index, shape in enumerate(dataset.get_sample_shapes()):
+            buckets[tuple(shape)].append(index)
+
+        self.batches = []
+        remainder = []
+        for shape, indices in buckets.items():
+            n_full = len(indices) // batch_size * batch_size
+            self.batches += [indices[i:i + batch_size] for i in range(0, n_full, batch_size)]
+            remainder += [(shape, index) for index in indices[n_full:]]
+
+        # Batch the remaining samples with those of similar size, to keep the padding small
+        remainder = [index for _, index in sorted(remainder)]
+        self.batches += [remainder[i:i + batch_size] for i in range(0, len(remainder), batch_size)]
+        self.batches.sort(key=lambda batch: batch[0])
+
+    def __iter__(self) -> Iterator[List[int]]:
+        yield from (list(batch) for batch in self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
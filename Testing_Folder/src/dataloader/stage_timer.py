@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+
+# Keys of the timings of a sample. Every sample carries all of them, so that the DataLoader can collate them.
+STAGE_TIMING_KEYS = ["time/getitem", "time/find_index", "time/load_imgs", "time/preprocess_and_augment",
+                     "time/select_features", "bytes_read", "day_cache/hits", "day_cache/misses",
+                     "prefetch/hits", "prefetch/misses", "prefetch/stall_time", "samples"]
+
+
+class StageTimer:
+    """_summary_ Accumulates the duration of the stages of FireSpreadDataset.__getitem__, the number of bytes read and
+    the cache counters, between two calls of pop. Used from the DataLoader worker that runs __getitem__, and from the
+    prefetcher's reader threads, if any. Like HDF5HandlePool, each process has its own values, which are reset after
+    forking or unpickling.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(STAGE_TIMING_KEYS, 0.0)
+        self._counters = {}
+
+    @contextmanager
+    def time(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"time/{stage}", time.perf_counter() - start_time)
+
+    def add(self, key: str, value: float):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            self._values[key] += value
+
+    def add_counters(self, counters: Dict[str, float]):
+        """_summary_ Adds the increase of cumulative counters, e.g. cache hits, since the last call.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            for key, value in counters.items():
+                self._values[key] += value - self._counters.get(key, 0)
+            self._counters = dict(counters)
+
+    def pop(self) -> Dict[str, torch.Tensor]:
+        """_summary_ Returns the accumulated values as float64 scalar tensors, and resets them.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            values = {key: torch.tensor(value, dtype=torch.float64) for key, value in self._values.items()}
+            self._values = dict.fromkeys(STAGE_TIMING_KEYS, 0.0)
+        return values
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self._reset()
+
+
+def reduce_stage_timings(timings: Dict[str, torch.Tensor]) -> Dict[str, float]:
+    """_summary_ Reduces the collated timings of a batch (one value per sample) to per-sample means in milliseconds,
+    megabytes read per sample and cache hit rates.
+    """
+    sums = {key: float(value.sum()) for key, value in timings.items()}
+    n_samples = max(sums["samples"], 1)
+    metrics = {f"data/{key.split('/', 1)[1]}_ms": 1000 * sums[key] / n_samples for key in sums if key.startswith("time/")}
+    metrics["data/mb_read"] = sums["bytes_read"] / n_samples / 1e6
+    for cache in ["day_cache", "prefetch"]:
+        n_requests = sums[f"{cache}/hits"] + sums[f"{cache}/misses"]
+        if n_requests > 0:
+            metrics[f"data/{cache}_hit_rate"] = sums[f"{cache}/hits"] / n_requests
+    if sums["prefetch/hits"] + sums["prefetch/misses"] > 0:
+        metrics["data/prefetch_stall_ms"] = 1000 * sums["prefetch/stall_time"] / n_samples
+    return metrics
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .flat_array_store import FlatArrayStore
+from .inventory import load_year_inventory
+
+STATISTICS_CACHE_NAME = ".fire_statistics.json"
+STATISTICS_VERSION = 1
+
+
+class ChannelStatistics:
+    """_summary_ Mergeable accumulator of per-channel statistics: number of valid (finite) values, mean and sum of squared
+    deviations from the mean (M2), following Welford's algorithm. Accumulators of different fires can be computed
+    independently, e.g. in different processes, and merged afterwards (Chan et al.), which gives the same result as
+    accumulating all data in one pass, without ever holding more than one fire in memory.
+
+    Additionally counts the total number of pixels per channel, to compute the rate of missing values, and the
+    number of pixels with an active fire detection.
+    """
+
+    def __init__(self, n_channels: int):
+        self.n_channels = n_channels
+        self.n_pixels = 0
+        self.n_fire_pixels = 0
+        self.n_valid = np.zeros(n_channels, dtype=np.int64)
+        self.mean = np.zeros(n_channels, dtype=np.float64)
+        self.m2 = np.zeros(n_channels, dtype=np.float64)
+
+    def update(self, imgs: np.ndarray, fire_mask: Optional[np.ndarray] = None):
+        """_summary_ Adds images to the statistics. Non-finite values count as missing.
+
+        Args:
+            imgs (np.ndarray): _description_ Images of shape (days, features, height, width).
+            fire_mask (Optional[np.ndarray], optional): _description_ Boolean mask of active fire pixels, of shape
+            (days, height, width). Defaults to None, which counts no fire pixels.
+        """
+        batch = ChannelStatistics(self.n_channels)
+        batch.n_pixels = imgs.shape[0] * imgs.shape[2] * imgs.shape[3]
+        batch.n_fire_pixels = 0 if fire_mask is None else int(fire_mask.sum())
+        for c in range(self.n_channels):
+            channel = imgs[:, c, ...]
+            values = channel[np.isfinite(channel)].astype(np.float64)
+            batch.n_valid[c] = values.size
+            if values.size > 0:
+                batch.mean[c] = values.mean()
+                batch.m2[c] = np.square(values - batch.mean[c]).sum()
+        self.merge(batch)
+
+    def merge(self, other: "ChannelStatistics"):
+        """_summary_ Merges the statistics of other into this accumulator.
+        """
+        n_valid = self.n_valid + other.n_valid
+        # Avoid division by zero for channels without any valid values so far
+        safe_n_valid = np.maximum(n_valid, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n_valid / safe_n_valid
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.n_valid * other.n_valid / safe_n_valid
+        self.n_valid = n_valid
+        self.n_pixels += other.n_pixels
+        self.n_fire_pixels += other.n_fire_pixels
+
+    @property
+    def means(self) -> np.ndarray:
+        return self.mean.astype(np.float32)
+
+    @property
+    def stds(self) -> np.ndarray:
+        return np.sqrt(self.m2 / np.maximum(self.n_valid, 1)).astype(np.float32)
+
+    @property
+    def missing_values(self) -> np.ndarray:
+        return (1 - self.n_valid / max(self.n_pixels, 1)).astype(np.float32)
+
+    @property
+    def fire_rate(self) -> float:
+        return self.n_fire_pixels / max(self.n_pixels, 1)
+
+    def to_dict(self) -> dict:
+        return {"n_channels": self.n_channels, "n_pixels": self.n_pixels, "n_fire_pixels": self.n_fire_pixels,
+                "n_valid": self.n_valid.tolist(), "mean": self.mean.tolist(), "m2": self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "ChannelStatistics":
+        statistics = cls(state["n_channels"])
+        statistics.n_pixels = state["n_pixels"]
+        statistics.n_fire_pixels = state["n_fire_pixels"]
+        statistics.n_valid = np.array(state["n_valid"], dtype=np.int64)
+        statistics.mean = np.array(state["mean"], dtype=np.float64)
+        statistics.m2 = np.array(state["m2"], dtype=np.float64)
+        return statistics
+
+
+def get_year_fingerprint(data_dir: str, year: int, data_format: str, use_inventory_cache: bool = True) -> str:
+    """_summary_ Computes a fingerprint of the data of one year, which changes whenever fires are added, removed or
+    rewritten. Based on the dataset inventory, i.e. on file names, image counts, shapes and modification times.
+
+    Args:
+        data_dir (str): _description_ Root directory of the dataset.
+        year (int): _description_
+        data_format (str): _description_ One of "tif", "hdf5" or "memmap".
+        use_inventory_cache (bool, optional): _description_ See load_year_inventory. Defaults to True.
+
+    Returns:
+        str: _description_ Hex digest.
+    """
+    if data_format == "memmap":
+        fingerprint = []
+        for path in FlatArrayStore.get_paths(data_dir, year):
+            stat = os.stat(path)
+            fingerprint.append([path.name, stat.st_mtime_ns, stat.st_size])
+    else:
+        inventory = load_year_inventory(data_dir, year, data_format, use_cache=use_inventory_cache)
+        fingerprint = [[fire_name, fire["n_imgs"], fire["shape"], fire.get("mtime"), fire.get("size")]
+                       for fire_name, fire in sorted(inventory.items())]
+    return hashlib.sha1(json.dumps(fingerprint).encode()).hexdigest()
+
+
+def load_statistics_cache(data_dir: str) -> dict:
+    """_summary_ Reads the statistics cache of a dataset directory. The cache maps "<data_format>/<year>" to the
+    fingerprint of that year's data and the serialized ChannelStatistics of all its images.
+    Returns an empty cache if there is none, or it can't be read.
+    """
+    cache_path = Path(data_dir) / STATISTICS_CACHE_NAME
+    if cache_path.is_file():
+        try:
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") == STATISTICS_VERSION:
+                return cache
+        except (OSError, ValueError):
+            pass
+    return {"version": STATISTICS_VERSION, "years": {}}
+
+
+def save_statistics_cache(data_dir: str, cache: dict):
+    """_summary_ Writes the statistics cache atomically, see load_statistics_cache.
+    """
+    cache_path = Path(data_dir) / STATISTICS_CACHE_NAME
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        warnings.warn(f"Could not write the statistics cache {cache_path}: {e}", RuntimeWarning)
+
+
+def load_cached_statistics(data_dir: str, years: List[int], data_format: str,
+                           use_inventory_cache: bool = True) -> Optional[ChannelStatistics]:
+    """_summary_ Returns the merged statistics of the given years from the cache created by
+    src/preprocess/ComputeDatasetStatistics.py. Since statistics are cached per year, any combination of cached
+    years can be served.
+
+    Args:
+        data_dir (str): _description_ Root directory of the dataset.
+        years (List[int]): _description_
+        data_format (str): _description_ One of "tif", "hdf5" or "memmap".
+        use_inventory_cache (bool, optional): _description_ See load_year_inventory. Defaults to True.
+
+    Returns:
+        Optional[ChannelStatistics]: _description_ None if any of the years is not cached, or its data changed since.
+    """
+    cache_path = Path(data_dir) / STATISTICS_CACHE_NAME
+    if not cache_path.is_file():
+        return None
+
+    cache = load_statistics_cache(data_dir)
+    statistics = None
+    for year in years:
+        entry = cache["years"].get(f"{data_format}/{year}")
+        if entry is None:
+            return None
+        try:
+            fingerprint = get_year_fingerprint(data_dir, year, data_format, use_inventory_cache)
+        except OSError:
+            return None
+        if entry["fingerprint"] != fingerprint:
+            warnings.warn(f"The cached statistics of {data_format}/{year} in {cache_path} are outdated, "
+                          f"rerun src/preprocess/ComputeDatasetStatistics.py.", RuntimeWarning)
+            return None
+        year_statistics = ChannelStatistics.from_dict(entry["statistics"])
+        if statistics is None:
+            statistics = year_statistics
+        else:
+            statistics.merge(year_statistics)
+    return statistics
+
+
+def update_statistics_cache(data_dir: str, data_format: str, year_statistics: Dict[int, ChannelStatistics],
+                            fingerprints: Dict[int, str]):
+    """_summary_ Adds or replaces the statistics of the given years in the cache.
+    """
+    cache = load_statistics_cache(data_dir)
+    for year, statistics in year_statistics.items():
+        cache["years"][f"{data_format}/{year}"] = {"fingerprint": fingerprints[year], "statistics": statistics.to_dict()}
+    save_statistics_cache(data_dir, cache)
@@ -1,21 +1,44 @@
-from typing import List
+from typing import List, Optional
 import torch
 import numpy as np
 
+from .statistics import load_cached_statistics
 
-def get_means_stds_missing_values(training_years: List[int]):
+
+def get_means_stds_missing_values(training_years: List[int], data_dir: Optional[str] = None,
+                                  data_format: Optional[str] = None, use_inventory_cache: bool = True):
     """_summary_ Returns mean and std values as tensor, computed on unaugmented and unstandardized 
     data of the indicated training years. We don't clip values, because min/max did not diverge 
     much from the 0.1 and 99.9 percentiles. Some variables are not standardized, indicated by mean=0, std=1. 
     These are specifically: All variables indicating a direction in degrees 
     (wind direction, aspect, forecast wind direction), and the categorical land cover type.
 
+    If data_dir is given, and the statistics of all training years have been computed for it with 
+    src/preprocess/ComputeDatasetStatistics.py, the cached statistics are used. Otherwise, the values below are used, 
+    which are only available for pairs of the years 2018 to 2021.
+
     Args:
         training_years (_type_): _description_
+        data_dir (Optional[str], optional): _description_ Root directory of the dataset. Defaults to None.
+        data_format (Optional[str], optional): _description_ One of "tif", "hdf5" or "memmap". Defaults to None.
+        use_inventory_cache (bool, optional): _description_ See load_year_inventory. Defaults to True.
+
+    Raises:
+        ValueError: _description_ If there are neither cached nor hardcoded statistics for the training years.
 
     Returns:
         _type_: _description_
     """
+    # Degree-based features and the categorical land cover type variable are not standardized
+    features_to_not_standardize = get_indices_of_degree_features() + [16]
+
+    if data_dir is not None:
+        statistics = load_cached_statistics(data_dir, training_years, data_format, use_inventory_cache)
+        if statistics is not None:
+            means, stds = statistics.means, statistics.stds
+            means[features_to_not_standardize] = 0
+            stds[features_to_not_standardize] = 1
+            return means, stds, statistics.missing_values
 
     stats_per_training_year_combo = {
         (2018, 2019): {
@@ -141,19 +164,73 @@ def get_means_stds_missing_values(training_years: List[int]):
             0., 0., 0.99780835], dtype=np.float32)}}
 
     years_tuple = tuple(training_years)
+    if years_tuple not in stats_per_training_year_combo:
+        raise ValueError(f"No statistics available for years {years_tuple}. "
+                         f"Compute them with src/preprocess/ComputeDatasetStatistics.py.")
     means = stats_per_training_year_combo[years_tuple]["means"]
     stds = stats_per_training_year_combo[years_tuple]["stds"]
     missing_values = stats_per_training_year_combo[years_tuple]["missing_values"]
 
     # Zero out means and stds for degree-based features and the categorical land cover type variable
-    features_to_not_standardize = get_indices_of_degree_features() + [16]
-
     means[features_to_not_standardize] = 0
     stds[features_to_not_standardize] = 1
 
     return means, stds, missing_values
 
 
+def get_fire_rate(training_years: List[int], data_dir: Optional[str] = None, data_format: Optional[str] = None,
+                  use_inventory_cache: bool = True) -> float:
+    """_summary_ Returns the fraction of pixels with an active fire detection in the training years, 
+    from the same sources as get_means_stds_missing_values. Non-fire pixels are marked as missing values 
+    in the active fire feature, so the hardcoded values are derived from its missing value rate.
+    """
+    if data_dir is not None:
+        statistics = load_cached_statistics(data_dir, training_years, data_format, use_inventory_cache)
+        if statistics is not None:
+            return statistics.fire_rate
+
+    _, _, missing_values_rates = get_means_stds_missing_values(training_years)
+    return float(1 - missing_values_rates[-1])
+
+
+# Target value of pixels that only exist because of padding, and must be ignored in the loss and metrics
+PADDING_LABEL = -1
+# The same, for compact uint8 targets, see FireSpreadDataset.compact_features
+COMPACT_PADDING_LABEL = 255
+
+
+def pad_collate(samples, label_index: int = 1):
+    """_summary_ Collates samples whose images have different sizes, by padding them at the bottom and right to the 
+    largest height and width in the batch. Inputs are padded with 0, which is the mean of the standardized features. 
+    Targets are padded with PADDING_LABEL (COMPACT_PADDING_LABEL for uint8 targets), so that padded pixels can be 
+    excluded from loss and metrics. Tensors with less than two dimensions (e.g. day of year) are stacked unchanged.
+
+    Args:
+        samples (_type_): _description_ List of tuples, as returned by FireSpreadDataset.__getitem__.
+        label_index (int, optional): _description_ Position of the target in each tuple. Defaults to 1.
+
+    Returns:
+        _type_: _description_ Tuple of batched tensors.
+    """
+    batch = []
+    for i, tensors in enumerate(zip(*samples)):
+        if tensors[0].dim() < 2:
+            batch.append(torch.stack(tensors))
+            continue
+
+        H = max(t.shape[-2] for t in tensors)
+        W = max(t.shape[-1] for t in tensors)
+        if i != label_index:
+            padding_value = 0
+        elif tensors[0].dtype == torch.uint8:
+            padding_value = COMPACT_PADDING_LABEL
+        else:
+            padding_value = PADDING_LABEL
+        batch.append(torch.stack([torch.nn.functional.pad(t, (0, W - t.shape[-1], 0, H - t.shape[-2]), value=padding_value)
+                                  for t in tensors]))
+    return tuple(batch)
+
+
 def get_indices_of_degree_features():
     """
     :return: Indices of features that take values in [0,360] and thus will be transformed via sin
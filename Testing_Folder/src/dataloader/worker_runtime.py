@@ -0,0 +1,74 @@
+import os
+import random
+from functools import partial
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+try:
+    # Limits the thread pools of BLAS and OpenMP libraries that are already loaded, e.g. the one numpy uses.
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Environment variables read by BLAS and OpenMP libraries that are loaded after the worker starts
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def init_worker(worker_id: int, num_workers: int, threads_per_worker: Optional[int] = None, pin_cpus: bool = False):
+    """_summary_ Initializes a DataLoader worker:
+    1. Seeds numpy and random from the worker's torch seed, which torch derives from the main process' random state and
+       the worker id. Without this, forked workers share numpy's random state, and would draw the same augmentations.
+    2. Optionally caps the number of intra-op threads of torch, BLAS and OpenMP, so that num_workers workers don't each
+       start thread pools with one thread per core.
+    3. Optionally pins the worker to its own share of the CPUs that the main process may use.
+
+    Args:
+        worker_id (int): _description_ Passed by the DataLoader.
+        num_workers (int): _description_ Number of workers of the DataLoader.
+        threads_per_worker (Optional[int], optional): _description_ Maximum number of intra-op threads per worker. Defaults to None,
+        which leaves the libraries' defaults untouched.
+        pin_cpus (bool, optional): _description_ Pin each worker to a disjoint set of CPUs. Only supported on Linux. Defaults to False.
+    """
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+    if threads_per_worker is not None:
+        torch.set_num_threads(threads_per_worker)
+        for env_var in THREAD_ENV_VARS:
+            os.environ[env_var] = str(threads_per_worker)
+        if threadpool_limits is not None:
+            threadpool_limits(limits=threads_per_worker)
+
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        cpus_per_worker = max(1, len(cpus) // num_workers)
+        start = (worker_id * cpus_per_worker) % len(cpus)
+        os.sched_setaffinity(0, cpus[start:start + cpus_per_worker])
+
+
+def get_dataloader_kwargs(num_workers: int, persistent_workers: bool = False, prefetch_factor: Optional[int] = None,
+                          pin_memory: bool = True, threads_per_worker: Optional[int] = None,
+                          pin_cpus: bool = False) -> Dict:
+    """_summary_ Returns the keyword arguments that configure the worker processes of a DataLoader. persistent_workers,
+    prefetch_factor and worker_init_fn are only passed with num_workers > 0, since DataLoader rejects them otherwise.
+
+    Args:
+        num_workers (int): _description_
+        persistent_workers (bool, optional): _description_ Keep the workers, and their open files and caches, alive between epochs. Defaults to False.
+        prefetch_factor (Optional[int], optional): _description_ Number of batches loaded in advance by each worker.
+        Defaults to None, which uses the DataLoader's default of 2.
+        pin_memory (bool, optional): _description_ Defaults to True.
+        threads_per_worker (Optional[int], optional): _description_ See init_worker. Defaults to None.
+        pin_cpus (bool, optional): _description_ See init_worker. Defaults to False.
+    """
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs["persistent_workers"] = persistent_workers
+        kwargs["worker_init_fn"] = partial(init_worker, num_workers=num_workers, threads_per_worker=threads_per_worker,
+                                           pin_cpus=pin_cpus)
+        if prefetch_factor is not None:
+            kwargs["prefetch_factor"] = prefetch_factor
+    return kwargs
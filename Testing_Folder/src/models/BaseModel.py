@@ -1,6 +1,7 @@
+import itertools
 import math
 from abc import ABC
-from typing import Any, Literal, Optional, Tuple
+from typing import Any, List, Literal, Optional, Tuple
 
 import pytorch_lightning as pl
 import torch
@@ -26,6 +27,8 @@ class BaseModel(pl.LightningModule, ABC):
         loss_function: Literal["BCE", "Focal", "Lovasz", "Jaccard", "Dice"],
         use_doy: bool = False,
         required_img_size: Optional[Tuple[int, int]] = None,
+        landcover_channel_ids: Optional[List[int]] = None,
+        tile_batch_size: int = 32,
         *args: Any,
         **kwargs: Any
     ):
@@ -42,14 +45,19 @@ class BaseModel(pl.LightningModule, ABC):
             When using a model that requires a specific image size, this parameter can be used to indicate it. We assume models require square images, 
             so this parameter indicates the side length. If set, the forward method will perform repeated inference on crops of the 
             image, and aggregate the results. This also works for non-square images. 
+            landcover_channel_ids (Optional[List[int]], optional): _description_. Defaults to None. Channels of the input data that contain 
+            land cover class indices instead of the one-hot encoding, as returned by the dataset with landcover_as_index. Each of these channels 
+            is replaced by a learned 17-dimensional embedding before the forward pass, so n_channels counts the embedded channels. The embedding 
+            is initialized as the identity, i.e. it starts out as the one-hot encoding. Set automatically in train.py.
+            tile_batch_size (int, optional): _description_. Defaults to 32. If required_img_size is set, the crops of all images in a batch 
+            are predicted in forward passes of up to this many crops. Crops are extracted per forward pass, so this also limits the 
+            memory that the crops take up. 
         """
         super().__init__(*args, **kwargs)
         self.save_hyperparameters()
 
         if required_img_size is not None:
-            self.hparams.required_img_size = torch.Size(
-                required_img_size, device=self.device
-            )
+            self.hparams.required_img_size = torch.Size(required_img_size)
 
         # Normalize class weights by assuming that the negative class has weight 1
         if self.hparams.loss_function == "Focal" and self.hparams.pos_class_weight > 1:
@@ -57,6 +65,13 @@ class BaseModel(pl.LightningModule, ABC):
 
         self.loss = self.get_loss()
 
+        if landcover_channel_ids:
+            self.landcover_embedding = nn.Embedding(17, 17)
+            with torch.no_grad():
+                self.landcover_embedding.weight.copy_(torch.eye(17))
+        else:
+            self.landcover_embedding = None
+
         self.train_f1 = torchmetrics.F1Score("binary")
         self.val_f1 = self.train_f1.clone()
         self.test_f1 = self.train_f1.clone()
@@ -76,17 +91,34 @@ class BaseModel(pl.LightningModule, ABC):
             x = x.flatten(start_dim=1, end_dim=2)
         return self.model(x)
 
+    def embed_landcover(self, x):
+        """_summary_ Replaces each land cover index channel given by landcover_channel_ids with its embedding. 
+
+        Args:
+            x (_type_): _description_ Input data of shape (..., channels, height, width).
+
+        Returns:
+            _type_: _description_ Input data with 16 additional channels per land cover channel.
+        """
+        if self.landcover_embedding is None:
+            return x
+
+        parts = []
+        start = 0
+        for channel_id in self.hparams.landcover_channel_ids:
+            parts.append(x[..., start:channel_id, :, :])
+            landcover_classes = x[..., channel_id, :, :].long()
+            parts.append(self.landcover_embedding(landcover_classes).movedim(-1, -3).to(x.dtype))
+            start = channel_id + 1
+        parts.append(x[..., start:, :, :])
+        return torch.cat(parts, dim=-3)
+
     def get_pred_and_gt(self, batch):
         """_summary_ Unbatch the data and perform inference on each sample.
 
         Args:
             batch (_type_): _description_ Either a tuple of (x, y) or (x, y, doys).
 
-        Raises:
-            ValueError: _description_ If the batch size is not 1 and the model requires repeated inference on crops of the image. 
-            This is the case for ConvLSTM, when predicting on the test set. During training, it uses random crops of the required size,
-            so larger batch sizes can be used. 
-
         Returns:
             _type_: _description_ Prediction and ground truth for each sample in the batch.
         """
@@ -98,58 +130,69 @@ class BaseModel(pl.LightningModule, ABC):
             x, y = batch
             doys = None
 
+        x = self.embed_landcover(x)
+
         # If the model requires a certain fixed size, perform repeated inference on crops of the image,
-        # and aggregate the results. When we reach the last row or column, which might not be divisible by
-        # the required size, we align the crop window with the right/bottom edge of the image. This means 
-        # that there is some amount of overlap between the last two crops in each row/column. We handle this
-        # by simply overwriting the existing predictions with the new ones. 
-
-        if self.hparams.required_img_size is not None:
-            B, T, C, H, W = x.shape
-
-            if x.shape[-2:] != self.hparams.required_img_size:
-                if B != 1:
-                    raise ValueError(
-                        "Not implemented: repeated cropping for batch size > 1."
-                    )
-                # Use crops of size H_rq x W_rq
-                H_req, W_req = self.hparams.required_img_size
-
-                n_H = math.ceil(H / H_req)
-                n_W = math.ceil(W / W_req)
-
-                # Aggregate predictions in this tensor
-                agg_output = torch.zeros(B, H, W, device=self.device)
-
-                for i in range(n_H):
-                    for j in range(n_W):
-                        
-                        # If we reach the bottom edge of the image, align the crop window with the bottom edge of the image
-                        if i == n_H - 1:
-                            H1 = H - H_req
-                            H2 = H
-                        else:
-                            H1 = i * H_req
-                            H2 = (i + 1) * H_req
-                        # If we reach the right edge of the image, align the crop window with the right edge of the image
-                        if j == n_W - 1:
-                            W1 = W - W_req
-                            W2 = W
-                        else:
-                            W1 = j * W_req
-                            W2 = (j + 1) * W_req
-
-                        x_crop = x[:, :, :, H1:H2, W1:W2]
-
-                        agg_output[:, H1:H2, W1:W2] = self(x_crop, doys).squeeze(1)
-
-                y_hat = agg_output
-                return y_hat, y
+        # and aggregate the results.
+        if self.hparams.required_img_size is not None and x.shape[-2:] != self.hparams.required_img_size:
+            y_hat = self.predict_tiled(x, doys)
+            return y_hat, y
 
         y_hat = self(x, doys).squeeze(1)
 
         return y_hat, y
 
+    @staticmethod
+    def get_tile_starts(size: int, tile_size: int):
+        """_summary_ Start positions of crops of tile_size along an image dimension of the given size. The crops 
+        are placed next to each other, and the last one is aligned with the end of the image, so that it might 
+        overlap with the second to last one.
+        """
+        n_tiles = math.ceil(size / tile_size)
+        return [i * tile_size for i in range(n_tiles - 1)] + [size - tile_size]
+
+    def predict_tiled(self, x, doys=None):
+        """_summary_ Predicts images that are larger than required_img_size by predicting crops of the required size 
+        and aggregating the results. The crops of all images are predicted in forward passes of up to tile_batch_size 
+        crops, and each forward pass only extracts its own crops from x. Where crops overlap, their predictions are 
+        blended with weights that decrease linearly towards the crop borders, where predictions have the least context.
+
+        Args:
+            x (_type_): _description_ Input data of shape (B, T, C, H, W), or (B, C, H, W) if the temporal dimension has been flattened.
+            doys (_type_, optional): _description_ Day of year of shape (B, T). Defaults to None.
+
+        Returns:
+            _type_: _description_ Predictions of shape (B, H, W).
+        """
+        B, H, W = x.shape[0], x.shape[-2], x.shape[-1]
+        H_req, W_req = self.hparams.required_img_size
+        row_starts = self.get_tile_starts(H, H_req)
+        col_starts = self.get_tile_starts(W, W_req)
+        # (image, row start, col start) of every crop, in the order of tile_preds below
+        tile_positions = list(itertools.product(range(B), row_starts, col_starts))
+
+        tile_preds = []
+        tile_batch_size = self.hparams.tile_batch_size
+        for start in range(0, len(tile_positions), tile_batch_size):
+            positions = tile_positions[start:start + tile_batch_size]
+            tiles = torch.stack([x[b, ..., H1:H1 + H_req, W1:W1 + W_req] for b, H1, W1 in positions])
+            batch_doys = None if doys is None else doys[[b for b, _, _ in positions]]
+            tile_preds.append(self(tiles, batch_doys).reshape(-1, H_req, W_req))
+        tile_preds = torch.cat(tile_preds).reshape(B, len(row_starts), len(col_starts), H_req, W_req)
+
+        # Weights are at least 1, so every pixel gets a prediction
+        row_weights = torch.minimum(torch.arange(1, H_req + 1, device=x.device), torch.arange(H_req, 0, -1, device=x.device))
+        col_weights = torch.minimum(torch.arange(1, W_req + 1, device=x.device), torch.arange(W_req, 0, -1, device=x.device))
+        tile_weights = (row_weights[:, None] * col_weights[None, :]).to(tile_preds.dtype)
+
+        agg_output = torch.zeros(B, H, W, device=x.device, dtype=tile_preds.dtype)
+        agg_weights = torch.zeros(H, W, device=x.device, dtype=tile_preds.dtype)
+        for i, H1 in enumerate(row_starts):
+            for j, W1 in enumerate(col_starts):
+                agg_output[:, H1:H1 + H_req, W1:W1 + W_req] += tile_preds[:, i, j] * tile_weights
+                agg_weights[H1:H1 + H_req, W1:W1 + W_req] += tile_weights
+        return agg_output / agg_weights
+
     def training_step(self, batch, batch_idx):
         """_summary_ Compute predictions and loss for the given batch. Log training loss and F1 score.
 
@@ -218,6 +261,8 @@ class BaseModel(pl.LightningModule, ABC):
 
     def test_step(self, batch, batch_idx):
         """_summary_ Compute predictions and loss for the given batch. Log test loss, F1, AP, precision, recall, IoU and confusion matrix.
+        If the batch contains padded images (see pad_collate), only the valid pixels are used. The loss is computed per scene 
+        and averaged over the scenes of the batch, see compute_scene_loss, so test_loss does not depend on test_batch_size.
 
         Args:
             batch (_type_): _description_
@@ -228,7 +273,13 @@ class BaseModel(pl.LightningModule, ABC):
         """
         y_hat, y = self.get_pred_and_gt(batch)
 
-        loss = self.compute_loss(y_hat, y)
+        # Padded pixels have a negative target
+        valid_mask = y >= 0
+        loss = self.compute_scene_loss(y_hat, y, valid_mask)
+        # Metrics are computed over all valid pixels, which doesn't require the image shape
+        if not valid_mask.all():
+            y_hat, y = y_hat[valid_mask], y[valid_mask]
+
         self.test_f1(y_hat, y)
         self.test_avg_precision(y_hat, y)
         self.test_precision(y_hat, y)
@@ -275,7 +326,7 @@ class BaseModel(pl.LightningModule, ABC):
     def predict_step(self, batch, batch_idx, dataloader_idx=0):
         x, y = batch
         x_af = x[:, :, -1, :, :]
-        y_hat = self(x).squeeze(1)
+        y_hat = self(self.embed_landcover(x)).squeeze(1)
         return x_af, y, y_hat
 
     def get_loss(self):
@@ -294,6 +345,27 @@ class BaseModel(pl.LightningModule, ABC):
         elif self.hparams.loss_function == "Dice":
             return DiceLoss(mode="binary")
 
+    def compute_scene_loss(self, y_hat, y, valid_mask):
+        """_summary_ Computes the loss of each scene of the batch on its valid pixels, and returns the mean over the scenes. 
+        Since pad_collate pads at the bottom and right, the valid pixels of a scene form its top left rectangle, 
+        which is cropped out, so that losses that need the (batch, height, width) shape, like Dice and Jaccard, can be used.
+
+        Args:
+            y_hat (_type_): _description_ Predicted logits of shape (batch, height, width).
+            y (_type_): _description_ Targets of the same shape.
+            valid_mask (_type_): _description_ Boolean mask of the same shape, False for padded pixels.
+
+        Returns:
+            _type_: _description_
+        """
+        scene_losses = []
+        for scene_y_hat, scene_y, scene_mask in zip(y_hat, y, valid_mask):
+            H = int(scene_mask.any(dim=1).sum())
+            W = int(scene_mask.any(dim=0).sum())
+            # Some losses, e.g. Lovasz, require contiguous inputs
+            scene_losses.append(self.compute_loss(scene_y_hat[None, :H, :W].contiguous(), scene_y[None, :H, :W].contiguous()))
+        return torch.stack(scene_losses).mean()
+
     def compute_loss(self, y_hat, y):
         if self.hparams.loss_function == "Focal":
             return self.loss(
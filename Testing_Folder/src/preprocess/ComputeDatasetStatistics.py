@@ -0,0 +1,107 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.FireSpreadDataset import FireSpreadDataset
+from src.dataloader.statistics import (ChannelStatistics, get_year_fingerprint, load_statistics_cache,
+                                       update_statistics_cache)
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+# Set in each worker process by init_worker, to avoid pickling the dataset for every fire
+worker_dataset = None
+
+
+def init_worker(dataset):
+    global worker_dataset
+    worker_dataset = dataset
+
+
+def compute_fire_statistics(year, fire_name):
+    """_summary_ Computes the statistics of all images of a single fire.
+
+    Active fire pixels without a detection are 0 after loading, but are counted as missing values, like the NaNs
+    in the original TIF files. The missing value rate of the active fire feature is therefore 1 - fire rate, and
+    mean and std of the detection hour are computed over detections only.
+
+    Returns:
+        _type_: _description_ Tuple of (year, serialized ChannelStatistics).
+    """
+    imgs = worker_dataset.load_fire_array(year, fire_name)
+    fire_mask = imgs[:, -1, ...] > 0
+    imgs[:, -1, ...][~fire_mask] = np.nan
+
+    statistics = ChannelStatistics(imgs.shape[1])
+    statistics.update(imgs, fire_mask)
+    return year, statistics.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str,
+                        help="Path to dataset directory", required=True)
+    parser.add_argument("--years", type=int, nargs="+", default=[2018, 2019, 2020, 2021],
+                        help="Years to compute statistics for. Statistics are cached per year, and can be combined for any set of these years.")
+    parser.add_argument("--load_from_hdf5", action="store_true",
+                        help="Read HDF5 files, as created by CreateHDF5Dataset.py, instead of TIF files")
+    parser.add_argument("--load_from_memmap", action="store_true",
+                        help="Read flat binary files, as created by CreateFlatArrayDataset.py, instead of TIF files")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(),
+                        help="Number of processes that read fires in parallel")
+    parser.add_argument("--recompute", action="store_true",
+                        help="Recompute the statistics of all years, even if the cached statistics are up to date")
+    args = parser.parse_args()
+
+    dataset = FireSpreadDataset(data_dir=args.data_dir,
+                                included_fire_years=args.years,
+                                load_from_hdf5=args.load_from_hdf5,
+                                load_from_memmap=args.load_from_memmap,
+                                # the following args are irrelevant here, but need to be set
+                                n_leading_observations=1, crop_side_length=128, is_train=True,
+                                remove_duplicate_features=False, stats_years=(2018, 2019))
+    data_format = dataset.data_format
+
+    fingerprints = {year: get_year_fingerprint(args.data_dir, year, data_format) for year in args.years}
+    cache = load_statistics_cache(args.data_dir)
+    years_to_compute = [year for year in args.years
+                        if args.recompute or cache["years"].get(f"{data_format}/{year}", {}).get("fingerprint") != fingerprints[year]]
+    print(f"Statistics of years {sorted(set(args.years) - set(years_to_compute))} are up to date, "
+          f"computing years {years_to_compute} with {args.num_workers} processes.")
+
+    tasks = [(year, fire_name) for year in years_to_compute for fire_name in dataset.imgs_per_fire[year]
+             if dataset.fire_inventory[year][fire_name]["n_imgs"] > 0]
+    year_statistics = {year: None for year in years_to_compute}
+    with ProcessPoolExecutor(max_workers=args.num_workers, initializer=init_worker, initargs=(dataset,)) as executor:
+        futures = [executor.submit(compute_fire_statistics, *task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            year, state = future.result()
+            fire_statistics = ChannelStatistics.from_dict(state)
+            if year_statistics[year] is None:
+                year_statistics[year] = fire_statistics
+            else:
+                year_statistics[year].merge(fire_statistics)
+
+    year_statistics = {year: statistics for year, statistics in year_statistics.items() if statistics is not None}
+    update_statistics_cache(args.data_dir, data_format, year_statistics, fingerprints)
+
+    cache = load_statistics_cache(args.data_dir)
+    feature_names = FireSpreadDataset.map_channel_index_to_features(only_base=True)
+    for year in args.years:
+        entry = cache["years"].get(f"{data_format}/{year}")
+        if entry is None:
+            continue
+        statistics = ChannelStatistics.from_dict(entry["statistics"])
+        print(f"\n{year}: fire rate {statistics.fire_rate:.6f}")
+        for c, feature_name in feature_names.items():
+            print(f"{feature_name:>40}: mean {statistics.means[c]:12.5g}, std {statistics.stds[c]:12.5g}, "
+                  f"missing {statistics.missing_values[c]:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.flat_array_store import FlatArrayStore
+from src.dataloader.quantization import dequantize_imgs, get_quantization_params
+import argparse
+import glob
+import json
+from pathlib import Path
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+
+def convert_year(data_dir: str, target_dir: str, year: int):
+    """_summary_ Writes all fires of a year from the HDF5 dataset into one flat binary file plus index,
+    see FlatArrayStore for the layout. Both files are written under temporary names first and renamed once complete.
+    Quantized HDF5 files are dequantized, the flat files always contain float32 data.
+    """
+    data_path, index_path = FlatArrayStore.get_paths(target_dir, year)
+    tmp_data_path, tmp_index_path = f"{data_path}.tmp", f"{index_path}.tmp"
+
+    index = {"dtype": "float32", "fires": {}}
+    offset = 0
+    with open(tmp_data_path, "wb") as data_file:
+        for fire_hdf5 in tqdm(sorted(glob.glob(f"{data_dir}/{year}/*.hdf5")), desc=str(year)):
+            with h5py.File(fire_hdf5, "r") as f:
+                dset = f["data"]
+                imgs = dset[:]
+                quantization_params = get_quantization_params(dset)
+                if quantization_params is not None:
+                    imgs = dequantize_imgs(imgs, *quantization_params)
+                imgs = imgs.astype(np.float32)
+                index["fires"][Path(fire_hdf5).stem] = {
+                    "offset": offset,
+                    "shape": list(imgs.shape),
+                    "img_dates": [str(img_date) for img_date in dset.attrs["img_dates"]],
+                    "lnglat": [float(v) for v in dset.attrs["lnglat"]],
+                }
+            imgs.tofile(data_file)
+            offset += imgs.size
+
+    with open(tmp_index_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_data_path, data_path)
+    os.replace(tmp_index_path, index_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str,
+                        help="Path to the HDF5 dataset directory, as created by CreateHDF5Dataset.py", required=True)
+    parser.add_argument("--target_dir", type=str,
+                        help="Path to directory where the flat binary files and their indices should be stored", required=True)
+    parser.add_argument("--years", type=int, nargs="+", default=[2018, 2019, 2020, 2021])
+    args = parser.parse_args()
+
+    Path(args.target_dir).mkdir(parents=True, exist_ok=True)
+    for year in args.years:
+        convert_year(args.data_dir, args.target_dir, year)
+
+
+if __name__ == "__main__":
+    main()
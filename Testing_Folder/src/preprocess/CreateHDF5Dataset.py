@@ -3,46 +3,185 @@ import os
 sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
 
 from src.dataloader.FireSpreadDataset import FireSpreadDataset
+from src.preprocess.hdf5_utils import CHUNK_LAYOUTS, COMPRESSIONS, QUANTIZATIONS, add_crop_index, write_fire_hdf5
 import argparse
-import h5py
+import glob
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
 
 # Need to prevent an error with HDF5 files being locked and thereby inaccessible
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
+MANIFEST_NAME = "conversion_manifest.json"
+QUANTIZATION_REPORT_NAME = "quantization_report.json"
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--data_dir", type=str,
-                    help="Path to dataset directory", required=True)
-parser.add_argument("--target_dir", type=str,
-                    help="Path to directory where the HDF5 files should be stored", required=True)
-args = parser.parse_args()
-
-years = [2018, 2019, 2020, 2021]
-dataset = FireSpreadDataset(data_dir=args.data_dir,
-                            included_fire_years=years,
-                            # the following args are irrelevant here, but need to be set
-                            n_leading_observations=1, crop_side_length=128, load_from_hdf5=False, is_train=True,
-                            remove_duplicate_features=False, stats_years=(2018,2019))
-data_gen = dataset.get_generator_for_hdf5()
-
-for y in years:
-    target_dir = f"{args.target_dir}/{y}"
-    Path(target_dir).mkdir(parents=True, exist_ok=True)
-
-for year, fire_name, img_dates, lnglat, imgs in tqdm(data_gen):
-
-    target_dir = f"{args.target_dir}/{year}"
-    h5_path = f"{target_dir}/{fire_name}.hdf5"
-
-    if Path(h5_path).is_file():
-        print(f"File {h5_path} already exists, skipping...")
-        continue
-
-    with h5py.File(h5_path, "w") as f:
-        dset = f.create_dataset("data", imgs.shape, data=imgs)
-        dset.attrs["year"] = year
-        dset.attrs["fire_name"] = fire_name
-        dset.attrs["img_dates"] = img_dates
-        dset.attrs["lnglat"] = lnglat
\ No newline at end of file
+
+def convert_fire(year, fire_name, img_files, h5_path, layout_kwargs):
+    """_summary_ Converts the TIF files of a single fire into one HDF5 file. The file is first written under a
+    temporary name and only renamed to its final name once it is complete, so that a crash never leaves a
+    half-written file behind under the final name.
+
+    Returns:
+        _type_: _description_ Tuple of (year, fire_name, number of images written, maximum absolute quantization error 
+        per channel or None).
+    """
+    img_dates, lnglat, imgs = FireSpreadDataset.load_fire_for_hdf5(img_files)
+
+    tmp_path = f"{h5_path}.{os.getpid()}.tmp"
+    try:
+        errors = write_fire_hdf5(tmp_path, year, fire_name, img_dates, lnglat, imgs, **layout_kwargs)
+        os.replace(tmp_path, h5_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return year, fire_name, len(imgs), None if errors is None else errors.tolist()
+
+
+def add_crop_indices(target_dir, num_workers):
+    """_summary_ Adds the crop index to all existing HDF5 files in target_dir, without converting them again.
+    """
+    h5_paths = sorted(glob.glob(f"{target_dir}/*/*.hdf5"))
+    print(f"Adding crop indices to {len(h5_paths)} HDF5 files with {num_workers} processes.")
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(add_crop_index, h5_path) for h5_path in h5_paths]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+
+def load_manifest(manifest_path, layout_kwargs, restart):
+    """_summary_ Loads the record of completely converted fires. Returns an empty record if there is none yet, or if
+    restart is set. Refuses to resume a conversion that used different layout settings.
+    """
+    if restart or not Path(manifest_path).is_file():
+        return {"layout": layout_kwargs, "fires": {}}
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    # Manifests written before quantization was an option
+    manifest["layout"].setdefault("quantization", "none")
+    if manifest["layout"] != layout_kwargs:
+        raise ValueError(f"{manifest_path} was created with layout {manifest['layout']}, but {layout_kwargs} was requested. "
+                         f"Use a different --target_dir, or pass --restart to convert all fires again.")
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def write_quantization_report(report_path, manifest):
+    """_summary_ Writes the maximum absolute reconstruction error per channel over all converted fires, 
+    next to the maximum error and the fire it occurred in.
+    """
+    feature_names = FireSpreadDataset.map_channel_index_to_features(only_base=True)
+    report = {"quantization": manifest["layout"]["quantization"], "channels": {}}
+    for fire_key, record in manifest["fires"].items():
+        for c, error in enumerate(record.get("max_abs_error") or []):
+            channel = report["channels"].setdefault(feature_names[c], {"max_abs_error": 0.0, "fire": None})
+            if error >= channel["max_abs_error"]:
+                channel["max_abs_error"] = error
+                channel["fire"] = fire_key
+
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=1)
+    for feature_name, channel in report["channels"].items():
+        print(f"{feature_name:>40}: max abs error {channel['max_abs_error']:.4g}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str,
+                        help="Path to dataset directory", required=True)
+    parser.add_argument("--target_dir", type=str,
+                        help="Path to directory where the HDF5 files should be stored", required=True)
+    parser.add_argument("--chunk_layout", type=str, choices=CHUNK_LAYOUTS, default="none",
+                        help="HDF5 chunking: contiguous storage (none), one chunk per day (day) or per day and spatial tile (tile)")
+    parser.add_argument("--tile_size", type=int, default=64,
+                        help="Side length of the spatial tiles, if chunk_layout is tile")
+    parser.add_argument("--compression", type=str, choices=COMPRESSIONS, default="none",
+                        help="Compression filter. blosc-lz4 and lz4 require hdf5plugin. Compression implies chunking, at least one chunk per day.")
+    parser.add_argument("--compression_level", type=int, default=None,
+                        help="Compression level for gzip and blosc-lz4, uses the filter's default if not set")
+    parser.add_argument("--quantization", type=str, choices=QUANTIZATIONS, default="none",
+                        help="Store features as int16 or float16 with per-channel scale and offset, instead of float32. "
+                             f"The maximum reconstruction error per channel is written to {QUANTIZATION_REPORT_NAME}.")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(),
+                        help="Number of processes that convert fires in parallel")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the record of already converted fires and convert everything again")
+    parser.add_argument("--index_only", action="store_true",
+                        help="Only add the crop index of fire pixels to existing HDF5 files in target_dir, which were converted before "
+                             "the index was written. Newly converted files always contain it.")
+    args = parser.parse_args()
+
+    if args.index_only:
+        add_crop_indices(args.target_dir, args.num_workers)
+        return
+
+    years = [2018, 2019, 2020, 2021]
+    dataset = FireSpreadDataset(data_dir=args.data_dir,
+                                included_fire_years=years,
+                                # the following args are irrelevant here, but need to be set
+                                n_leading_observations=1, crop_side_length=128, load_from_hdf5=False, is_train=True,
+                                remove_duplicate_features=False, stats_years=(2018,2019))
+
+    for y in years:
+        target_dir = f"{args.target_dir}/{y}"
+        Path(target_dir).mkdir(parents=True, exist_ok=True)
+        # Leftovers of conversions that were interrupted while writing
+        for tmp_path in glob.glob(f"{target_dir}/*.tmp"):
+            os.remove(tmp_path)
+
+    layout_kwargs = {"chunk_layout": args.chunk_layout, "tile_size": args.tile_size,
+                     "compression": args.compression, "compression_level": args.compression_level,
+                     "quantization": args.quantization}
+    manifest_path = f"{args.target_dir}/{MANIFEST_NAME}"
+    manifest = load_manifest(manifest_path, layout_kwargs, args.restart)
+
+    # Only fires that are recorded as complete are skipped. Files that exist without a record, e.g. from a crashed
+    # run, are converted again.
+    tasks = []
+    n_done = 0
+    for year, fires_in_year in dataset.imgs_per_fire.items():
+        for fire_name, img_files in fires_in_year.items():
+            h5_path = f"{args.target_dir}/{year}/{fire_name}.hdf5"
+            record = manifest["fires"].get(f"{year}/{fire_name}")
+            if record is not None and record["n_imgs"] == len(img_files) and Path(h5_path).is_file():
+                n_done += 1
+                continue
+            if len(img_files) == 0:
+                continue
+            tasks.append((year, fire_name, img_files, h5_path))
+
+    print(f"{n_done} fires already converted, "
+          f"converting {len(tasks)} fires with {args.num_workers} processes.")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = {executor.submit(convert_fire, *task, layout_kwargs): task for task in tasks}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                year, fire_name, n_imgs, errors = future.result()
+            except Exception as e:
+                year, fire_name = futures[future][:2]
+                print(f"Converting fire {year}: {fire_name} failed: {e!r}")
+                failed.append(f"{year}/{fire_name}")
+                continue
+            manifest["fires"][f"{year}/{fire_name}"] = {"n_imgs": n_imgs, "max_abs_error": errors}
+            save_manifest(manifest_path, manifest)
+
+    if args.quantization != "none":
+        write_quantization_report(f"{args.target_dir}/{QUANTIZATION_REPORT_NAME}", manifest)
+
+    if failed:
+        raise RuntimeError(f"Conversion failed for {len(failed)} fires, rerun to retry them: {failed}")
+
+
+if __name__ == "__main__":
+    main()
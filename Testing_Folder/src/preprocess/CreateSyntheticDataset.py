@@ -0,0 +1,237 @@
+"""Writes a synthetic dataset in the layout of WildfireSpreadTS, for benchmarks and tests without the real data.
+
+Fires are written as 23-band GeoTIFFs (<target_dir>/<year>/<fire_name>/<date>.tif), which FireSpreadDataset reads with
+load_from_hdf5=False, and/or as HDF5 files (<target_dir>/<year>/<fire_name>.hdf5) in the format of CreateHDF5Dataset.py.
+
+Features are drawn around the mean and standard deviation of the real data, with spatially smooth structure. Static
+features (slope, aspect, elevation, land cover) are the same on all days of a fire. Each fire spreads from a few ignition
+points along an arrival time field, which is elongated in the wind direction and perturbed by smooth noise. The active
+fire feature of a day is the band of pixels that the fire reaches on that day, i.e. the fire front, with detection
+times in hhmm and NaN where there is no detection. Consecutive days therefore have adjacent fire masks, so the crop
+scoring of FireSpreadDataset.augment finds fire pixels in targets and inputs like on the real data. The number of
+active pixels per day rises and decays over the lifetime of a fire, so that the last days may have no detections at all.
+
+Example:
+    python src/preprocess/CreateSyntheticDataset.py --target_dir /tmp/synthetic --format both \\
+        --fires_per_year 20 --min_days 5 --max_days 30 --min_size 128 --max_size 384
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__).split("/src")[-2]))
+
+from src.dataloader.utils import get_means_stds_missing_values, get_indices_of_degree_features
+from src.preprocess.hdf5_utils import write_fire_hdf5
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import torch
+import torch.nn.functional as F
+from rasterio.transform import from_origin
+from tqdm import tqdm
+
+# Need to prevent an error with HDF5 files being locked and thereby inaccessible
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+N_FEATURES = 23
+LANDCOVER_FEATURE = 16
+ACTIVE_FIRE_FEATURE = 22
+STATIC_FEATURES = [12, 13, 14, LANDCOVER_FEATURE]
+# Features that share a missing value mask: VIIRS reflectances and vegetation indices (clouds), daily weather and
+# drought index, and topography. Weather forecasts and land cover have no missing values in the real data.
+NAN_GROUPS = [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9, 10, 11, 15], [12, 13, 14]]
+# Pixel size of the real data, in degrees (375 m)
+PIXEL_SIZE = 0.00337
+
+
+def smooth_noise(rng: np.random.Generator, shape, scale: int) -> np.ndarray:
+    """_summary_ Returns standard normal noise of shape (..., height, width) that varies smoothly over about scale pixels,
+    by bilinear upsampling of a coarse random grid.
+    """
+    *leading, height, width = shape
+    coarse = rng.standard_normal((int(np.prod(leading, dtype=np.int64)), 1,
+                                  height // scale + 2, width // scale + 2)).astype(np.float32)
+    fine = F.interpolate(torch.from_numpy(coarse), scale_factor=scale, mode="bilinear", align_corners=False)
+    fine = fine[..., :height, :width].numpy().reshape(shape)
+    return fine / fine.std()
+
+
+def simulate_active_fire(rng: np.random.Generator, n_days: int, height: int, width: int, fire_pixel_density: float,
+                         wind_direction: float) -> np.ndarray:
+    """_summary_ Simulates the active fire detections of a fire.
+
+    Args:
+        rng (np.random.Generator): _description_
+        n_days (int): _description_
+        height (int): _description_
+        width (int): _description_
+        fire_pixel_density (float): _description_ Average fraction of pixels with a detection per day.
+        wind_direction (float): _description_ Direction in degrees in which the fire spreads fastest.
+
+    Returns:
+        np.ndarray: _description_ float32 array of shape (n_days, height, width), with detection times in hhmm and NaN
+        where there is no detection.
+    """
+    # Arrival time of the fire at each pixel: Anisotropic distance to the nearest ignition point, perturbed by noise
+    rows, cols = np.mgrid[0:height, 0:width].astype(np.float32)
+    angle = np.deg2rad(wind_direction)
+    n_ignitions = int(rng.integers(1, 4))
+    center = np.array([height, width]) * rng.uniform(0.3, 0.7, size=2)
+    ignitions = center + rng.normal(0, min(height, width) / 10, size=(n_ignitions, 2))
+    arrival_time = np.full((height, width), np.inf, dtype=np.float32)
+    elongation = rng.uniform(1.5, 3)
+    for ignition_row, ignition_col in ignitions:
+        along = (cols - ignition_col) * np.cos(angle) - (rows - ignition_row) * np.sin(angle)
+        across = (cols - ignition_col) * np.sin(angle) + (rows - ignition_row) * np.cos(angle)
+        # Faster spread downwind than upwind
+        along = np.where(along > 0, along / elongation, along)
+        arrival_time = np.minimum(arrival_time, np.sqrt(along**2 + (across * elongation / 2)**2))
+    arrival_time *= np.exp(0.3 * smooth_noise(rng, (height, width), 16))
+
+    # Number of newly reached pixels per day, following the life cycle of a fire: growth, peak and decay
+    days = np.arange(n_days)
+    peak = rng.uniform(0.2, 0.6) * n_days
+    life_cycle = np.exp(-0.5 * ((days - peak) / max(n_days / 4, 1))**2)
+    life_cycle[-max(1, n_days // 8):] *= rng.uniform(0, 0.5)
+    n_active = fire_pixel_density * height * width * life_cycle / life_cycle.mean()
+    cumulative = np.minimum(np.round(np.cumsum(n_active)).astype(np.int64), height * width - 1)
+
+    sorted_times = np.sort(arrival_time, axis=None)
+    thresholds = np.concatenate([[-np.inf], sorted_times[cumulative]])
+    active_fire = np.full((n_days, height, width), np.nan, dtype=np.float32)
+    for day in days:
+        front = (arrival_time >= thresholds[day]) & (arrival_time < thresholds[day + 1])
+        # Not every burning pixel is detected
+        front &= rng.random((height, width)) > 0.1
+        # Overpasses of VIIRS around 01:30 and 13:30 local time
+        overpass = np.where(rng.random(int(front.sum())) < 0.5, 100, 1200)
+        active_fire[day][front] = overpass + rng.integers(0, 4, size=overpass.shape) * 100 + rng.integers(0, 60, size=overpass.shape)
+    return active_fire
+
+
+def generate_fire(seed: int, n_days: int, height: int, width: int, nan_rate: float, fire_pixel_density: float,
+                  means: np.ndarray, stds: np.ndarray) -> np.ndarray:
+    """_summary_ Generates all images of a synthetic fire, as they would be read from the TIF files.
+
+    Returns:
+        np.ndarray: _description_ float32 array of shape (n_days, 23, height, width).
+    """
+    rng = np.random.default_rng(seed)
+    imgs = np.empty((n_days, N_FEATURES, height, width), dtype=np.float32)
+    degree_features = get_indices_of_degree_features()
+
+    # Spatial structure that is shared by all days, and smaller changes per day
+    static_noise = smooth_noise(rng, (N_FEATURES, height, width), 24)
+    for day in range(n_days):
+        daily_noise = smooth_noise(rng, (N_FEATURES, height, width), 48)
+        imgs[day] = means[:, None, None] + stds[:, None, None] * (0.8 * static_noise + 0.6 * daily_noise)
+        for c in STATIC_FEATURES:
+            imgs[day, c] = means[c] + stds[c] * static_noise[c]
+
+    # Features that are not standardized have mean 0 and std 1 in the statistics, and are generated separately
+    wind_direction = rng.uniform(0, 360)
+    for c in degree_features:
+        base = wind_direction if c != 13 else rng.uniform(0, 360)
+        imgs[:, c] = (base + 40 * (static_noise[c] if c == 13 else imgs[:, c] - means[c])) % 360
+    landcover = np.floor((static_noise[LANDCOVER_FEATURE] - static_noise[LANDCOVER_FEATURE].min()) * 4) % 17 + 1
+    imgs[:, LANDCOVER_FEATURE] = landcover
+    # Precipitation can't be negative
+    imgs[:, [5, 17]] = np.maximum(imgs[:, [5, 17]], 0)
+
+    imgs[:, ACTIVE_FIRE_FEATURE] = simulate_active_fire(rng, n_days, height, width, fire_pixel_density, wind_direction)
+
+    # Missing values come in patches, e.g. clouds
+    if nan_rate > 0:
+        for nan_group in NAN_GROUPS:
+            n_nan_days = 1 if nan_group == NAN_GROUPS[-1] else n_days
+            noise = smooth_noise(rng, (n_nan_days, height, width), 16)
+            mask = noise > np.quantile(noise, 1 - nan_rate)
+            for c in nan_group:
+                imgs[:, c][np.broadcast_to(mask, (n_days, height, width))] = np.nan
+    return imgs
+
+
+def write_fire(target_dir: str, data_format: str, year: int, fire_name: str, seed: int, n_days: int, height: int,
+               width: int, nan_rate: float, fire_pixel_density: float, means: np.ndarray, stds: np.ndarray):
+    """_summary_ Generates a fire and writes it in the TIF and/or HDF5 layout.
+    """
+    rng = np.random.default_rng(seed)
+    imgs = generate_fire(seed, n_days, height, width, nan_rate, fire_pixel_density, means, stds)
+    start_date = date(year, 5, 1) + timedelta(days=int(rng.integers(0, 150)))
+    img_dates = [(start_date + timedelta(days=day)).isoformat() for day in range(n_days)]
+    lng, lat = rng.uniform(-124, -104), rng.uniform(32, 49)
+    transform = from_origin(lng - width / 2 * PIXEL_SIZE, lat + height / 2 * PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE)
+
+    if data_format in ["tif", "both"]:
+        tif_dir = Path(target_dir) / ("tif" if data_format == "both" else "") / str(year) / fire_name
+        tif_dir.mkdir(parents=True, exist_ok=True)
+        for img_date, img in zip(img_dates, imgs):
+            with rasterio.open(tif_dir / f"{img_date}.tif", "w", driver="GTiff", height=height, width=width,
+                               count=N_FEATURES, dtype="float32", crs="EPSG:4326", transform=transform) as ds:
+                ds.write(img)
+
+    if data_format in ["hdf5", "both"]:
+        hdf5_dir = Path(target_dir) / ("hdf5" if data_format == "both" else "") / str(year)
+        hdf5_dir.mkdir(parents=True, exist_ok=True)
+        # Same preprocessing of the active fire feature as in FireSpreadDataset.load_fire_for_hdf5
+        imgs[:, -1, ...] = np.floor_divide(np.nan_to_num(imgs[:, -1, ...], nan=0), 100)
+        write_fire_hdf5(str(hdf5_dir / f"{fire_name}.hdf5"), year, fire_name, img_dates, (lng, lat), imgs)
+
+    return year, fire_name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target_dir", type=str, required=True,
+                        help="Directory to write the dataset to")
+    parser.add_argument("--format", type=str, choices=["tif", "hdf5", "both"], default="both",
+                        help="Layout to write. With both, TIF files are written to <target_dir>/tif and HDF5 files to <target_dir>/hdf5.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2018, 2019, 2020, 2021],
+                        help="Years to create. Training statistics and data folds of the real dataset refer to 2018 to 2021.")
+    parser.add_argument("--fires_per_year", type=int, default=10)
+    parser.add_argument("--min_days", type=int, default=5,
+                        help="Minimum number of days per fire")
+    parser.add_argument("--max_days", type=int, default=20,
+                        help="Maximum number of days per fire")
+    parser.add_argument("--min_size", type=int, default=128,
+                        help="Minimum height and width of the scenes, in pixels. Must exceed the crop_side_length used for training.")
+    parser.add_argument("--max_size", type=int, default=320,
+                        help="Maximum height and width of the scenes, in pixels")
+    parser.add_argument("--nan_rate", type=float, default=0.02,
+                        help="Fraction of missing values of the features that have missing values in the real data")
+    parser.add_argument("--fire_pixel_density", type=float, default=0.002,
+                        help="Average fraction of pixels with an active fire detection per day")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(),
+                        help="Number of processes that generate fires in parallel")
+    args = parser.parse_args()
+
+    if not (1 <= args.min_days <= args.max_days and 1 <= args.min_size <= args.max_size):
+        raise ValueError("Expected 1 <= min_days <= max_days and 1 <= min_size <= max_size.")
+
+    # Features are generated around the statistics of the real data
+    means, stds, _ = get_means_stds_missing_values([2018, 2019])
+
+    rng = np.random.default_rng(args.seed)
+    tasks = []
+    for year in args.years:
+        for fire_id in range(args.fires_per_year):
+            tasks.append(dict(year=year, fire_name=f"fire_{year}{fire_id:05d}", seed=int(rng.integers(2**31)),
+                              n_days=int(rng.integers(args.min_days, args.max_days + 1)),
+                              height=int(rng.integers(args.min_size, args.max_size + 1)),
+                              width=int(rng.integers(args.min_size, args.max_size + 1))))
+
+    print(f"Generating {len(tasks)} fires with {args.num_workers} processes.")
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = [executor.submit(write_fire, args.target_dir, args.format, nan_rate=args.nan_rate,
+                                   fire_pixel_density=args.fire_pixel_density, means=means, stds=stds, **task)
+                   for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from typing import Optional, Tuple
+
+import h5py
+import numpy as np
+
+from src.dataloader.crop_index import (FIRE_PIXEL_OFFSETS_NAME, FIRE_PIXEL_VALUES_NAME, FIRE_PIXELS_NAME,
+                                       compute_crop_index)
+from src.dataloader.quantization import (QUANTIZATIONS, dequantize_imgs, get_quantization_params,
+                                         max_reconstruction_error, quantize_imgs)
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+CHUNK_LAYOUTS = ["none", "day", "tile"]
+COMPRESSIONS = ["none", "lzf", "gzip", "blosc-lz4", "lz4"]
+
+
+def get_chunk_shape(imgs_shape: Tuple[int, ...], chunk_layout: str, tile_size: int = 64) -> Optional[Tuple[int, ...]]:
+    """_summary_ Computes the HDF5 chunk shape for a fire with the given data shape.
+
+    Args:
+        imgs_shape (Tuple[int, ...]): _description_ Shape of the fire's data, (days, features, height, width).
+        chunk_layout (str): _description_ One of "none" (contiguous storage), "day" (one chunk per day)
+        or "tile" (one chunk per day and spatial tile of tile_size x tile_size pixels).
+        tile_size (int, optional): _description_ Side length of the spatial tiles for the "tile" layout. Defaults to 64.
+
+    Returns:
+        Optional[Tuple[int, ...]]: _description_ Chunk shape, or None for contiguous storage.
+    """
+    if chunk_layout not in CHUNK_LAYOUTS:
+        raise ValueError(f"Unknown chunk layout {chunk_layout}, expected one of {CHUNK_LAYOUTS}.")
+
+    _, C, H, W = imgs_shape
+    if chunk_layout == "none":
+        return None
+    if chunk_layout == "day":
+        return (1, C, H, W)
+    return (1, C, min(tile_size, H), min(tile_size, W))
+
+
+def get_compression_kwargs(compression: str, compression_level: Optional[int] = None) -> dict:
+    """_summary_ Translates a compression name into keyword arguments for h5py's create_dataset.
+
+    Args:
+        compression (str): _description_ One of "none", "lzf", "gzip", "blosc-lz4" or "lz4". The last two require hdf5plugin,
+        which also needs to be installed wherever the files are read.
+        compression_level (Optional[int], optional): _description_ Compression level for gzip (0-9) and blosc-lz4 (0-9).
+        Defaults to None, which uses the filter's default.
+
+    Returns:
+        dict: _description_ Keyword arguments for h5py's create_dataset.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}.")
+
+    if compression == "none":
+        return {}
+    if compression == "lzf":
+        return {"compression": "lzf"}
+    if compression == "gzip":
+        return {"compression": "gzip", "compression_opts": 4 if compression_level is None else compression_level}
+
+    if hdf5plugin is None:
+        raise ImportError(f"Compression {compression} requires the hdf5plugin package.")
+    if compression == "blosc-lz4":
+        return dict(hdf5plugin.Blosc(cname="lz4", clevel=5 if compression_level is None else compression_level,
+                                     shuffle=hdf5plugin.Blosc.SHUFFLE))
+    return dict(hdf5plugin.LZ4())
+
+
+def write_fire_hdf5(h5_path: str, year: int, fire_name: str, img_dates, lnglat, imgs: np.ndarray,
+                    chunk_layout: str = "none", tile_size: int = 64, compression: str = "none",
+                    compression_level: Optional[int] = None, quantization: str = "none") -> Optional[np.ndarray]:
+    """_summary_ Writes all images of a fire into a single HDF5 file, in the format that FireSpreadDataset expects.
+
+    Args:
+        h5_path (str): _description_ Path of the HDF5 file to create.
+        year (int): _description_ Year of the fire.
+        fire_name (str): _description_ Name of the fire.
+        img_dates (_type_): _description_ Date strings of the images.
+        lnglat (_type_): _description_ Longitude and latitude of the image center.
+        imgs (np.ndarray): _description_ Images of shape (days, features, height, width).
+        chunk_layout (str, optional): _description_ See get_chunk_shape. Defaults to "none".
+        tile_size (int, optional): _description_ See get_chunk_shape. Defaults to 64.
+        compression (str, optional): _description_ See get_compression_kwargs. Defaults to "none".
+        compression_level (Optional[int], optional): _description_ See get_compression_kwargs. Defaults to None.
+        quantization (str, optional): _description_ One of "none", "int16" or "float16". Quantized data is stored with per-channel
+        "scale" and "offset" attributes, which FireSpreadDataset uses to dequantize it when loading, see quantize_imgs. Defaults to "none".
+
+    The file additionally contains the crop index of the fire, see write_crop_index.
+
+    Returns:
+        Optional[np.ndarray]: _description_ Maximum absolute reconstruction error per channel, or None if quantization is "none".
+    """
+    # Compression filters only work on chunked datasets, so fall back to one chunk per day.
+    if compression != "none" and chunk_layout == "none":
+        chunk_layout = "day"
+
+    crop_index = compute_crop_index(imgs[:, -1, ...])
+    errors = None
+    if quantization != "none":
+        quantized, scale, offset = quantize_imgs(imgs, quantization)
+        errors = max_reconstruction_error(imgs, quantized, scale, offset)
+        imgs = quantized
+
+    with h5py.File(h5_path, "w") as f:
+        dset = f.create_dataset("data", imgs.shape, data=imgs,
+                                chunks=get_chunk_shape(imgs.shape, chunk_layout, tile_size),
+                                **get_compression_kwargs(compression, compression_level))
+        dset.attrs["year"] = year
+        dset.attrs["fire_name"] = fire_name
+        dset.attrs["img_dates"] = img_dates
+        dset.attrs["lnglat"] = lnglat
+        if quantization != "none":
+            dset.attrs["quantization"] = quantization
+            dset.attrs["scale"] = scale
+            dset.attrs["offset"] = offset
+        write_crop_index(f, *crop_index)
+
+    return errors
+
+
+def write_crop_index(f: h5py.File, fire_pixels: np.ndarray, fire_pixel_values: np.ndarray, fire_pixel_offsets: np.ndarray):
+    """_summary_ Stores the crop index of a fire, see compute_crop_index, as small datasets next to "data". 
+    FireSpreadDataset uses it to choose training crops before reading, and then only reads the crop window.
+    Existing crop index datasets are replaced.
+    """
+    for name, values in [(FIRE_PIXELS_NAME, fire_pixels), (FIRE_PIXEL_VALUES_NAME, fire_pixel_values),
+                         (FIRE_PIXEL_OFFSETS_NAME, fire_pixel_offsets)]:
+        if name in f:
+            del f[name]
+        f.create_dataset(name, data=values)
+
+
+def add_crop_index(h5_path: str):
+    """_summary_ Adds the crop index to an existing HDF5 file, e.g. one that was converted before crop indices existed. 
+    Only the active fire feature is read.
+    """
+    with h5py.File(h5_path, "a") as f:
+        dset = f["data"]
+        active_fire = dset[:, -1:, ...]
+        quantization_params = get_quantization_params(dset)
+        if quantization_params is not None:
+            scale, offset = quantization_params
+            active_fire = dequantize_imgs(active_fire, scale[-1:], offset[-1:])
+        write_crop_index(f, *compute_crop_index(active_fire[:, 0, ...]))
@@ -0,0 +1,175 @@
+"""Runs several data folds, see FireSpreadDataModule.split_fires, with one shared FireCatalog, and collects their metrics in one table.
+
+Running each fold as its own train.py process lists every year again, loads the statistics of its years again and, with
+resident_memory_budget_gb, reads its training years into memory again, although the twelve folds only combine four years.
+Here, the folds share one catalog, which does this once per year:
+- With --n_processes 1, the folds run one after another in this process, and each data module takes over the catalog of the previous one.
+- With --n_processes > 1, the catalog is filled in this process first, by setting up the data of all folds, and then sent to
+  worker processes that run the folds in parallel. Resident years are shared memory, so all workers read the same copy.
+  Each worker uses the devices of the trainer config, so parallel folds share the GPUs.
+
+All arguments that are not listed below are passed on to LightningCLI, exactly as for train.py. data.data_fold_id is set per fold,
+and each fold logs and saves its checkpoints in the subdirectory fold_<id> of trainer.default_root_dir. Training, validation and
+test metrics of each fold are written to a CSV table, together with the mean over all folds.
+
+Example:
+    python src/run_folds.py --folds 0 1 2 3 --output folds.csv --config cfgs/unet/res18_monotemporal.yaml \\
+        --trainer cfgs/trainer_single_gpu.yaml --data cfgs/data_monotemporal_full_features.yaml
+"""
+from dataloader.FireSpreadDataModule import FireSpreadDataModule
+from models import BaseModel
+from train import MyLightningCLI, run
+import argparse
+import csv
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+import torch.multiprocessing as mp
+import wandb
+
+# Columns of the results table that are not metrics
+FOLD_COLUMNS = ["fold", "train_years", "val_years", "test_years", "duration_s"]
+
+
+class FoldCLI(MyLightningCLI):
+    def before_instantiate_classes(self):
+        super().before_instantiate_classes()
+        # Folds must not share a log directory, otherwise folds that run at the same time get the same logger version,
+        # and load each other's "best" checkpoint.
+        root_dir = os.path.join(self.config.trainer.default_root_dir, f"fold_{self.config.data.data_fold_id}")
+        self.config.trainer.default_root_dir = root_dir
+        logger = self.config.trainer.logger
+        if logger and "init_args" in logger and "save_dir" in logger.init_args:
+            logger.init_args.save_dir = root_dir
+
+
+def build_cli(cli_args, fold: int) -> MyLightningCLI:
+    """_summary_ Instantiates the model, data module and trainer of a fold, as train.py does.
+    """
+    return FoldCLI(BaseModel, FireSpreadDataModule, subclass_mode_model=True, save_config_kwargs={
+        "overwrite": True}, parser_kwargs={"parser_mode": "yaml"}, args=cli_args + [f"--data.data_fold_id={fold}"], run=False)
+
+
+def run_fold(cli_args, fold: int, catalog=None):
+    """_summary_ Runs a fold, with the given catalog if not None.
+
+    Returns:
+        _type_: _description_ The row of the fold in the results table, and the catalog that the fold used.
+    """
+    cli = build_cli(cli_args, fold)
+    if catalog is not None:
+        cli.datamodule.catalog = catalog
+    cli.wandb_setup()
+
+    start_time = time.perf_counter()
+    metrics = run(cli)
+    train_years, val_years, test_years = FireSpreadDataModule.split_fires(fold)
+    row = {"fold": fold, "train_years": " ".join(map(str, train_years)), "val_years": " ".join(map(str, val_years)),
+           "test_years": " ".join(map(str, test_years)), "duration_s": time.perf_counter() - start_time, **metrics}
+
+    # Each fold is logged as its own run
+    if wandb.run is not None:
+        wandb.finish()
+    return row, cli.datamodule.catalog
+
+
+def run_folds_worker(cli_args, folds, catalog, results):
+    """_summary_ Runs the given folds one after another in a worker process, and puts their rows into the results queue.
+    """
+    for fold in folds:
+        row, catalog = run_fold(cli_args, fold, catalog)
+        results.put(row)
+
+
+def fill_catalog(cli_args, folds):
+    """_summary_ Sets up the data of all folds in this process, which lists all years, loads the statistics of all
+    training years and, if resident_memory_budget_gb is set, makes the training years resident. Returns the catalog.
+    """
+    data_module = build_cli(cli_args, folds[0]).datamodule
+    for fold in folds:
+        data_module.data_fold_id = fold
+        data_module.setup("fit")
+    return data_module.catalog
+
+
+def run_folds_in_processes(cli_args, folds, n_processes: int):
+    """_summary_ Runs the folds in n_processes spawned worker processes, which share one catalog.
+
+    Returns:
+        _type_: _description_ The rows of the folds that finished, and whether all worker processes succeeded.
+    """
+    catalog = fill_catalog(cli_args, folds)
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=run_folds_worker, args=(cli_args, folds[i::n_processes], catalog, results))
+                 for i in range(n_processes)]
+    for process in processes:
+        process.start()
+
+    rows = []
+    while len(rows) < len(folds):
+        try:
+            rows.append(results.get(timeout=10))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join()
+    return rows, all(process.exitcode == 0 for process in processes)
+
+
+def write_table(rows, output_path: str):
+    """_summary_ Writes one row per fold and the mean over all folds to a CSV file, and prints the table.
+    """
+    rows = sorted(rows, key=lambda row: row["fold"])
+    metric_columns = sorted({key for row in rows for key in row} - set(FOLD_COLUMNS))
+    mean_row = {"fold": "mean", "duration_s": float(np.mean([row["duration_s"] for row in rows]))}
+    for column in metric_columns:
+        values = [row[column] for row in rows if column in row]
+        mean_row[column] = float(np.mean(values))
+
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FOLD_COLUMNS + metric_columns)
+        writer.writeheader()
+        writer.writerows(rows + [mean_row])
+
+    print(f"\nResults of {len(rows)} folds, written to {output_path}:")
+    for row in rows + [mean_row]:
+        print(", ".join(f"{column}={row[column]:.4f}" if isinstance(row.get(column), float) else f"{column}={row.get(column, '')}"
+                        for column in ["fold"] + metric_columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folds", type=int, nargs="+", default=list(range(12)),
+                        help="Data folds to run, see FireSpreadDataModule.split_fires. Defaults to all twelve.")
+    parser.add_argument("--n_processes", type=int, default=1,
+                        help="Number of worker processes that run folds in parallel. 1 runs all folds in this process.")
+    parser.add_argument("--output", type=str, default="folds.csv",
+                        help="Path of the CSV file to write the metrics of all folds to")
+    args, cli_args = parser.parse_known_args()
+    cli_args = [arg for arg in cli_args if arg != "--"]
+    # LightningCLI receives its arguments via args, and warns if there are command line arguments as well
+    sys.argv = sys.argv[:1]
+
+    if args.n_processes > 1:
+        rows, success = run_folds_in_processes(cli_args, args.folds, args.n_processes)
+    else:
+        rows, catalog = [], None
+        for fold in args.folds:
+            row, catalog = run_fold(cli_args, fold, catalog)
+            rows.append(row)
+        success = True
+
+    if rows:
+        write_table(rows, args.output)
+    if not success or len(rows) < len(args.folds):
+        missing_folds = sorted(set(args.folds) - {row["fold"] for row in rows})
+        raise RuntimeError(f"Folds {missing_folds} did not finish, see the output of the worker processes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import wandb
 import os
 
 from dataloader.FireSpreadDataset import FireSpreadDataset
-from dataloader.utils import get_means_stds_missing_values
+from dataloader.utils import get_fire_rate
 
 os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
 torch.set_float32_matmul_precision('high')
@@ -40,12 +40,21 @@ class MyLightningCLI(LightningCLI):
             self.config.data.remove_duplicate_features)
         self.config.model.init_args.n_channels = n_features
 
+        # With landcover_as_index, the dataset returns land cover as class indices, which the model embeds before the forward pass.
+        # n_channels above already counts the embedded channels, the model only needs to know where the index channels are.
+        if self.config.data.landcover_as_index:
+            self.config.model.init_args.landcover_channel_ids = FireSpreadDataset.get_landcover_channel_ids(
+                self.config.data.n_leading_observations,
+                self.config.data.features_to_keep,
+                self.config.data.remove_duplicate_features)
+
         # The exact positive class weight changes with the data fold in the data module, but the weight is needed to instantiate the model.
-        # Non-fire pixels are marked as missing values in the active fire feature, so we simply use that to compute the positive class weight.
+        # Uses the statistics computed by src/preprocess/ComputeDatasetStatistics.py if available, otherwise the hardcoded ones.
         train_years, _, _ = FireSpreadDataModule.split_fires(
             self.config.data.data_fold_id)
-        _, _, missing_values_rates = get_means_stds_missing_values(train_years)
-        fire_rate = 1 - missing_values_rates[-1]
+        data_format = "memmap" if self.config.data.load_from_memmap else "hdf5" if self.config.data.load_from_hdf5 else "tif"
+        fire_rate = get_fire_rate(train_years, data_dir=self.config.data.data_dir, data_format=data_format,
+                                  use_inventory_cache=self.config.data.use_inventory_cache)
         pos_class_weight = float(1 / fire_rate)
 
         self.config.model.init_args.pos_class_weight = pos_class_weight
@@ -86,20 +95,28 @@ class MyLightningCLI(LightningCLI):
 
 
 from plot_callback import PlotLossCallback
+from data_timing_callback import DataTimingCallback
 
-def main():
-    # Instantiate the Lightning CLI
-    cli = MyLightningCLI(BaseModel, FireSpreadDataModule, subclass_mode_model=True, save_config_kwargs={
-        "overwrite": True}, parser_kwargs={"parser_mode": "yaml"}, run=False)
-    cli.wandb_setup()
+def run(cli):
+    """_summary_ Runs training, validation, testing and prediction, as selected by the do_* arguments of the CLI.
 
+    Args:
+        cli (_type_): _description_ MyLightningCLI, instantiated with run=False.
+
+    Returns:
+        _type_: _description_ Dictionary of the metrics logged by the last of training, validation and testing.
+    """
     # Add the custom callback to log training and validation loss
     loss_callback = PlotLossCallback()
     cli.trainer.callbacks.append(loss_callback)
+    # Logs data loading stage timings, if enabled via log_stage_timings of the data module
+    cli.trainer.callbacks.append(DataTimingCallback())
 
+    metrics = {}
     if cli.config.do_train:
         cli.trainer.fit(cli.model, cli.datamodule,
                         ckpt_path=cli.config.ckpt_path)
+        metrics.update({key: float(value) for key, value in cli.trainer.callback_metrics.items()})
 
     # Use the best checkpoint for validation, testing, and prediction
     ckpt = cli.config.ckpt_path
@@ -107,10 +124,10 @@ def main():
         ckpt = "best"
 
     if cli.config.do_validate:
-        cli.trainer.validate(cli.model, cli.datamodule, ckpt_path=ckpt)
+        metrics.update(cli.trainer.validate(cli.model, cli.datamodule, ckpt_path=ckpt)[0])
 
     if cli.config.do_test:
-        cli.trainer.test(cli.model, cli.datamodule, ckpt_path=ckpt)
+        metrics.update(cli.trainer.test(cli.model, cli.datamodule, ckpt_path=ckpt)[0])
 
     if cli.config.do_predict:
         # Produce predictions and save them
@@ -128,5 +145,15 @@ def main():
             cli.config.trainer.default_root_dir, f"predictions_{wandb.run.id}.pt")
         torch.save(fire_masks_combined, predictions_file_name)
 
+    return metrics
+
+
+def main():
+    # Instantiate the Lightning CLI
+    cli = MyLightningCLI(BaseModel, FireSpreadDataModule, subclass_mode_model=True, save_config_kwargs={
+        "overwrite": True}, parser_kwargs={"parser_mode": "yaml"}, run=False)
+    cli.wandb_setup()
+    run(cli)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
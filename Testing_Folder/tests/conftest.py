@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The code in src imports its packages as top-level modules, e.g. "from dataloader.FireSpreadDataset import ...",
+# as when running src/train.py. The scripts in src/preprocess import them from the repository root, e.g. "from src.dataloader...".
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
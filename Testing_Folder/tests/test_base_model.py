@@ -0,0 +1,87 @@
+import pytest
+import torch
+
+from dataloader.utils import pad_collate
+from models import LogisticRegression
+
+N_OBSERVATIONS = 1
+N_FEATURES = 3
+
+
+def make_scene(H, W, seed):
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(N_OBSERVATIONS, N_FEATURES, H, W, generator=generator)
+    y = (torch.rand(H, W, generator=generator) > 0.7).long()
+    return x, y
+
+
+def make_model(loss_function):
+    torch.manual_seed(0)
+    model = LogisticRegression(n_channels=N_OBSERVATIONS * N_FEATURES, flatten_temporal_dimension=True,
+                               pos_class_weight=2.0, loss_function=loss_function)
+    # Logging requires a trainer, which isn't needed to check the loss
+    model.log = lambda *args, **kwargs: None
+    model.log_dict = lambda *args, **kwargs: None
+    return model.eval()
+
+
+@pytest.mark.parametrize("loss_function", ["Dice", "Jaccard", "BCE", "Lovasz"])
+def test_test_step_on_padded_batch_averages_scene_losses(loss_function):
+    model = make_model(loss_function)
+    scenes = [make_scene(20, 12, 0), make_scene(16, 24, 1), make_scene(20, 24, 2)]
+    batch = pad_collate(scenes)
+    assert (batch[1] < 0).any()
+
+    with torch.no_grad():
+        loss = model.test_step(batch, 0)
+        scene_losses = [model.test_step((x[None], y[None]), 0) for x, y in scenes]
+
+    # Padding must not change the loss of a scene, and each scene counts equally, independent of its size
+    assert loss.dim() == 0
+    torch.testing.assert_close(loss, torch.stack(scene_losses).mean())
+
+
+@pytest.mark.parametrize("loss_function", ["Dice", "Jaccard"])
+def test_test_step_without_padding_matches_compute_loss(loss_function):
+    model = make_model(loss_function)
+    x, y = make_scene(16, 16, 3)
+
+    with torch.no_grad():
+        loss = model.test_step((x[None], y[None]), 0)
+        y_hat, _ = model.get_pred_and_gt((x[None], y[None]))
+        expected_loss = model.compute_loss(y_hat, y[None])
+
+    torch.testing.assert_close(loss, expected_loss)
+
+
+class PixelwiseModel(LogisticRegression):
+    """Predicts each pixel from its own features only, so it works at any input size, and adds the mean day of year
+    of each sample, so that crops only match if they get the day of year of their own image."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.model = torch.nn.Conv2d(N_OBSERVATIONS * N_FEATURES, 1, kernel_size=1)
+
+    def forward(self, x, doys=None):
+        y_hat = super().forward(x)
+        if doys is not None:
+            y_hat = y_hat + doys.float().mean(dim=1)[:, None, None, None]
+        return y_hat
+
+
+@pytest.mark.parametrize("use_doy", [False, True])
+@pytest.mark.parametrize("tile_batch_size", [1, 4, 32])
+def test_predict_tiled_matches_full_image_forward(use_doy, tile_batch_size):
+    torch.manual_seed(0)
+    model = PixelwiseModel(n_channels=N_OBSERVATIONS * N_FEATURES, flatten_temporal_dimension=True, pos_class_weight=2.0,
+                           loss_function="BCE", required_img_size=[8, 8], tile_batch_size=tile_batch_size, use_doy=use_doy)
+    # Neither side is a multiple of the crop size, so the last crops overlap their neighbours
+    x = torch.randn(3, N_OBSERVATIONS, N_FEATURES, 20, 13)
+    doys = torch.tensor([[10], [200], [300]]) if use_doy else None
+
+    with torch.no_grad():
+        y_hat = model.predict_tiled(x, doys)
+        expected = model(x, doys).squeeze(1)
+
+    assert y_hat.shape == (3, 20, 13)
+    torch.testing.assert_close(y_hat, expected)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+
+from dataloader.FireSpreadDataset import FireSpreadDataset
+from dataloader.utils import get_means_stds_missing_values
+from src.preprocess.CreateSyntheticDataset import generate_fire
+from src.preprocess.hdf5_utils import write_fire_hdf5
+
+YEAR = 2018
+CROP_SIDE_LENGTH = 16
+N_LEADING_OBSERVATIONS = 2
+
+
+@pytest.fixture(scope="module", params=["none", "int16"])
+def data_dir(request, tmp_path_factory):
+    """_summary_ Writes three synthetic fires in the HDF5 format of CreateHDF5Dataset, including the crop index.
+    """
+    data_dir = tmp_path_factory.mktemp(f"hdf5_{request.param}")
+    (data_dir / str(YEAR)).mkdir()
+    means, stds, _ = get_means_stds_missing_values([2018, 2019])
+    for i, (n_days, height, width) in enumerate([(5, 40, 52), (6, 33, 33), (4, 64, 37)]):
+        imgs = generate_fire(i, n_days, height, width, nan_rate=0.05, fire_pixel_density=0.02, means=means, stds=stds)
+        # Same preprocessing of the active fire feature as in CreateHDF5Dataset
+        imgs[:, -1, ...] = np.floor_divide(np.nan_to_num(imgs[:, -1, ...], nan=0), 100)
+        img_dates = [f"{YEAR}-07-{day + 1:02d}" for day in range(n_days)]
+        write_fire_hdf5(str(data_dir / str(YEAR) / f"fire_{i}.hdf5"), YEAR, f"fire_{i}", img_dates, (-120.0, 40.0), imgs,
+                        quantization=request.param)
+    return str(data_dir)
+
+
+def make_dataset(data_dir, use_crop_index):
+    return FireSpreadDataset(data_dir, included_fire_years=[YEAR], n_leading_observations=N_LEADING_OBSERVATIONS,
+                             crop_side_length=CROP_SIDE_LENGTH, load_from_hdf5=True, is_train=True,
+                             remove_duplicate_features=False, stats_years=(2018, 2019), use_crop_index=use_crop_index)
+
+
+def test_read_crop_window_equals_cropped_full_read(data_dir):
+    dataset = make_dataset(data_dir, use_crop_index=True)
+    for index in range(len(dataset)):
+        fire_year, fire_name, in_fire_index = dataset.find_image_index_from_dataset_index(index)
+        end_index = in_fire_index + N_LEADING_OBSERVATIONS + 1
+        assert dataset.can_read_crop_window(fire_year, fire_name)
+
+        np.random.seed(index)
+        crop = dataset.read_crop_window(fire_year, fire_name, in_fire_index, end_index)
+
+        # Choose the window from the full images, with the same random draws, as augment does
+        np.random.seed(index)
+        imgs = dataset.read_days(fire_year, fire_name, in_fire_index, end_index)
+        top, left = dataset.select_crop_window(torch.from_numpy(imgs[-1, -1] > 0).long(), torch.from_numpy(imgs[:-1, -1]))
+        expected = imgs[..., top:top + CROP_SIDE_LENGTH, left:left + CROP_SIDE_LENGTH]
+
+        assert crop.shape == (N_LEADING_OBSERVATIONS + 1, imgs.shape[1], CROP_SIDE_LENGTH, CROP_SIDE_LENGTH)
+        np.testing.assert_array_equal(crop, expected)
+
+
+def test_samples_match_the_full_read_path(data_dir):
+    with_index = make_dataset(data_dir, use_crop_index=True)
+    without_index = make_dataset(data_dir, use_crop_index=False)
+    for index in range(len(with_index)):
+        np.random.seed(index)
+        x, y = with_index[index]
+        np.random.seed(index)
+        expected_x, expected_y = without_index[index]
+        torch.testing.assert_close(x, expected_x, equal_nan=True)
+        torch.testing.assert_close(y, expected_y)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import torch
+
+from dataloader.FireSpreadDataset import FireSpreadDataset
+
+CROP_SIDE_LENGTH = 8
+
+
+def make_dataset(n_crop_candidates):
+    # select_crop_window only depends on the crop settings, so no data needs to be loaded
+    dataset = FireSpreadDataset.__new__(FireSpreadDataset)
+    dataset.crop_side_length = CROP_SIDE_LENGTH
+    dataset.n_crop_candidates = n_crop_candidates
+    return dataset
+
+
+def make_fire(H, W, seed):
+    generator = torch.Generator().manual_seed(seed)
+    target_mask = (torch.rand(H, W, generator=generator) > 0.9).long()
+    input_af = torch.rand(3, H, W, generator=generator) * (torch.rand(3, H, W, generator=generator) > 0.8)
+    return target_mask, input_af
+
+
+def brute_force_score(target_mask, input_af, top, left):
+    """_summary_ Scores a window by slicing it out, as augment did before the integral images.
+    """
+    c = CROP_SIDE_LENGTH
+    return input_af[:, top:top + c, left:left + c].double().mean() + \
+        1000 * target_mask[top:top + c, left:left + c].double().mean()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_candidate_window_has_the_best_brute_force_score(seed):
+    dataset = make_dataset(n_crop_candidates=10)
+    target_mask, input_af = make_fire(30, 41, seed)
+
+    np.random.seed(seed)
+    top, left = dataset.select_crop_window(target_mask, input_af)
+
+    # The same candidates, drawn from the same random state
+    np.random.seed(seed)
+    positions = np.random.randint(0, [30 - CROP_SIDE_LENGTH, 41 - CROP_SIDE_LENGTH], size=(10, 2))
+    scores = [brute_force_score(target_mask, input_af, candidate_top, candidate_left)
+              for candidate_top, candidate_left in positions]
+    assert (top, left) == tuple(positions[int(np.argmax(scores))])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_exhaustive_window_has_the_best_brute_force_score(seed):
+    dataset = make_dataset(n_crop_candidates=None)
+    target_mask, input_af = make_fire(20, 27, seed)
+
+    np.random.seed(seed)
+    top, left = dataset.select_crop_window(target_mask, input_af)
+
+    scores = torch.tensor([[brute_force_score(target_mask, input_af, candidate_top, candidate_left)
+                            for candidate_left in range(27 - CROP_SIDE_LENGTH)]
+                           for candidate_top in range(20 - CROP_SIDE_LENGTH)], dtype=torch.float64)
+    torch.testing.assert_close(scores[top, left], scores.max())
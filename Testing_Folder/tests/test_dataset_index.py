@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from dataloader.FireSpreadDataset import FireSpreadDataset
+
+# Includes fires without data points, and a year without fires
+DATAPOINTS_PER_FIRE = {
+    2018: {"fire_a": 3, "fire_b": 0, "fire_c": 5},
+    2019: {},
+    2020: {"fire_d": 0, "fire_e": 1, "fire_f": 4, "fire_g": 0},
+}
+
+
+def make_dataset(datapoints_per_fire):
+    # Index resolution only depends on datapoints_per_fire, so no data needs to be loaded
+    dataset = FireSpreadDataset.__new__(FireSpreadDataset)
+    dataset.datapoints_per_fire = datapoints_per_fire
+    dataset.fire_keys, dataset.fire_end_offsets = dataset.compute_cumulative_datapoints()
+    dataset.fire_key_years = np.array([fire_year for fire_year, _ in dataset.fire_keys], dtype=np.int64)
+    dataset.fire_key_names = np.array([fire_name for _, fire_name in dataset.fire_keys], dtype=object)
+    dataset.length = int(dataset.fire_end_offsets[-1]) if len(dataset.fire_end_offsets) > 0 else 0
+    return dataset
+
+
+def linear_scan(datapoints_per_fire, target_id):
+    """_summary_ The index resolution as implemented before the cumulative offsets, which walks over all fires.
+    """
+    first_id_in_current_fire = 0
+    for fire_year in datapoints_per_fire:
+        for fire_name, datapoints_in_fire in datapoints_per_fire[fire_year].items():
+            if target_id - first_id_in_current_fire < datapoints_in_fire:
+                return fire_year, fire_name, target_id - first_id_in_current_fire
+            first_id_in_current_fire += datapoints_in_fire
+    raise IndexError(target_id)
+
+
+def test_find_image_index_matches_linear_scan():
+    dataset = make_dataset(DATAPOINTS_PER_FIRE)
+    assert len(dataset) == 13
+
+    for target_id in range(len(dataset)):
+        assert dataset.find_image_index_from_dataset_index(target_id) == linear_scan(DATAPOINTS_PER_FIRE, target_id)
+        # Negative indices count from the end
+        assert dataset.find_image_index_from_dataset_index(target_id - len(dataset)) == \
+            linear_scan(DATAPOINTS_PER_FIRE, target_id)
+
+
+def test_find_image_indices_matches_linear_scan():
+    dataset = make_dataset(DATAPOINTS_PER_FIRE)
+    target_ids = np.random.default_rng(0).permutation(len(dataset))
+
+    years, names, in_fire_indices = dataset.find_image_indices_from_dataset_indices(target_ids)
+    for target_id, year, name, in_fire_index in zip(target_ids, years, names, in_fire_indices):
+        assert (year, name, in_fire_index) == linear_scan(DATAPOINTS_PER_FIRE, target_id)
+
+    years, names, in_fire_indices = dataset.find_image_indices_from_dataset_indices(target_ids - len(dataset))
+    assert list(names) == [linear_scan(DATAPOINTS_PER_FIRE, target_id)[1] for target_id in target_ids]
+
+
+def test_out_of_range_indices_raise():
+    dataset = make_dataset(DATAPOINTS_PER_FIRE)
+    with pytest.raises(RuntimeError):
+        dataset.find_image_index_from_dataset_index(len(dataset))
+    with pytest.raises(RuntimeError):
+        dataset.find_image_indices_from_dataset_indices([0, len(dataset)])
+    with pytest.raises(RuntimeError):
+        dataset.find_image_indices_from_dataset_indices([-len(dataset) - 1])
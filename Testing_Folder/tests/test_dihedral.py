@@ -0,0 +1,84 @@
+import itertools
+
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms.functional as TF
+
+from dataloader.FireSpreadDataset import FireSpreadDataset
+from dataloader.utils import get_indices_of_degree_features
+
+N_OBSERVATIONS = 2
+N_BANDS = 23
+
+
+def reference_transform(x, y, hflip, vflip, rotate, indices_of_degree_features):
+    """_summary_ The augmentation as implemented before dihedral_transform: TF.hflip, TF.vflip and TF.rotate one after
+    the other, each followed by its correction of the degree features.
+    """
+    if hflip:
+        x = TF.hflip(x)
+        y = TF.hflip(y)
+        x[:, indices_of_degree_features, ...] = 360 - x[:, indices_of_degree_features, ...]
+
+    if vflip:
+        x = TF.vflip(x)
+        y = TF.vflip(y)
+        x[:, indices_of_degree_features, ...] = (180 - x[:, indices_of_degree_features, ...]) % 360
+
+    if rotate != 0:
+        angle = rotate * 90
+        x = TF.rotate(x, angle)
+        y = torch.unsqueeze(y, 0)
+        y = TF.rotate(y, angle)
+        y = torch.squeeze(y, 0)
+        x[:, indices_of_degree_features, ...] = (x[:, indices_of_degree_features, ...] - 90 * rotate) % 360
+
+    return x, y
+
+
+def make_dataset():
+    # dihedral_transform only depends on the positions of the degree features, so no data needs to be loaded
+    dataset = FireSpreadDataset.__new__(FireSpreadDataset)
+    dataset.indices_of_degree_features = get_indices_of_degree_features()
+    return dataset
+
+
+def make_sample(side_length, seed):
+    rng = np.random.default_rng(seed)
+    x = torch.from_numpy(rng.normal(size=(N_OBSERVATIONS, N_BANDS, side_length, side_length)).astype(np.float32))
+    x[:, get_indices_of_degree_features(), ...] = torch.from_numpy(
+        rng.uniform(0, 360, size=(N_OBSERVATIONS, 3, side_length, side_length)).astype(np.float32))
+    y = torch.from_numpy(rng.integers(0, 2, size=(side_length, side_length)))
+    return x, y
+
+
+@pytest.mark.parametrize("side_length", [16, 17])
+@pytest.mark.parametrize("hflip,vflip,rotate", list(itertools.product([False, True], [False, True], range(4))))
+def test_dihedral_transform_matches_torchvision(side_length, hflip, vflip, rotate):
+    dataset = make_dataset()
+    x, y = make_sample(side_length, seed=side_length)
+
+    x_out, y_out = dataset.dihedral_transform(x.clone(), y.clone(), hflip, vflip, rotate)
+    x_ref, y_ref = reference_transform(x.clone(), y.clone(), hflip, vflip, rotate, dataset.indices_of_degree_features)
+
+    assert torch.equal(y_out, y_ref)
+
+    degree_features = dataset.indices_of_degree_features
+    other_features = [i for i in range(N_BANDS) if i not in degree_features]
+    assert torch.equal(x_out[:, other_features], x_ref[:, other_features])
+
+    # Angles may differ by multiples of 360, and by rounding, so they are compared as the sin and cos the model sees
+    angles_out = torch.deg2rad(x_out[:, degree_features])
+    angles_ref = torch.deg2rad(x_ref[:, degree_features])
+    torch.testing.assert_close(torch.sin(angles_out), torch.sin(angles_ref), atol=1e-4, rtol=0)
+    torch.testing.assert_close(torch.cos(angles_out), torch.cos(angles_ref), atol=1e-4, rtol=0)
+
+
+def test_dihedral_transforms_are_distinct():
+    # The 8 combinations of hflip and rotate cover all symmetries of the square, vflip adds no new ones
+    dataset = make_dataset()
+    x, y = make_sample(16, seed=0)
+    outputs = {tuple(dataset.dihedral_transform(x.clone(), y.clone(), hflip, False, rotate)[1].flatten().tolist())
+               for hflip, rotate in itertools.product([False, True], range(4))}
+    assert len(outputs) == 8
@@ -0,0 +1,67 @@
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from dataloader.hdf5_pool import HDF5HandlePool
+
+
+@pytest.fixture
+def hdf5_paths(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f"fire_{i}.hdf5")
+        with h5py.File(path, "w") as f:
+            f.create_dataset("data", data=np.full((2, 4, 4), i, dtype=np.float32))
+        paths.append(path)
+    return paths
+
+
+def test_eviction_keeps_leased_handles_open(hdf5_paths):
+    pool = HDF5HandlePool(max_open_files=1)
+    with pool.lease(hdf5_paths[0]) as f:
+        # Opening other files exceeds max_open_files, but must not close the leased file
+        for path in hdf5_paths[1:]:
+            with pool.lease(path) as other:
+                assert other["data"][0, 0, 0] == hdf5_paths.index(path)
+        assert f["data"][0, 0, 0] == 0
+    assert len(pool) == 1
+    pool.close_all()
+
+
+def test_handles_are_reused_and_evicted_least_recently_used_first(hdf5_paths):
+    pool = HDF5HandlePool(max_open_files=2)
+    with pool.lease(hdf5_paths[0]) as f0:
+        pass
+    with pool.lease(hdf5_paths[1]):
+        pass
+    with pool.lease(hdf5_paths[0]) as f:
+        assert f is f0
+    with pool.lease(hdf5_paths[2]):
+        pass
+    # File 1 was used least recently
+    assert len(pool) == 2 and f0.id.valid
+    pool.close_all()
+
+
+def test_concurrent_readers_with_a_small_pool(hdf5_paths):
+    pool = HDF5HandlePool(max_open_files=1)
+    errors = []
+
+    def read(path, expected):
+        try:
+            for _ in range(50):
+                with pool.lease(path) as f:
+                    assert f["data"][...].min() == expected
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(path, i)) for i, path in enumerate(hdf5_paths)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(pool) == 1
+    pool.close_all()
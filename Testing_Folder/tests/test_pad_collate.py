@@ -0,0 +1,59 @@
+import torch
+
+from dataloader.utils import COMPACT_PADDING_LABEL, PADDING_LABEL, pad_collate
+from models import LogisticRegression
+
+SHAPES = [(20, 12), (16, 24), (20, 24)]
+
+
+def make_samples(target_dtype=torch.long):
+    generator = torch.Generator().manual_seed(0)
+    return [(torch.randn(2, 3, H, W, generator=generator), (torch.rand(H, W, generator=generator) > 0.7).to(target_dtype),
+             torch.tensor([100.0 + i, 101.0 + i]))
+            for i, (H, W) in enumerate(SHAPES)]
+
+
+def test_pad_collate_pads_at_the_bottom_and_right():
+    samples = make_samples()
+    x, y, doys = pad_collate(samples)
+
+    assert x.shape == (3, 2, 3, 20, 24) and y.shape == (3, 20, 24)
+    torch.testing.assert_close(doys, torch.stack([sample[2] for sample in samples]))
+    for i, (sample_x, sample_y, _) in enumerate(samples):
+        H, W = sample_y.shape
+        torch.testing.assert_close(x[i, ..., :H, :W], sample_x)
+        torch.testing.assert_close(y[i, :H, :W], sample_y)
+        assert (x[i, ..., H:, :] == 0).all() and (x[i, ..., W:] == 0).all()
+        assert (y[i, H:, :] == PADDING_LABEL).all() and (y[i, :, W:] == PADDING_LABEL).all()
+        # The valid region of each scene is exactly its unpadded image
+        assert int((y[i] >= 0).sum()) == H * W
+
+
+def test_pad_collate_pads_compact_targets_with_their_own_label():
+    _, y, _ = pad_collate(make_samples(torch.uint8))
+    assert y.dtype == torch.uint8
+    assert (y[0, :, 12:] == COMPACT_PADDING_LABEL).all()
+    assert int((y != COMPACT_PADDING_LABEL).sum()) == sum(H * W for H, W in SHAPES)
+
+
+def test_masked_pixels_of_a_padded_batch_are_the_pixels_of_its_scenes():
+    torch.manual_seed(0)
+    model = LogisticRegression(n_channels=6, flatten_temporal_dimension=True, pos_class_weight=2.0, loss_function="BCE")
+    samples = [sample[:2] for sample in make_samples()]
+    x, y = pad_collate(samples)
+
+    with torch.no_grad():
+        y_hat = model(x).squeeze(1)
+        valid_mask = y >= 0
+        # A pooled loss over the valid pixels of the padded batch is the loss over all pixels of the scenes
+        masked_loss = model.compute_loss(y_hat[valid_mask], y[valid_mask])
+        scene_preds = [model(sample_x[None]).squeeze(1) for sample_x, _ in samples]
+        expected_loss = model.compute_loss(torch.cat([pred.flatten() for pred in scene_preds]),
+                                           torch.cat([sample_y.flatten() for _, sample_y in samples]))
+        # The scene loss averages the loss of each unpadded scene
+        scene_loss = model.compute_scene_loss(y_hat, y, valid_mask)
+        expected_scene_loss = torch.stack([model.compute_loss(pred, sample_y[None])
+                                           for pred, (_, sample_y) in zip(scene_preds, samples)]).mean()
+
+    torch.testing.assert_close(masked_loss, expected_loss)
+    torch.testing.assert_close(scene_loss, expected_scene_loss)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from dataloader.quantization import dequantize_imgs, quantize_imgs
+
+
+def make_integer_channel(low, high, seed=0):
+    rng = np.random.default_rng(seed)
+    imgs = rng.integers(low, high + 1, size=(2, 1, 16, 16)).astype(np.float32)
+    imgs[0, 0, 0, 0], imgs[0, 0, 0, 1] = low, high
+    return imgs
+
+
+def test_int16_keeps_integer_channels_lossless():
+    imgs = make_integer_channel(3000, 9000)
+    quantized, scale, offset = quantize_imgs(imgs, "int16")
+
+    assert scale[0] == 1 and offset[0] == 0
+    np.testing.assert_array_equal(dequantize_imgs(quantized, scale, offset), imgs)
+
+
+@pytest.mark.parametrize("shift", [0.0, 0.5])
+def test_float16_centers_channels_above_2048(shift):
+    # Elevation-like integers, which float16 can't represent exactly without centering
+    imgs = make_integer_channel(3000, 9000) + shift
+    quantized, scale, offset = quantize_imgs(imgs, "float16")
+
+    assert offset[0] == pytest.approx(6000 + shift)
+    error = np.abs(dequantize_imgs(quantized, scale, offset) - imgs).max()
+    # Centered values lie in [-3000, 3000], where float16 values are 2 apart
+    assert error <= 1.0
+
+
+@pytest.mark.parametrize("quantization", ["int16", "float16"])
+def test_round_trip_keeps_nans(quantization):
+    imgs = make_integer_channel(3000, 9000)
+    imgs[1, 0, 5, 5] = np.nan
+    quantized, scale, offset = quantize_imgs(imgs, quantization)
+    reconstructed = dequantize_imgs(quantized, scale, offset)
+
+    np.testing.assert_array_equal(np.isnan(reconstructed), np.isnan(imgs))
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from dataloader.samplers import FireLocalitySampler, SizeBucketBatchSampler
+
+# Fires with 5, 0, 7, 1 and 0 samples
+FIRE_END_OFFSETS = np.array([5, 5, 12, 13, 13])
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 100])
+def test_fire_locality_sampler_yields_a_permutation(block_size):
+    sampler = FireLocalitySampler(SimpleNamespace(fire_end_offsets=FIRE_END_OFFSETS), block_size=block_size, seed=0)
+    for _ in range(3):
+        indices = list(sampler)
+        assert len(indices) == len(sampler) == 13
+        assert sorted(indices) == list(range(13))
+
+
+def test_fire_locality_sampler_keeps_blocks_together():
+    sampler = FireLocalitySampler(SimpleNamespace(fire_end_offsets=FIRE_END_OFFSETS), block_size=3, seed=0)
+    indices = list(sampler)
+    # Blocks never span two fires, so the last block of a fire may be shorter. Each block is yielded at once.
+    for start, end in [(0, 3), (3, 5), (5, 8), (8, 11), (11, 12), (12, 13)]:
+        positions = sorted(indices.index(index) for index in range(start, end))
+        assert positions == list(range(positions[0], positions[0] + end - start))
+
+
+def test_fire_locality_sampler_order_depends_on_seed_and_epoch():
+    dataset = SimpleNamespace(fire_end_offsets=FIRE_END_OFFSETS)
+    sampler = FireLocalitySampler(dataset, block_size=2, seed=0)
+    sampler.set_epoch(1)
+    first = list(sampler)
+    sampler.set_epoch(1)
+    assert list(sampler) == first
+    sampler.set_epoch(2)
+    assert list(sampler) != first
+    assert list(FireLocalitySampler(dataset, block_size=2, seed=1)) != list(FireLocalitySampler(dataset, block_size=2, seed=0))
+
+
+def test_size_bucket_batch_sampler_batches_every_sample_once():
+    shapes = np.array([[64, 64], [32, 96], [64, 64], [64, 64], [32, 96], [96, 32], [64, 64], [64, 64], [32, 96]])
+    sampler = SizeBucketBatchSampler(SimpleNamespace(get_sample_shapes=lambda: shapes), batch_size=2)
+    batches = list(sampler)
+
+    assert len(batches) == len(sampler)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(shapes)))
+    assert all(len(batch) <= 2 for batch in batches)
+    # Only the leftover samples of each size are batched with samples of another size
+    mixed_batches = [batch for batch in batches if len({tuple(shapes[index]) for index in batch}) > 1]
+    assert len(mixed_batches) <= 2
+    assert batches == list(sampler)
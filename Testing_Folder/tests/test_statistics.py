@@ -0,0 +1,85 @@
+import h5py
+import numpy as np
+import pytest
+
+from dataloader.statistics import ChannelStatistics, get_year_fingerprint, load_cached_statistics, update_statistics_cache
+
+N_CHANNELS = 4
+
+
+def make_fire(rng, n_days, H, W):
+    # Channels with different offsets and scales, and missing values. The last channel is missing on all days of some fires.
+    imgs = rng.normal(size=(n_days, N_CHANNELS, H, W)) * [[[[1]], [[100]], [[0.01]], [[5]]]] + [[[[0]], [[3000]], [[1]], [[-7]]]]
+    imgs[rng.random(imgs.shape) < 0.1] = np.nan
+    if rng.random() < 0.5:
+        imgs[:, -1] = np.nan
+    return imgs.astype(np.float32)
+
+
+def make_years(seed=0):
+    rng = np.random.default_rng(seed)
+    return {year: [make_fire(rng, int(rng.integers(1, 5)), int(rng.integers(3, 9)), int(rng.integers(3, 9)))
+                   for _ in range(3)]
+            for year in [2018, 2019, 2020]}
+
+
+def accumulate(fires):
+    statistics = ChannelStatistics(N_CHANNELS)
+    for imgs in fires:
+        fire_statistics = ChannelStatistics(N_CHANNELS)
+        fire_statistics.update(imgs)
+        # Fire statistics are sent between processes in serialized form
+        statistics.merge(ChannelStatistics.from_dict(fire_statistics.to_dict()))
+    return statistics
+
+
+def reference_statistics(fires):
+    """_summary_ Statistics over all pixels of the concatenated fires, per channel.
+    """
+    pixels = np.concatenate([imgs.transpose(1, 0, 2, 3).reshape(N_CHANNELS, -1) for imgs in fires], axis=1).astype(np.float64)
+    means, stds = np.zeros(N_CHANNELS), np.zeros(N_CHANNELS)
+    for c, channel in enumerate(pixels):
+        values = channel[~np.isnan(channel)]
+        if values.size > 0:
+            means[c], stds[c] = np.mean(values), np.std(values)
+    return means, stds, np.isnan(pixels).mean(axis=1)
+
+
+@pytest.mark.parametrize("years", [[2018], [2018, 2019], [2019, 2020], [2018, 2019, 2020]])
+def test_merged_statistics_match_concatenated_years(years):
+    fires_per_year = make_years()
+    # Merged per year first, then across years, as load_cached_statistics does
+    statistics = None
+    for year in years:
+        year_statistics = accumulate(fires_per_year[year])
+        if statistics is None:
+            statistics = year_statistics
+        else:
+            statistics.merge(year_statistics)
+
+    means, stds, missing_values = reference_statistics([imgs for year in years for imgs in fires_per_year[year]])
+    np.testing.assert_allclose(statistics.means, means, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(statistics.stds, stds, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(statistics.missing_values, missing_values, rtol=1e-6)
+
+
+def test_cached_statistics_of_any_year_combination(tmp_path):
+    fires_per_year = make_years(seed=1)
+    data_dir = str(tmp_path)
+    for year, fires in fires_per_year.items():
+        (tmp_path / str(year)).mkdir()
+        for i, imgs in enumerate(fires):
+            with h5py.File(tmp_path / str(year) / f"fire_{i}.hdf5", "w") as f:
+                dset = f.create_dataset("data", data=imgs)
+                dset.attrs["img_dates"] = [f"{year}-07-{day + 1:02d}" for day in range(len(imgs))]
+
+    fingerprints = {year: get_year_fingerprint(data_dir, year, "hdf5") for year in fires_per_year}
+    update_statistics_cache(data_dir, "hdf5", {year: accumulate(fires) for year, fires in fires_per_year.items()}, fingerprints)
+
+    statistics = load_cached_statistics(data_dir, [2020, 2018], "hdf5")
+    means, stds, missing_values = reference_statistics(fires_per_year[2020] + fires_per_year[2018])
+    np.testing.assert_allclose(statistics.means, means, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(statistics.stds, stds, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(statistics.missing_values, missing_values, rtol=1e-6)
+    # Years without cached statistics can't be served from the cache
+    assert load_cached_statistics(data_dir, [2018, 2021], "hdf5") is None
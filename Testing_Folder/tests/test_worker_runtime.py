@@ -0,0 +1,29 @@
+import os
+
+import torch
+import yaml
+
+from dataloader.worker_runtime import get_dataloader_kwargs, init_worker
+
+
+def test_defaults_keep_the_dataloader_behaviour():
+    kwargs = get_dataloader_kwargs(num_workers=2)
+    assert kwargs["persistent_workers"] is False
+    assert "prefetch_factor" not in kwargs
+    assert kwargs["worker_init_fn"].keywords["threads_per_worker"] is None
+
+
+def test_init_worker_without_threads_per_worker_keeps_torch_threads():
+    n_threads = torch.get_num_threads()
+    init_worker(0, num_workers=2)
+    assert torch.get_num_threads() == n_threads
+
+
+def test_shipped_data_configs_use_the_defaults():
+    cfgs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cfgs")
+    for name in ["data_monotemporal_full_features.yaml", "data_multitemporal_full_features copy.yaml"]:
+        with open(os.path.join(cfgs_dir, name)) as f:
+            config = yaml.safe_load(f)
+        assert config["persistent_workers"] is False
+        assert config["prefetch_factor"] is None
+        assert config["worker_threads"] is None